@@ -6,13 +6,6 @@ import os
 import pprint
 import re
 
-import pandas as pd
-import plotly
-import plotly.graph_objs as go
-from docopt import docopt
-from matplotlib import cm
-from matplotlib.colors import rgb2hex
-from munkres import Munkres
 from operator import itemgetter
 
 import commonFunctions
@@ -29,6 +22,8 @@ class Block:
     :ivar lineNum: The line number in the sequence of blocks.
     :ivar blockJson: The representation of a parsed block  in JSON. 
     :ivar action: Whether its a permit or deny block.
+    :ivar lineHashes: The hash of every line without its line number.
+    :ivar hash: The hash of the action and the lines of the block.
     """
 
     def __init__(self, lineNum, action, blockJson):
@@ -40,6 +35,17 @@ class Block:
             line[LINENUM] = lineNum[0]
             lineNum[0] += 1
             self.lines.append(line)
+        self.rehash()
+
+    def __setstate__(self, state):
+        # String hashes differ between interpreters, so unpickled and copied blocks hash their content again.
+        self.__dict__.update(state)
+        self.rehash()
+
+    def rehash(self):
+        """Recomputes the content hashes of the lines and of the block, to be called whenever the lines change."""
+        self.lineHashes = [commonFunctions.LineHash(line, LINENUM) for line in self.lines]
+        self.hash = hash((self.action["type"], tuple(self.lineHashes)))
 
 
 class ACL:
@@ -273,7 +279,16 @@ class ACL:
         return line
 
 
-def GetBlockSequence(device, deviceInfo, pattern, foundDevices, emptyDefDevices, exactDefMatchMap):
+def NormalForm(ACLJson):
+    """ Returns the canonical form of the ACL that is parsed and compared for exact equality: only the action and
+    the match condition of every line, without the line texts (which carry the sequence numbers) and trace elements.
+    """
+    return {"lines": [{"action": line["action"],
+                       "matchCondition": commonFunctions.WithoutKeys(line["matchCondition"], ("traceElement",))}
+                      for line in ACLJson["lines"]]}
+
+
+def GetBlockSequence(device, deviceInfo, pattern, foundDevices, emptyDefDevices, exactDefMatchMap, segmentCache=None):
     """ Generates block sequence for ACL from the parsed JSON object.
     
     :ivar device: The name of the device.
@@ -281,7 +296,8 @@ def GetBlockSequence(device, deviceInfo, pattern, foundDevices, emptyDefDevices,
     :ivar pattern: The ACL pattern that is templated.
     :ivar foundDevices: The set of devices which have at least one ACL matching the pattern.
     :ivar emptyDefDevices: The set of devices that have an empty definition for the ACL.
-    :ivar exactDefMatchMap: The bookkeeping used for exact equality optimization. 
+    :ivar exactDefMatchMap: The ExactMatchMap used for exact equality optimization.
+    :ivar segmentCache: The SegmentCache to load already parsed ACLs from (if any).
     """
     patternMatchSegments = []
     patternMatchSegmentsLineCounts = []
@@ -293,16 +309,30 @@ def GetBlockSequence(device, deviceInfo, pattern, foundDevices, emptyDefDevices,
                     rname = device + "#" + segmentName
                 else:
                     rname = device
-                parsedSegment = ACL(
-                    segmentName, rname, segments[segmentName], deviceInfo['configurationFormat'])
+                definition = NormalForm(segments[segmentName])
+                digest = commonFunctions.CanonicalDigest(definition)
+                if digest in exactDefMatchMap.emptyDigests:
+                    emptyDefDevices.add(rname)
+                    continue
+                # Identical definitions are only parsed once, for the representative of their group.
+                if exactDefMatchMap.addDuplicate(digest, rname):
+                    foundDevices.add(rname)
+                    continue
+                if segmentCache:
+                    parsedSegment = segmentCache.Parse(
+                        ACL, segmentName, rname, definition, deviceInfo['configurationFormat'], digest)
+                else:
+                    parsedSegment = ACL(
+                        segmentName, rname, definition, deviceInfo['configurationFormat'])
                 if len(parsedSegment.blocks) > 0 and len(parsedSegment.blocks[0].lines) > 0:
                     foundDevices.add(rname)
-                    if not commonFunctions.checkJSONEquality(exactDefMatchMap, segments[segmentName], rname):
-                        # Last block's last line's (-1) attribute.
-                        totalLines = parsedSegment.blocks[-1].lines[-1][LINENUM]
-                        patternMatchSegments.append(parsedSegment)
-                        patternMatchSegmentsLineCounts.append(totalLines)
+                    exactDefMatchMap.addRepresentative(digest, rname, definition)
+                    # Last block's last line's (-1) attribute.
+                    totalLines = parsedSegment.blocks[-1].lines[-1][LINENUM]
+                    patternMatchSegments.append(parsedSegment)
+                    patternMatchSegmentsLineCounts.append(totalLines)
                 else:
+                    exactDefMatchMap.emptyDigests.add(digest)
                     emptyDefDevices.add(rname)
     return patternMatchSegments, patternMatchSegmentsLineCounts
 
@@ -317,6 +347,23 @@ def LineSequence(block):
     return block.lines
 
 
+def LineNumber(line):
+    """Returns the line number of a line."""
+    return line[LINENUM]
+
+
+def ScoreLowerBound(block1, block2):
+    """Returns a lower bound of the MisMatchScore of two blocks, the penalty of the lines that are left unmatched."""
+    if block1.action["type"] != block2.action["type"]:
+        return commonFunctions.INFINITY
+    return LINE_PENALTY*abs(len(block1.lines) - len(block2.lines))
+
+
+def BlockDigest(block):
+    """Returns a digest of the action and lines of the block, leaving out the line numbers."""
+    return PrefixList.BlockDigest(block)
+
+
 def LineScore(templateLine, deviceLine, paramValueMap):
     """Returns the score for matching the line from the metatemplate with a line from the device."""
     # Return infinity if the protocols of the lines do not match
@@ -335,15 +382,26 @@ def LineScore(templateLine, deviceLine, paramValueMap):
     return score
 
 
-def BipartiteMatching(LS1, LS2, paramValueMap, noOfAttributes):
+def BipartiteMatching(LS1, LS2, paramValueMap, noOfAttributes, lineHashes1=None, lineHashes2=None, solver=None,
+                      approxThreshold=0, window=0):
     """ Score and matching calculator for matching LineSequence1 with LineSequence2."""
 
-    return PrefixList.BipartiteMatching(LS1, LS2, paramValueMap, noOfAttributes)
+    return PrefixList.BipartiteMatching(LS1, LS2, paramValueMap, noOfAttributes, lineHashes1, lineHashes2, solver,
+                                        approxThreshold, window)
 
 
-def TemplateGenerator(block1Alignment, block2Alignment, lineMatchings, parametersLines, device, noOfAttributes):
+def TemplateGenerator(block1Alignment, block2Alignment, lineMatchings, parametersLines, device, noOfAttributes, deviceLineMap=None):
     """ Given the alignment and line matchings the function returns the merged terms."""
-    return PrefixList.TemplateGenerator(block1Alignment, block2Alignment, lineMatchings, parametersLines, device, noOfAttributes)
+    return PrefixList.TemplateGenerator(block1Alignment, block2Alignment, lineMatchings, parametersLines, device, noOfAttributes, deviceLineMap)
+
+
+def ReorderMerge(metaTemplate, segment, parametersLines, device):
+    """Merges a segment that only reorders the lines of the template blocks without aligning them (if possible)."""
+    return PrefixList.ReorderMerge(metaTemplate, segment, parametersLines, device)
+
+
+def RenameParameters(metaTemplate, renameMap, noOfAttributes):
+    PrefixList.RenameParameters(metaTemplate, renameMap, noOfAttributes)
 
 
 def MinimizeParameters(metaTemplate, parametersLines, noOfAttributes):
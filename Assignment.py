@@ -0,0 +1,239 @@
+import collections
+import math
+
+# The assignment solver used when none is asked for.
+DEFAULT_SOLVER = "lapjv"
+# The number of assignments each solver made, and the total cost and lower bound of the approximate ones.
+ASSIGNMENT_STATS = collections.Counter()
+# The last bidding increment of the approximate assignment, and the factor it is lowered by in every phase.
+FINAL_EPSILON = 1.0
+EPSILON_FACTOR = 4.0
+# Smaller cost matrices are solved with plain Python lists, the numpy calls cost more than they save on them.
+MIN_ARRAY_CELLS = 3600
+
+
+class ShortestAugmentingPath:
+    """ Solves the rectangular assignment problem in the way of Jonker-Volgenant: the rows start at their cheapest column
+    when it is still free, and every other row is assigned along a shortest augmenting path found with Dijkstra on the
+    reduced costs. On large matrices all the columns at the same distance are scanned at once with numpy, so cost
+    matrices with few distinct values need only a few steps per row, and the arrays are kept between the calls and only
+    grown for larger matrices. Small matrices are solved one column at a time on lists.
+
+    :ivar rows: The number of rows the row buffers can hold.
+    :ivar columns: The number of columns the column buffers can hold.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.columns = 0
+
+    def buffers(self, n, m):
+        """Returns the row potentials and columns, and the column potentials, distances, scanned flags, path rows and rows."""
+        import numpy
+        if n > self.rows:
+            self.rows = max(n, 2*self.rows)
+            self.u = numpy.empty(self.rows)
+            self.rowColumn = numpy.empty(self.rows, dtype=numpy.int64)
+        if m > self.columns:
+            self.columns = max(m, 2*self.columns)
+            self.v = numpy.empty(self.columns)
+            self.distance = numpy.empty(self.columns)
+            self.scanned = numpy.empty(self.columns, dtype=bool)
+            self.way = numpy.empty(self.columns, dtype=numpy.int64)
+            self.columnRow = numpy.empty(self.columns, dtype=numpy.int64)
+        return (self.u[:n], self.rowColumn[:n], self.v[:m], self.distance[:m], self.scanned[:m], self.way[:m],
+                self.columnRow[:m])
+
+    def compute(self, matrix):
+        """Returns the (row, column) pairs of a minimum cost assignment of the cost matrix, sorted by row."""
+        if not matrix or not matrix[0]:
+            return []
+        transposed = len(matrix) > len(matrix[0])
+        if len(matrix)*len(matrix[0]) < MIN_ARRAY_CELLS:
+            rowColumn = self.solveLists([list(column) for column in zip(*matrix)] if transposed else matrix)
+        else:
+            import numpy
+            cost = numpy.asarray(matrix, dtype=float)
+            rowColumn = self.solveArrays(cost.T if transposed else cost)
+        pairs = [(i, int(j)) for i, j in enumerate(rowColumn)]
+        if transposed:
+            pairs = [(j, i) for i, j in pairs]
+        return sorted(pairs)
+
+    def solveLists(self, cost):
+        """Returns the column of every row of a cost matrix with no more rows than columns."""
+        n, m = len(cost), len(cost[0])
+        u = [0]*n
+        v = [0]*m
+        rowColumn = [-1]*n
+        columnRow = [-1]*m
+        way = [0]*m
+        for free in range(n):
+            treeRows = [free]
+            distance = [math.inf]*m
+            scanned = [False]*m
+            i = free
+            while True:
+                # Relax the columns from the row that joined the tree and find the closest column left.
+                row, ui = cost[i], u[i]
+                delta, j = math.inf, -1
+                for k in range(m):
+                    if not scanned[k]:
+                        reduced = row[k] - ui - v[k]
+                        if reduced < distance[k]:
+                            distance[k] = reduced
+                            way[k] = i
+                        if distance[k] < delta:
+                            delta, j = distance[k], k
+                for t in treeRows:
+                    u[t] += delta
+                for k in range(m):
+                    if scanned[k]:
+                        v[k] -= delta
+                    else:
+                        distance[k] -= delta
+                if columnRow[j] == -1:
+                    break
+                scanned[j] = True
+                i = columnRow[j]
+                treeRows.append(i)
+            # Flip the assignment along the path back to the free row.
+            while True:
+                i = way[j]
+                columnRow[j] = i
+                j, rowColumn[i] = rowColumn[i], j
+                if i == free:
+                    break
+        return rowColumn
+
+    def solveArrays(self, cost):
+        """Returns the column of every row of a cost matrix (numpy array) with no more rows than columns."""
+        import numpy
+        n, m = cost.shape
+        u, rowColumn, v, distance, scanned, way, columnRow = self.buffers(n, m)
+        # Row reduction, every row takes its cheapest column unless an earlier row already did.
+        u[:] = cost.min(axis=1)
+        v[:] = 0
+        rowColumn[:] = -1
+        columnRow[:] = -1
+        for i, j in enumerate(cost.argmin(axis=1)):
+            if columnRow[j] == -1:
+                columnRow[j] = i
+                rowColumn[i] = j
+        for free in numpy.flatnonzero(rowColumn[:n] == -1):
+            treeRows = [free]
+            distance[:] = cost[free] - u[free] - v
+            way[:] = free
+            scanned[:] = False
+            while True:
+                delta = numpy.where(scanned, math.inf, distance).min()
+                # Shift the potentials so that the closest columns are reached at a reduced cost of 0.
+                u[treeRows] += delta
+                v[scanned] -= delta
+                distance[~scanned] -= delta
+                reached = ~scanned & (distance <= 0)
+                ends = numpy.flatnonzero(reached & (columnRow == -1))
+                if len(ends):
+                    j = ends[0]
+                    break
+                scanned |= reached
+                newRows = columnRow[reached]
+                treeRows.extend(newRows)
+                reduced = cost[newRows] - u[newRows][:, None] - v
+                closest = reduced.argmin(axis=0)
+                reducedMin = reduced[closest, numpy.arange(m)]
+                shorter = ~scanned & (reducedMin < distance)
+                distance[shorter] = reducedMin[shorter]
+                way[shorter] = newRows[closest[shorter]]
+            # Flip the assignment along the path back to the free row.
+            while True:
+                i = way[j]
+                columnRow[j] = i
+                j, rowColumn[i] = rowColumn[i], j
+                if i == free:
+                    break
+        return rowColumn
+
+
+def MunkresAssignment(matrix):
+    """Returns the (row, column) pairs of a minimum cost assignment computed by the munkres package."""
+    from munkres import Munkres
+    return Munkres().compute(matrix)
+
+
+def ApproximateAssignment(matrix):
+    """ Returns the (row, column) pairs of an assignment of the cost matrix found by an auction with epsilon scaling,
+    along with a lower bound of the optimal cost. All the unassigned rows bid at once for their cheapest column by how
+    much more their second cheapest column costs plus epsilon, and the highest bid raises the price of the column.
+    Every phase starts over with the prices of the last one and a smaller epsilon down to the FINAL_EPSILON, which leaves
+    the assignment at most FINAL_EPSILON per row or column, whichever are more, above the optimum. The prices give the
+    lower bound.
+    """
+    import numpy
+    cost = numpy.asarray(matrix, dtype=float)
+    if cost.ndim != 2 or cost.size == 0:
+        return [], 0
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    rows = cost.shape[0]
+    # Free rows of zero cost take the columns left over, the auction is only near optimal on square matrices.
+    cost = numpy.vstack([cost, numpy.zeros((cost.shape[1] - rows, cost.shape[1]))])
+    n, m = cost.shape
+    prices = numpy.zeros(m)
+    epsilon = max((cost.max() - cost.min())/EPSILON_FACTOR, FINAL_EPSILON)
+    while True:
+        rowColumn = numpy.full(n, -1, dtype=numpy.int64)
+        columnRow = numpy.full(m, -1, dtype=numpy.int64)
+        free = numpy.arange(n)
+        while len(free):
+            values = cost[free] + prices
+            best = values.argmin(axis=1)
+            if m > 1:
+                cheapest = numpy.partition(values, 1, axis=1)
+                bids = cheapest[:, 1] - cheapest[:, 0] + epsilon
+            else:
+                bids = numpy.full(len(free), epsilon)
+            # Only the highest bid for every column is taken.
+            order = numpy.lexsort((-bids, best))
+            highest = numpy.ones(len(order), dtype=bool)
+            highest[1:] = best[order[1:]] != best[order[:-1]]
+            winners, columns = free[order[highest]], best[order[highest]]
+            prices[columns] += bids[order[highest]]
+            outbid = columnRow[columns]
+            rowColumn[outbid[outbid >= 0]] = -1
+            columnRow[columns] = winners
+            rowColumn[winners] = columns
+            free = numpy.flatnonzero(rowColumn == -1)
+        if epsilon <= FINAL_EPSILON:
+            break
+        epsilon = max(epsilon/EPSILON_FACTOR, FINAL_EPSILON)
+    # The prices are a feasible dual solution once every row takes its cheapest column at those prices.
+    lowerBound = (cost + prices).min(axis=1).sum() - prices.sum()
+    pairs = [(i, int(j)) for i, j in enumerate(rowColumn[:rows])]
+    if transposed:
+        pairs = [(j, i) for i, j in pairs]
+    return sorted(pairs), float(lowerBound)
+
+
+# The solvers agree on the optimal cost but not on which of several equally cheap assignments they return.
+SOLVERS = {"lapjv": ShortestAugmentingPath().compute, "munkres": MunkresAssignment}
+
+
+def Assign(matrix, solver=None, approxThreshold=0):
+    """ Returns the (row, column) pairs of a minimum cost assignment of the rows of the cost matrix (a list of lists) to
+    its columns, min(rows, columns) pairs in all. The matrices with more rows or columns than the approxThreshold get
+    the ApproximateAssignment instead, and its cost and lower bound are added to the ASSIGNMENT_STATS.
+
+    :ivar solver: The name of the solver in SOLVERS, DEFAULT_SOLVER when not given.
+    :ivar approxThreshold: The most rows or columns solved exactly, 0 to always solve exactly.
+    """
+    if approxThreshold and matrix and max(len(matrix), len(matrix[0])) > approxThreshold:
+        pairs, lowerBound = ApproximateAssignment(matrix)
+        ASSIGNMENT_STATS["approximate"] += 1
+        ASSIGNMENT_STATS["approximateCost"] += sum(matrix[i][j] for i, j in pairs)
+        ASSIGNMENT_STATS["lowerBound"] += lowerBound
+        return pairs
+    solver = solver or DEFAULT_SOLVER
+    ASSIGNMENT_STATS[solver] += 1
+    return SOLVERS[solver](matrix)
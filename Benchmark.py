@@ -0,0 +1,221 @@
+import re
+import subprocess
+import sys
+import time
+
+from docopt import docopt
+
+doc = """
+Micro benchmarks for the different stages of SelfStarter.
+
+Usage:
+    Benchmark.py startup [--repeat=<n>]
+    Benchmark.py fetch <answerFile> [--batch=<b>] [--workers=<w>] [--latency=<ms>]
+    Benchmark.py ordering <directory> [--kind=<k>]
+    Benchmark.py assignment [--sizes=<s>] [--count=<c>] [--seed=<sd>]
+    Benchmark.py engines <directory> [--kind=<k>] [--engine=<en>] [--workers=<w>]
+
+Options:
+    -h --help           Show this help screen.
+    --repeat=<n>        Number of fresh interpreters timed per measurement [default: 5].
+    --batch=<b>         Number of nodes per viModel request [default: 50].
+    --workers=<w>       Number of concurrent viModel requests, or of processes of the templating engine [default: 4].
+    --latency=<ms>      Extra delay per requested node of the stand-in server in milliseconds [default: 0].
+    --kind=<k>          The kind of segments templated, ACLs, PrefixLists or RoutePolicies [default: ACLs].
+    --sizes=<s>         Comma separated sizes of the square cost matrices solved [default: 3,10,30,100,300].
+    --count=<c>         Number of random cost matrices of every size [default: 20].
+    --seed=<sd>         Seed of the random cost matrices [default: 0].
+    --engine=<en>       The templating engine compared with the sequential one, mapreduce or centerstar [default: mapreduce].
+"""
+
+
+def Timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+HEAVY_MODULES = ("pandas", "plotly", "matplotlib", "munkres", "numpy", "pybatfish")
+STARTUP_MODULES = ("commonFunctions", "ACL", "PrefixList",
+                   "RoutePolicy", "MetaTemplater", "main")
+
+
+def BenchmarkStartup(repeat):
+    """Reports the best time of importing every module and of running the statistics subcommand in fresh interpreters,
+    along with the heavy dependencies each of them pulls in."""
+    import tempfile
+    report = "; print('loaded:' + ','.join(m for m in {} if m in sys.modules))".format(HEAVY_MODULES)
+    snippets = [("import " + module, "import sys; import " + module + report)
+                for module in STARTUP_MODULES]
+    snippets.append(("main.py statistics", "import runpy, sys; sys.argv = ['main.py', 'statistics', '--inputDir={}'];"
+                     " runpy.run_path('main.py', run_name='__main__')".format(tempfile.mkdtemp()) + report))
+    for name, snippet in snippets:
+        timings = list()
+        for _ in range(repeat):
+            result, elapsed = Timed(lambda: subprocess.run(
+                [sys.executable, "-c", snippet], stdout=subprocess.PIPE, stderr=subprocess.PIPE))
+            if result.returncode != 0:
+                raise RuntimeError(name + " failed:\n" + result.stderr.decode())
+            timings.append(elapsed)
+        loaded = [line for line in result.stdout.decode().splitlines()
+                  if line.startswith("loaded:")][-1][len("loaded:"):]
+        print("{:<22} best {:.3f}s  heavy modules loaded: {}".format(
+            name, min(timings), loaded or "none"))
+
+
+def BenchmarkFetch(answerFile, batchSize, workers, latency):
+    """Compares a single viModel request against concurrent batched requests on a StandInServer replaying the answerFile."""
+    import NodeFetcher
+    import StandInServer
+
+    nodes = StandInServer.LoadRecordedNodes(answerFile)
+    server = StandInServer.StartServer(nodes, latency=latency)
+    url = "http://127.0.0.1:{}".format(server.server_port)
+    allNodes = re.compile(".*")
+    try:
+        single, singleTime = Timed(lambda: dict(NodeFetcher.FetchNodes(
+            NodeFetcher.HttpAnswerSource(url), allNodes, 0, 1)))
+        batched, batchedTime = Timed(lambda: dict(NodeFetcher.FetchNodes(
+            NodeFetcher.HttpAnswerSource(url), allNodes, batchSize, workers)))
+    finally:
+        server.shutdown()
+    if single != batched:
+        raise ValueError("The batched fetch returned different node models")
+    print("{} nodes: single request {:.3f}s, batches of {} with {} workers {:.3f}s".format(
+        len(batched), singleTime, batchSize, workers, batchedTime))
+
+
+def TemplateWidth(metaTemplate, GetLineSequence):
+    """Returns the number of lines of the metaTemplate, counting the guard and true cmds of the route policy terms."""
+    width = 0
+    for block in metaTemplate.blocks:
+        lines = GetLineSequence(block)
+        width += sum(len(l) for l in lines) if lines and isinstance(lines[0], list) else len(lines)
+    return width
+
+
+def BenchmarkOrdering(directory, kind):
+    """Templates every segment name of the kind in the natively parsed directory in the frequency and in the similarity
+    order and reports the total width of the templates and the total time spent merging the segments."""
+    import main
+    import MetaTemplater
+    import NativeParser
+    import commonFunctions
+
+    _, segmentType, functions = main.SEGMENT_KINDS[kind]
+    nodes = NativeParser.ParseDirectory(directory, re.compile(".*"))
+    _, segmentIndex = main.ExtractSegments(nodes.items(), {kind: segmentType})[kind]
+    totals = {}
+    for ordering in ("frequency", "similarity"):
+        width = elapsed = 0
+        for name, candidates in segmentIndex.items():
+            lineCountMap = {}
+            for device, deviceInfo in candidates:
+                segments, lineCounts = functions["GetBlockSequence"](device, deviceInfo, re.compile(re.escape(name) + "$"),
+                                                                     set(), set(), commonFunctions.ExactMatchMap())
+                for segment, lineCount in zip(segments, lineCounts):
+                    lineCountMap.setdefault(lineCount, list()).append(segment)
+            if not lineCountMap:
+                continue
+            (metaTemplate, _, _), seconds = Timed(lambda: MetaTemplater.TemplateSegments(
+                MetaTemplater.OrderedSegments(lineCountMap, ordering), **functions))
+            width += TemplateWidth(metaTemplate, functions["GetLineSequence"])
+            elapsed += seconds
+        totals[ordering] = (width, elapsed)
+        print("{:<10} ordering: {} template lines over {} {}, merged in {:.3f}s".format(
+            ordering, width, len(segmentIndex), kind, elapsed))
+    (frequencyWidth, frequencyTime), (similarityWidth, similarityTime) = totals["frequency"], totals["similarity"]
+    print("similarity/frequency: width {:.2f}x, time {:.2f}x".format(
+        similarityWidth/max(frequencyWidth, 1), similarityTime/max(frequencyTime, 1e-9)))
+
+
+def TemplatedGroups(nodes, segmentType, functions, kind, Template):
+    """ Templates every segment name of the kind found in the nodes with the Template function, a TemplateSegments
+    alike, and returns the time spent and the groups of devices found for every name, largest first."""
+    import main
+    import MetaTemplater
+    import commonFunctions
+
+    _, segmentIndex = main.ExtractSegments(nodes.items(), {kind: segmentType})[kind]
+    groups = {}
+    elapsed = 0
+    for name, candidates in segmentIndex.items():
+        lineCountMap = {}
+        exactDefMatchMap = commonFunctions.ExactMatchMap()
+        for device, deviceInfo in candidates:
+            segments, lineCounts = functions["GetBlockSequence"](device, deviceInfo, re.compile(re.escape(name) + "$"),
+                                                                 set(), set(), exactDefMatchMap)
+            for segment, lineCount in zip(segments, lineCounts):
+                lineCountMap.setdefault(lineCount, list()).append(segment)
+        if not lineCountMap:
+            continue
+        (metaTemplate, parametersLines, _), seconds = Timed(lambda: Template(
+            MetaTemplater.OrderedSegments(lineCountMap), **functions))
+        elapsed += seconds
+        MetaTemplater.ShutdownWorkerPools()
+        functions["MinimizeParameters"](metaTemplate, parametersLines, functions["NumberOfAttributes"])
+        parametersLines.addExactRouters(exactDefMatchMap)
+        groups[name] = sorted((sorted(devices) for _, devices in parametersLines.groupsList), key=len, reverse=True)
+    return groups, elapsed
+
+
+def BenchmarkEngines(directory, kind, engine, workers):
+    """Templates every segment name of the kind in the natively parsed directory with the sequential engine and with the
+    given one, reports the time both take and lists the names whose groups of devices differ."""
+    import functools
+    import main
+    import MetaTemplater
+    import NativeParser
+
+    _, segmentType, functions = main.SEGMENT_KINDS[kind]
+    nodes = NativeParser.ParseDirectory(directory, re.compile(".*"))
+    engines = {"mapreduce": MetaTemplater.MapReduceTemplates, "centerstar": MetaTemplater.CenterStarTemplates}
+    sequential, sequentialTime = TemplatedGroups(nodes, segmentType, functions, kind, MetaTemplater.TemplateSegments)
+    parallel, parallelTime = TemplatedGroups(nodes, segmentType, functions, kind,
+                                             functools.partial(engines[engine], workers=workers))
+    differing = [name for name in sorted(sequential) if sequential[name] != parallel[name]]
+    print("sequential {:.3f}s, {} with {} workers {:.3f}s".format(sequentialTime, engine, workers, parallelTime))
+    print("{} of {} {} have the same groups as the sequential engine".format(
+        len(sequential) - len(differing), len(sequential), kind))
+    for name in differing:
+        print("{}: group sizes {} sequential, {} {}".format(
+            name, [len(group) for group in sequential[name]], [len(group) for group in parallel[name]], engine))
+
+
+def RandomCostMatrix(rng, rows, columns):
+    """Returns a cost matrix like the line scores of two ACL blocks, small attribute penalties and some INFINITY."""
+    import commonFunctions
+    return [[commonFunctions.INFINITY if rng.random() < 0.1 else 2*rng.randint(0, 20) - rng.randint(0, 1)
+             for _ in range(columns)] for _ in range(rows)]
+
+
+def BenchmarkAssignment(sizes, count, seed):
+    """ Reports the time each assignment solver takes per random square cost matrix of every size. That the solvers find
+    the same optimal cost is checked by tests/test_assignment.py."""
+    import random
+    import Assignment
+
+    rng = random.Random(seed)
+    for size in sizes:
+        matrices = [RandomCostMatrix(rng, size, size) for _ in range(count)]
+        times = {name: Timed(lambda: [Assignment.Assign(matrix, name) for matrix in matrices])[1]/count
+                 for name in Assignment.SOLVERS}
+        print("{:>4}x{:<4} ".format(size, size) + "  ".join(
+            "{} {:.5f}s".format(name, elapsed) for name, elapsed in times.items()) +
+            "  munkres/lapjv {:.1f}x".format(times["munkres"]/max(times["lapjv"], 1e-9)))
+
+
+if __name__ == '__main__':
+    arguments = docopt(doc)
+    if arguments["startup"]:
+        BenchmarkStartup(int(arguments["--repeat"]))
+    if arguments["fetch"]:
+        BenchmarkFetch(arguments["<answerFile>"], int(arguments["--batch"]), int(arguments["--workers"]),
+                       int(arguments["--latency"])/1000.0)
+    if arguments["ordering"]:
+        BenchmarkOrdering(arguments["<directory>"], arguments["--kind"])
+    if arguments["assignment"]:
+        BenchmarkAssignment([int(size) for size in arguments["--sizes"].split(",")], int(arguments["--count"]),
+                            int(arguments["--seed"]))
+    if arguments["engines"]:
+        BenchmarkEngines(arguments["<directory>"], arguments["--kind"], arguments["--engine"], int(arguments["--workers"]))
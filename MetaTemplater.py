@@ -1,15 +1,35 @@
 import argparse
+import array
 import collections
 import copy
 import json
 import os
 import pprint
+import random
 import re
 import statistics
+from concurrent.futures import ProcessPoolExecutor
 
+import Assignment
 import commonFunctions
 # import RoutePolicy
 
+# The hits and misses of the ScoreCaches of all the segments templated so far.
+SCORE_CACHE_STATS = collections.Counter()
+# The block pairs whose matching was skipped because their ScoreLowerBound already lost to a gap, and those matched.
+MATCHING_STATS = collections.Counter()
+# Alignments with fewer block pairs left to score are not worth handing to the worker processes.
+MIN_POOLED_PAIRS = 256
+# The smallest number of segments templated by one worker of the mapreduce engine.
+MIN_CHUNK_SEGMENTS = 8
+# The stand-in device that a partial metaTemplate is merged as, before its parameters are handed to its own devices.
+MERGED_TEMPLATE = "\0MergedTemplate"
+WORKER_POOLS = {}
+# The number of hash functions of a MinHash sketch and the number of bands they are split into to find similar segments.
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16
+MERSENNE_PRIME = (1 << 61) - 1
+
 
 def MisMatchScore(block1, block2, paramValueMap, GetLineSequence, MinimumWeightBipartiteMatching, noOfAttributes):
     """ Calculates the score and mapping of lines for matching block1 with block2.
@@ -23,121 +43,679 @@ def MisMatchScore(block1, block2, paramValueMap, GetLineSequence, MinimumWeightB
     """
     if block1.action["type"] != block2.action["type"]:
         return commonFunctions.INFINITY, []
+    elif block1.hash == block2.hash:
+        # Identical blocks match line by line without building a cost matrix.
+        return 0, commonFunctions.IdentityMatching(block1.lineHashes)
     else:
         LS1 = GetLineSequence(block1)
         LS2 = GetLineSequence(block2)
         score, matching = MinimumWeightBipartiteMatching(
-            LS1, LS2, paramValueMap, noOfAttributes)
+            LS1, LS2, paramValueMap, noOfAttributes, block1.lineHashes, block2.lineHashes)
         return score, matching
 
 
-def AlignSequences(bs1, bs2, parametersLines, **functions):
-    """ Sequence Alignment of two segments.
-    Based on : https://www.geeksforgeeks.org/sequence-alignment-problem/
+def ScorePairs(pairs, paramValueMap, GetLineSequence, MinimumWeightBipartiteMatching, noOfAttributes):
+    """Returns the MisMatchScore of every (block1, block2) pair, run by the worker processes."""
+    return [MisMatchScore(block1, block2, paramValueMap, GetLineSequence, MinimumWeightBipartiteMatching, noOfAttributes)
+            for block1, block2 in pairs]
 
-    :ivar bs1: Block Sequence 1.
-    :ivar bs2: Block Sequence 2.
-    :ivar parametersLines: The ParametersLinesMap object.
+
+def WorkerPool(work, workers):
+    """ Returns the pool of worker processes for the work ("scores" or "templates"), started on its first use and shut
+    down by ShutdownWorkerPools once the segments are templated."""
+    if work not in WORKER_POOLS:
+        WORKER_POOLS[work] = ProcessPoolExecutor(max_workers=workers)
+    return WORKER_POOLS[work]
+
+
+def ShutdownWorkerPools():
+    """Shuts down the pools of worker processes started by WorkerPool."""
+    for pool in WORKER_POOLS.values():
+        pool.shutdown()
+    WORKER_POOLS.clear()
+
+
+def PooledScores(blocks1, blocks2, paramValueMap, workers, Known, **functions):
+    """ Returns the grid of the MisMatchScore of every block of blocks1 with every block of blocks2, the pairs not already
+    Known are scored in chunks across a pool of worker processes.
+
+    :ivar workers: The number of worker processes.
+    :ivar Known: Function from a pair (i, j) to its already known score and matching or None.
     """
-    m = len(bs1.blocks)
-    n = len(bs2.blocks)
+    grid = [[Known(i, j) for j in range(len(blocks2))] for i in range(len(blocks1))]
+    missing = [(i, j) for i, row in enumerate(grid) for j, scored in enumerate(row) if scored is None]
+    if len(missing) < MIN_POOLED_PAIRS:
+        for i, j in missing:
+            grid[i][j] = MisMatchScore(blocks1[i], blocks2[j], paramValueMap, functions["GetLineSequence"],
+                                       functions["MinimumWeightBipartiteMatching"], functions["NumberOfAttributes"])
+        return grid
+    # A few chunks per worker keep all of them busy when some pairs take much longer to match than others.
+    chunkSize = -(-len(missing)//(4*workers))
+    chunks = [missing[k:k+chunkSize] for k in range(0, len(missing), chunkSize)]
+    pool = WorkerPool("scores", workers)
+    futures = [pool.submit(RunWithStatistics, ScorePairs, [(blocks1[i], blocks2[j]) for i, j in chunk], paramValueMap,
+                           functions["GetLineSequence"], functions["MinimumWeightBipartiteMatching"],
+                           functions["NumberOfAttributes"]) for chunk in chunks]
+    for chunk, scores in zip(chunks, CollectPartials(futures)):
+        for (i, j), scored in zip(chunk, scores):
+            grid[i][j] = scored
+    return grid
 
-    dp = list()
-    #
-    for _ in range(m+1):
-        tmp = list()
-        for _ in range(n+1):
-            tmp.append(commonFunctions.matrixCell())
-        dp.append(tmp)
 
-    for i in range(m+1):
-        if i > 0:
-            block = bs1.blocks[i-1]
-            dp[i][0].score = dp[i-1][0].score + functions["GapPenalty"](block)
-            dp[i][0].pointer = [0]
+# The moves of an alignment path: both blocks aligned, a gap in the first sequence, a gap in the second sequence.
+DIAGONAL = 1
+LEFT = 2
+UP = 3
 
-    for i in range(n+1):
-        if i > 0:
-            block = bs2.blocks[i-1]
-            dp[0][i].score = dp[0][i-1].score + functions["GapPenalty"](block)
-            dp[0][i].pointer = [0]
 
-    paramValueMap = parametersLines.parameterDistribution()
+def BandWindow(i, m, n, bandWidth):
+    """ Returns the first and last column computed in row i, all of them unless a bandWidth is given.
+    The band of a row starts from the diagonal of the previous row so that consecutive rows always overlap.
+    """
+    if not bandWidth or m == 0:
+        return 0, n
+    return max(0, ((i-1)*n)//m - bandWidth), min(n, -((-i*n)//m) + bandWidth)
 
-    for i in range(1, m+1):
-        for j in range(1, n+1):
-            pairScore, matchedPairs = MisMatchScore(
-                bs1.blocks[i-1], bs2.blocks[j-1], paramValueMap, functions["GetLineSequence"], functions["MinimumWeightBipartiteMatching"], functions["NumberOfAttributes"])
-            block1Gap = functions["GapPenalty"](bs1.blocks[i-1])
-            block2Gap = functions["GapPenalty"](bs2.blocks[j-1])
 
+def TableAlignmentPath(i0, i1, j0, j1, PairScore, gaps1, gaps2, bandWidth=0, matchings=None):
+    """ Returns the moves of the optimal alignment of blocks i0..i1 with blocks j0..j1.
+    The scores and pointers are kept in one flat array and bytearray per row, covering only the band when a bandWidth
+    is given, and the line matchings only of the cells reached diagonally.
+    PairScore(i, j, limit) may return infinity instead of the score of a pair that is known to be above the limit.
+    When a matchings dict is given, PairScore returns the score and the line matching of the pair, and the line
+    matchings of the pairs aligned on the path are added to the dict by their (i, j).
+    """
+    m = i1 - i0
+    n = j1 - j0
+    infinity = float("inf")
+    rows = list()
+    for i in range(m+1):
+        lo, hi = BandWindow(i, m, n, bandWidth)
+        scores = array.array("d", [infinity])*(hi - lo + 1)
+        pointers = bytearray(hi - lo + 1)
+        diagonalMatchings = {}
+        if i > 0:
+            prevLo, prevScores, _, _ = rows[-1]
+            prevHi = prevLo + len(prevScores) - 1
+        for j in range(lo, hi+1):
+            if i == 0:
+                scores[j-lo] = scores[j-lo-1] + gaps2[j0+j-1] if j > 0 else 0
+                continue
+            up = prevScores[j-prevLo] + gaps1[i0+i-1] if prevLo <= j <= prevHi else infinity
+            if j == 0:
+                scores[0] = up
+                continue
+            left = scores[j-lo-1] + gaps2[j0+j-1] if j > lo else infinity
+            diagonal = infinity
+            if prevLo <= j-1 <= prevHi and prevScores[j-1-prevLo] != infinity:
+                previous = prevScores[j-1-prevLo]
+                scored = PairScore(i0+i-1, j0+j-1, min(up, left) - previous)
+                if matchings is not None:
+                    scored, matching = scored
+                diagonal = previous + scored
             # When scores are same preference is given to diagonal (x==y) rather than a gap (x==_)
-            if dp[i-1][j-1].score + pairScore <= dp[i-1][j].score + block1Gap:
-                if dp[i-1][j-1].score + pairScore <= dp[i][j-1].score + block2Gap:
-                    dp[i][j].score = dp[i-1][j-1].score + pairScore
-                    dp[i][j].pointer = [1]
-                    dp[i][j].matchedLines = matchedPairs
+            if diagonal <= up:
+                if diagonal <= left:
+                    scores[j-lo], pointers[j-lo] = diagonal, DIAGONAL
+                    if matchings is not None and diagonal != infinity:
+                        diagonalMatchings[j] = matching
                 else:
-                    dp[i][j].score = dp[i][j-1].score + block2Gap
-                    dp[i][j].pointer = [2]
+                    scores[j-lo], pointers[j-lo] = left, LEFT
             else:
-                if dp[i-1][j].score + block1Gap <= dp[i][j-1].score + block2Gap:
-                    dp[i][j].score = dp[i-1][j].score + block1Gap
-                    dp[i][j].pointer = [3]
+                if up <= left:
+                    scores[j-lo], pointers[j-lo] = up, UP
                 else:
-                    dp[i][j].score = dp[i][j-1].score + block2Gap
-                    dp[i][j].pointer = [2]
-    l = m+n
-    i = m
-    j = n
-    xpos = l
-    ypos = l
-    block1Alignment = list()
-    block2Alignment = list()
-    lineMatchings = list()
-    while (not (i == 0 or j == 0)):
-        if dp[i][j].pointer == [1]:
-            block1Alignment.append(bs1.blocks[i-1])
-            block2Alignment.append(bs2.blocks[j-1])
-            lineMatchings.append(dp[i][j].matchedLines)
+                    scores[j-lo], pointers[j-lo] = left, LEFT
+        rows.append((lo, scores, pointers, diagonalMatchings))
+    moves = list()
+    i, j = m, n
+    while not (i == 0 or j == 0):
+        lo, _, pointers, diagonalMatchings = rows[i]
+        move = pointers[j-lo]
+        if move == DIAGONAL:
+            if j in diagonalMatchings:
+                matchings[(i0+i-1, j0+j-1)] = diagonalMatchings[j]
             i -= 1
             j -= 1
-        elif dp[i][j].pointer == [2]:
-            block1Alignment.append([])
-            block2Alignment.append(bs2.blocks[j-1])
+        elif move == LEFT:
             j -= 1
-        elif dp[i][j].pointer == [3]:
-            block1Alignment.append(bs1.blocks[i-1])
-            block2Alignment.append([])
+        elif move == UP:
             i -= 1
         else:
             raise ValueError("Undefined pointer type")
-        xpos -= 1
-        ypos -= 1
+        moves.append(move)
+    moves.extend([UP]*i + [LEFT]*j)
+    moves.reverse()
+    return moves
 
-    while xpos >= 0:
-        if i > 0:
-            block1Alignment.append(bs1.blocks[i-1])
-            i -= 1
+
+def LastRowScores(rows, columns, PairScore, gap1, gap2):
+    """ Returns the scores of aligning all the rows with the first 0..len(columns) columns, keeping a single row in memory.
+
+    :ivar rows: The block indices of the first sequence in the order they are aligned.
+    :ivar columns: The block indices of the second sequence in the order they are aligned.
+    """
+    scores = array.array("d", [0])*(len(columns) + 1)
+    for k, j in enumerate(columns):
+        scores[k+1] = scores[k] + gap2[j]
+    for i in rows:
+        diagonal = scores[0]
+        scores[0] += gap1[i]
+        for k, j in enumerate(columns):
+            gap = min(scores[k+1] + gap1[i], scores[k] + gap2[j])
+            best = min(diagonal + PairScore(i, j, gap - diagonal), gap)
+            diagonal = scores[k+1]
+            scores[k+1] = best
+    return scores
+
+
+def LinearAlignmentPath(i0, i1, j0, j1, PairScore, gaps1, gaps2, matchings=None):
+    """ Returns the moves of an optimal alignment of blocks i0..i1 with blocks j0..j1 in linear memory (Hirschberg).
+    The first sequence is halved and the column where the optimal path crosses the middle row is found from the
+    scores of the top half aligned forwards and of the bottom half aligned backwards. The matchings are kept as in
+    TableAlignmentPath, by the single rows the halving ends with.
+    """
+    if i1 - i0 <= 1 or j1 - j0 == 0:
+        return TableAlignmentPath(i0, i1, j0, j1, PairScore, gaps1, gaps2, matchings=matchings)
+    mid = (i0 + i1)//2
+    RowPairScore = PairScore if matchings is None else lambda i, j, limit: PairScore(i, j, limit)[0]
+    forward = LastRowScores(range(i0, mid), range(j0, j1), RowPairScore, gaps1, gaps2)
+    backward = LastRowScores(range(i1-1, mid-1, -1), range(j1-1, j0-1, -1), RowPairScore, gaps1, gaps2)
+    n = j1 - j0
+    split = min(range(n+1), key=lambda k: forward[k] + backward[n-k])
+    return (LinearAlignmentPath(i0, mid, j0, j0+split, PairScore, gaps1, gaps2, matchings) +
+            LinearAlignmentPath(mid, i1, j0+split, j1, PairScore, gaps1, gaps2, matchings))
+
+
+def AlignedFirst(i, j, rows, columns, PairLowerBound, gaps1, gaps2):
+    """ Returns whether the identical blocks i and j can be aligned with each other before the rest of the rows and
+    columns without losing the optimal alignment. Aligning them is never worse than the gaps it replaces unless another
+    block could be aligned with one of them for less than the difference of their gap penalties, which is ruled out
+    with the PairLowerBound of every block whose gap penalty is larger.
+    """
+    return (all(PairLowerBound(i, l) + gaps1[i] >= gaps2[l] for l in columns if gaps2[l] > gaps1[i]) and
+            all(PairLowerBound(k, j) + gaps2[j] >= gaps1[k] for k in rows if gaps1[k] > gaps2[j]))
+
+
+def AnchoredAlignmentPath(digests1, digests2, PairScore, PairLowerBound, gaps1, gaps2, bandWidth=0, matchings=None):
+    """ Returns the moves of an optimal alignment that aligns the identical leading and trailing blocks directly and
+    only runs the dynamic program on the blocks between them. The trimming stops at the first identical pair that
+    AlignedFirst cannot prove to be on an optimal path. The matchings are kept as in TableAlignmentPath, except for the
+    trimmed blocks that are aligned without being scored.
+    """
+    m = len(digests1)
+    n = len(digests2)
+    prefix = 0
+    while (prefix < min(m, n) and digests1[prefix] == digests2[prefix] and
+           AlignedFirst(prefix, prefix, range(prefix, m), range(prefix, n), PairLowerBound, gaps1, gaps2)):
+        prefix += 1
+    suffix = 0
+    while (suffix < min(m, n) - prefix and digests1[m-suffix-1] == digests2[n-suffix-1] and
+           AlignedFirst(m-suffix-1, n-suffix-1, range(prefix, m-suffix), range(prefix, n-suffix), PairLowerBound,
+                        gaps1, gaps2)):
+        suffix += 1
+    moves = [DIAGONAL]*prefix
+    moves.extend(TableAlignmentPath(prefix, m-suffix, prefix, n-suffix, PairScore, gaps1, gaps2, bandWidth, matchings))
+    moves.extend([DIAGONAL]*suffix)
+    return moves
+
+
+def AlignSequences(bs1, bs2, parametersLines, scoreCache=None, **functions):
+    """ Sequence Alignment of two segments.
+    Based on : https://www.geeksforgeeks.org/sequence-alignment-problem/
+
+    :ivar bs1: Block Sequence 1.
+    :ivar bs2: Block Sequence 2.
+    :ivar parametersLines: The ParametersLinesMap object.
+    :ivar scoreCache: The ScoreCache to look up the block pair scores in (if any).
+
+    The AlignmentMode in the functions picks the dynamic program: "full" keeps a score table (restricted to a band of
+    BandWidth blocks around the diagonal when given), "linear" keeps O(m+n) scores and "anchored" only fills the
+    table between the identical leading and trailing blocks of the two segments. The line matchings of the aligned pairs
+    on the final path are kept from the dynamic program, only the trimmed identical blocks are matched again. With ScoreWorkers above one all the pair scores are computed upfront across that many
+    processes and the dynamic program runs over the precomputed grid, except for the anchored alignment that only
+    scores the pairs left after trimming. Otherwise the pairs whose ScoreLowerBound is above the score of the best gap
+    move are not matched.
+    """
+    m = len(bs1.blocks)
+    n = len(bs2.blocks)
+    paramValueMap = parametersLines.parameterDistribution()
+    alignmentMode = functions.get("AlignmentMode")
+    if scoreCache is not None:
+        paramVersion = commonFunctions.ParameterDistributionVersion(paramValueMap)
+    if scoreCache is not None or alignmentMode == "anchored":
+        digests1 = [functions["BlockDigest"](block) for block in bs1.blocks]
+        digests2 = [functions["BlockDigest"](block) for block in bs2.blocks]
+
+    def PairScoreAndMatching(i, j):
+        if scoreCache is None:
+            return MisMatchScore(bs1.blocks[i], bs2.blocks[j], paramValueMap, functions["GetLineSequence"],
+                                 functions["MinimumWeightBipartiteMatching"], functions["NumberOfAttributes"])
+        key = (digests1[i], digests2[j], paramVersion)
+        scored = scoreCache.get(key)
+        if scored is None:
+            scored = MisMatchScore(bs1.blocks[i], bs2.blocks[j], paramValueMap, functions["GetLineSequence"],
+                                   functions["MinimumWeightBipartiteMatching"], functions["NumberOfAttributes"])
+            scoreCache.put(key, scored)
+        return scored
+
+    pooled = functions.get("ScoreWorkers", 1) > 1 and m*n >= MIN_POOLED_PAIRS and alignmentMode != "anchored"
+    if pooled:
+        if scoreCache is None:
+            Known = lambda i, j: None
         else:
-            block1Alignment.append([])
-        xpos -= 1
+            Known = lambda i, j: scoreCache.get((digests1[i], digests2[j], paramVersion))
+        grid = PooledScores(bs1.blocks, bs2.blocks, paramValueMap, functions["ScoreWorkers"], Known, **functions)
+        if scoreCache is not None:
+            for i in range(m):
+                for j in range(n):
+                    scoreCache.put((digests1[i], digests2[j], paramVersion), grid[i][j])
+        PairScoreAndMatching = lambda i, j: grid[i][j]
 
-    while ypos >= 0:
-        if j > 0:
-            block2Alignment.append(bs2.blocks[j-1])
-            j -= 1
+    def PairScore(i, j, limit=float("inf")):
+        # A pair whose lower bound already loses to the best gap is not matched at all.
+        if not pooled and functions["ScoreLowerBound"](bs1.blocks[i], bs2.blocks[j]) > limit:
+            MATCHING_STATS["pruned"] += 1
+            return float("inf"), None
+        MATCHING_STATS["matched"] += 1
+        return PairScoreAndMatching(i, j)
+
+    gaps1 = [functions["GapPenalty"](block) for block in bs1.blocks]
+    gaps2 = [functions["GapPenalty"](block) for block in bs2.blocks]
+    matchings = {}
+    if alignmentMode == "linear":
+        moves = LinearAlignmentPath(0, m, 0, n, PairScore, gaps1, gaps2, matchings)
+    elif alignmentMode == "anchored":
+        PairLowerBound = lambda i, j: functions["ScoreLowerBound"](bs1.blocks[i], bs2.blocks[j])
+        moves = AnchoredAlignmentPath(digests1, digests2, PairScore, PairLowerBound, gaps1, gaps2,
+                                      functions.get("BandWidth"), matchings)
+    else:
+        moves = TableAlignmentPath(0, m, 0, n, PairScore, gaps1, gaps2, functions.get("BandWidth"), matchings)
+
+    block1Alignment = list()
+    block2Alignment = list()
+    lineMatchings = list()
+    i = j = 0
+    for move in moves:
+        if move == DIAGONAL:
+            block1Alignment.append(bs1.blocks[i])
+            block2Alignment.append(bs2.blocks[j])
+            lineMatchings.append(matchings[(i, j)] if (i, j) in matchings else PairScoreAndMatching(i, j)[1])
+            i += 1
+            j += 1
+        elif move == LEFT:
+            block1Alignment.append([])
+            block2Alignment.append(bs2.blocks[j])
+            j += 1
         else:
+            block1Alignment.append(bs1.blocks[i])
             block2Alignment.append([])
-        ypos -= 1
-
-    block1Alignment.reverse()
-    block2Alignment.reverse()
-    lineMatchings.reverse()
+            i += 1
+    # Both alignments are padded at the front to m+n+1 entries.
+    padding = m + n + 1 - len(moves)
+    block1Alignment = [[] for _ in range(padding)] + block1Alignment
+    block2Alignment = [[] for _ in range(padding)] + block2Alignment
     return block1Alignment, block2Alignment, lineMatchings
 
 
-def StructuredGeneralization(patternString, devicesInfo, GetBlockSequence, outputDirectory, foundDevices, emptyDefDevices, **functions):
+def InitialTemplate(segment, lineCount):
+    """Returns the metaTemplate made of the first segment and the bookkeeping info of its device."""
+    metaTemplate = copy.deepcopy(segment)
+    metaTemplate.deviceName = "Template"
+    lineMapping = {}
+    lineMapping[segment.deviceName] = [
+        y for y in range(lineCount+1)]
+    parametersLines = commonFunctions.ParametersLinesMap(
+        {segment.deviceName: {}}, lineMapping)
+    return metaTemplate, parametersLines
+
+
+def TemplateSegments(segments, **functions):
+    """ Combines the segments one after the other into a metaTemplate.
+    Returns the metaTemplate, its ParametersLinesMap and the number of segments merged into the first one.
+
+    :ivar segments: The (segment, lineCount) pairs in the order they are templated.
+    """
+    metaTemplate = None
+    parametersLines = None
+    templatingCount = 0
+    scoreCache = None
+    if functions.get("ScoreCacheSize"):
+        scoreCache = commonFunctions.ScoreCache(functions["ScoreCacheSize"])
+
+    #Iterate over the sorted segments and combine them one after with other.
+    for segment, lineCount in segments:
+        if not parametersLines:
+            metaTemplate, parametersLines = InitialTemplate(segment, lineCount)
+        else:
+            parametersLines.parameters[segment.deviceName] = {}
+            # Segments that only reorder the lines of the template are merged without aligning them.
+            if not functions["ReorderMerge"](metaTemplate, segment, parametersLines, segment.deviceName):
+                block1Alignment, block2Alignment, lineMatchings = AlignSequences(
+                    metaTemplate, segment, parametersLines, scoreCache, **functions)
+                metaTemplate.blocks = functions["GenerateTemplate"](
+                    block1Alignment, block2Alignment, lineMatchings, parametersLines, segment.deviceName, functions["NumberOfAttributes"])
+            templatingCount += 1
+
+    if scoreCache:
+        SCORE_CACHE_STATS["hits"] += scoreCache.hits
+        SCORE_CACHE_STATS["misses"] += scoreCache.misses
+    return metaTemplate, parametersLines, templatingCount
+
+
+def MergeTemplates(partial1, partial2, **functions):
+    """ Merges two results of TemplateSegments over disjoint sets of devices, as if the devices of the second one were
+    templated after those of the first one.
+    The second metaTemplate is aligned with the first one as a single MERGED_TEMPLATE device, whose new line numbers and
+    parameter values are then handed to each of the devices it stands for.
+
+    :ivar partial1: The (metaTemplate, parametersLines, templatingCount) of the first devices.
+    :ivar partial2: The (metaTemplate, parametersLines, templatingCount) of the other devices.
+    """
+    metaTemplate, parametersLines, templatingCount = partial1
+    otherTemplate, otherLines, otherCount = partial2
+    # The parameters of the second metaTemplate are numbered after those of the first one.
+    renameMap = {"P" + str(k): "P" + str(k + parametersLines.counter) for k in range(otherLines.counter)}
+    functions["RenameParameters"](otherTemplate, renameMap, functions["NumberOfAttributes"])
+    parametersLines.counter += otherLines.counter
+
+    parametersLines.parameters[MERGED_TEMPLATE] = {}
+    deviceLineMap = {}
+    block1Alignment, block2Alignment, lineMatchings = AlignSequences(
+        metaTemplate, otherTemplate, parametersLines, **functions)
+    metaTemplate.blocks = functions["GenerateTemplate"](
+        block1Alignment, block2Alignment, lineMatchings, parametersLines, MERGED_TEMPLATE, functions["NumberOfAttributes"], deviceLineMap)
+    mergedValues = parametersLines.parameters.pop(MERGED_TEMPLATE)
+    del parametersLines.lineMapping[MERGED_TEMPLATE]
+
+    renamedParams = set(renameMap.values())
+    for device in otherLines.parameters:
+        values = {renameMap.get(param, param): value for param, value in otherLines.parameters[device].items()}
+        # A value that is a parameter of the second metaTemplate stands for the value of that parameter on the device.
+        for param, value in mergedValues.items():
+            values[param] = values.get(value, "") if value in renamedParams else value
+        parametersLines.parameters[device] = values
+        parametersLines.lineMapping[device] = [deviceLineMap.get(line, line) for line in otherLines.lineMapping[device]]
+    return metaTemplate, parametersLines, templatingCount + otherCount + 1
+
+
+def RunWithStatistics(work, *args, **functions):
+    """ Runs the work in a worker process and returns its result along with the score, matching and assignment statistics
+    it gathered."""
+    SCORE_CACHE_STATS.clear()
+    MATCHING_STATS.clear()
+    Assignment.ASSIGNMENT_STATS.clear()
+    return work(*args, **functions), SCORE_CACHE_STATS.copy(), MATCHING_STATS.copy(), Assignment.ASSIGNMENT_STATS.copy()
+
+
+def CollectPartials(futures):
+    """Returns the results of the RunWithStatistics futures in order, adding their statistics to those of this process."""
+    partials = list()
+    for future in futures:
+        partial, scoreCacheStats, matchingStats, assignmentStats = future.result()
+        SCORE_CACHE_STATS.update(scoreCacheStats)
+        MATCHING_STATS.update(matchingStats)
+        Assignment.ASSIGNMENT_STATS.update(assignmentStats)
+        partials.append(partial)
+    return partials
+
+
+def MapReduceTemplates(segments, workers, **functions):
+    """ Templates consecutive chunks of the segments in worker processes and merges the partial metaTemplates pairwise in
+    a tree, keeping the order of the segments. Returns the same as TemplateSegments.
+
+    :ivar workers: The number of worker processes.
+    """
+    pool = WorkerPool("templates", workers)
+    chunkSize = max(MIN_CHUNK_SEGMENTS, -(-len(segments)//workers))
+    partials = CollectPartials([pool.submit(RunWithStatistics, TemplateSegments, segments[k:k+chunkSize], **functions)
+                                for k in range(0, len(segments), chunkSize)])
+    while len(partials) > 1:
+        merged = CollectPartials([pool.submit(RunWithStatistics, MergeTemplates, partials[k], partials[k+1], **functions)
+                                  for k in range(0, len(partials) - 1, 2)])
+        partials = merged + partials[len(partials) - len(partials) % 2:]
+    return partials[0]
+
+
+def AlignedIndices(bs1, bs2, block1Alignment, block2Alignment):
+    """Returns the (index in bs1, index in bs2) of every aligned position, with None standing for a gap."""
+    indices1 = {id(block): i for i, block in enumerate(bs1.blocks)}
+    indices2 = {id(block): j for j, block in enumerate(bs2.blocks)}
+    return [(indices1[id(block1)] if block1 != [] else None, indices2[id(block2)] if block2 != [] else None)
+            for block1, block2 in zip(block1Alignment, block2Alignment) if block1 != [] or block2 != []]
+
+
+def AlignToCenter(center, segments, **functions):
+    """ Returns the AlignedIndices of the center segment with each of the segments, aligned independently, along with
+    the line matching of every aligned pair of blocks, keyed by the index of the center block."""
+    _, centerLines = InitialTemplate(center, 0)
+    scoreCache = None
+    if functions.get("ScoreCacheSize"):
+        scoreCache = commonFunctions.ScoreCache(functions["ScoreCacheSize"])
+    alignments = list()
+    for segment in segments:
+        block1Alignment, block2Alignment, lineMatchings = AlignSequences(center, segment, centerLines, scoreCache,
+                                                                         **functions)
+        alignedIndices = AlignedIndices(center, segment, block1Alignment, block2Alignment)
+        pairs = [c for c, d in alignedIndices if c is not None and d is not None]
+        alignments.append((alignedIndices, dict(zip(pairs, lineMatchings))))
+    if scoreCache:
+        SCORE_CACHE_STATS["hits"] += scoreCache.hits
+        SCORE_CACHE_STATS["misses"] += scoreCache.misses
+    return alignments
+
+
+def LineParts(sequence):
+    """ Returns the lists of lines (or of matched pairs) of a line sequence or matching, the guard and set cmds of a
+    term or the single list of the other kinds, and whether the sequence is nested."""
+    if sequence and isinstance(sequence[0], list):
+        return sequence, True
+    return [sequence], False
+
+
+def CenterLineMatching(templateBlock, centerBlock, deviceBlock, centerMatching, centerLineMap, paramValueMap,
+                       **functions):
+    """ Returns the line matching of the template block that grew out of the center block with the device block.
+    The device lines the worker matched with identical center lines keep the template lines those center lines
+    became, found through the line mapping of the center device, and only the other lines are matched with each other.
+    """
+    if templateBlock.action["type"] != deviceBlock.action["type"]:
+        return []
+    LineNumber = functions["LineNumber"]
+    templateParts, nested = LineParts(functions["GetLineSequence"](templateBlock))
+    centerParts, _ = LineParts(functions["GetLineSequence"](centerBlock))
+    deviceParts, _ = LineParts(functions["GetLineSequence"](deviceBlock))
+    matchingParts, _ = LineParts(centerMatching)
+    centerHashes, _ = LineParts(centerBlock.lineHashes)
+    deviceHashes, _ = LineParts(deviceBlock.lineHashes)
+    matching = list()
+    leftover = list()
+    for templateLines, centerLines, deviceLines, pairs, hashes1, hashes2 in zip(
+            templateParts, centerParts, deviceParts, matchingParts, centerHashes, deviceHashes):
+        templateIndex = {LineNumber(line): x for x, line in enumerate(templateLines)}
+        matched = [(templateIndex[centerLineMap[LineNumber(centerLines[x])]], y) for x, y in pairs
+                   if hashes1[x] == hashes2[y]]
+        rows = {x for x, _ in matched}
+        columns = {y for _, y in matched}
+        matching.append(matched)
+        leftover.append(([x for x in range(len(templateLines)) if x not in rows],
+                         [y for y in range(len(deviceLines)) if y not in columns]))
+    if any(rows and columns for rows, columns in leftover):
+        LS1 = [[lines[x] for x in rows] for lines, (rows, _) in zip(templateParts, leftover)]
+        LS2 = [[lines[y] for y in columns] for lines, (_, columns) in zip(deviceParts, leftover)]
+        _, leftoverMatching = functions["MinimumWeightBipartiteMatching"](
+            LS1 if nested else LS1[0], LS2 if nested else LS2[0], paramValueMap, functions["NumberOfAttributes"])
+        for matched, (rows, columns), pairs in zip(matching, leftover, LineParts(leftoverMatching)[0]):
+            matched.extend((rows[x], columns[y]) for x, y in pairs)
+    return matching if nested else matching[0]
+
+
+def AlignAddedBlocks(templateBlocks, deviceBlocks, block1Alignment, block2Alignment, lineMatchings, paramValueMap,
+                     **functions):
+    """ Appends the alignment of the template blocks and the device blocks that lie between the same two center blocks,
+    and the line matchings of their aligned pairs."""
+    def PairScore(i, j, limit=None):
+        return MisMatchScore(templateBlocks[i], deviceBlocks[j], paramValueMap, functions["GetLineSequence"],
+                             functions["MinimumWeightBipartiteMatching"], functions["NumberOfAttributes"])
+
+    gaps1 = [functions["GapPenalty"](block) for block in templateBlocks]
+    gaps2 = [functions["GapPenalty"](block) for block in deviceBlocks]
+    matchings = {}
+    i = j = 0
+    for move in TableAlignmentPath(0, len(templateBlocks), 0, len(deviceBlocks), PairScore, gaps1, gaps2,
+                                   matchings=matchings):
+        block1Alignment.append(templateBlocks[i] if move != LEFT else [])
+        block2Alignment.append(deviceBlocks[j] if move != UP else [])
+        if move == DIAGONAL:
+            lineMatchings.append(matchings[(i, j)])
+        i += move != LEFT
+        j += move != UP
+
+
+def CenterStarTemplates(segments, workers, **functions):
+    """ Aligns every segment with the first (center) segment independently in worker processes, then folds the
+    alignments into a metaTemplate in a single pass. Returns the same as TemplateSegments.
+    The template blocks coming from a center block take the device blocks aligned with that center block, and the device
+    blocks aligned with a gap are only aligned with the blocks other devices added between the same two center blocks.
+    The line matchings of the workers are kept for the lines identical to center lines.
+
+    :ivar workers: The number of worker processes.
+    """
+    center, lineCount = segments[0]
+    others = [segment for segment, _ in segments[1:]]
+    pool = WorkerPool("templates", workers)
+    chunkSize = max(MIN_CHUNK_SEGMENTS, -(-len(others)//(4*workers)))
+    chunks = CollectPartials([pool.submit(RunWithStatistics, AlignToCenter, center, others[k:k+chunkSize], **functions)
+                              for k in range(0, len(others), chunkSize)])
+
+    metaTemplate, parametersLines = InitialTemplate(center, lineCount)
+    # The center block each template block comes from, None for the blocks added by the other devices.
+    centerIndices = list(range(len(metaTemplate.blocks)))
+    templatingCount = 0
+    alignments = (alignment for chunk in chunks for alignment in chunk)
+    for segment, (alignedIndices, centerMatchings) in zip(others, alignments):
+        parametersLines.parameters[segment.deviceName] = {}
+        templatingCount += 1
+        if functions["ReorderMerge"](metaTemplate, segment, parametersLines, segment.deviceName):
+            continue
+        paramValueMap = parametersLines.parameterDistribution()
+        centerLineMap = parametersLines.lineMapping[center.deviceName]
+        positions = {c: t for t, c in enumerate(centerIndices) if c is not None}
+        block1Alignment = list()
+        block2Alignment = list()
+        lineMatchings = list()
+        t = 0
+        addedBlocks = list()
+        for c, d in alignedIndices + [(None, None)]:
+            if c is None and d is not None:
+                addedBlocks.append(segment.blocks[d])
+                continue
+            # The blocks added between two center blocks by the device are aligned with those added by earlier devices.
+            end = positions[c] if c is not None else len(metaTemplate.blocks)
+            AlignAddedBlocks(metaTemplate.blocks[t:end], addedBlocks, block1Alignment, block2Alignment, lineMatchings,
+                             paramValueMap, **functions)
+            addedBlocks = list()
+            if c is not None:
+                block1Alignment.append(metaTemplate.blocks[end])
+                block2Alignment.append(segment.blocks[d] if d is not None else [])
+                if d is not None:
+                    lineMatchings.append(CenterLineMatching(metaTemplate.blocks[end], center.blocks[c],
+                                                            segment.blocks[d], centerMatchings[c], centerLineMap,
+                                                            paramValueMap, **functions))
+            t = end + 1
+
+        templateCenterIndices = {id(block): c for block, c in zip(metaTemplate.blocks, centerIndices)}
+        centerIndices = [templateCenterIndices[id(block1)] if block1 != [] else None for block1 in block1Alignment]
+        metaTemplate.blocks = functions["GenerateTemplate"](
+            block1Alignment, block2Alignment, lineMatchings, parametersLines, segment.deviceName, functions["NumberOfAttributes"])
+    return metaTemplate, parametersLines, templatingCount
+
+
+def MinHashSketch(segment, salts):
+    """Returns the MinHash sketch of the set of (action, line hash) of all the lines of the segment."""
+    shingles = set()
+    for block in segment.blocks:
+        lineHashes = block.lineHashes
+        while lineHashes and isinstance(lineHashes[0], list):
+            lineHashes = [h for hashes in lineHashes for h in hashes]
+        shingles.update(hash((block.action["type"], h)) for h in lineHashes)
+    if not shingles:
+        return tuple([MERSENNE_PRIME]*len(salts))
+    return tuple(min((a*h + b) % MERSENNE_PRIME for h in shingles) for a, b in salts)
+
+
+def SimilarityOrder(segments):
+    """ Reorders the (segment, lineCount) pairs so that similar segments are templated one after the other.
+    The segments are sketched with MinHash and the segments sharing a band of their sketches are neighbours. The order
+    starts from the segment whose neighbourhood is the densest and always moves on to the most similar neighbour of the
+    last segment not yet ordered, or to the densest segment left when it has none.
+    """
+    rng = random.Random(0)
+    salts = [(rng.randrange(1, MERSENNE_PRIME), rng.randrange(MERSENNE_PRIME)) for _ in range(MINHASH_PERMUTATIONS)]
+    groups = collections.OrderedDict()
+    for segment, lineCount in segments:
+        groups.setdefault(MinHashSketch(segment, salts), list()).append((segment, lineCount))
+    sketches = list(groups)
+    if len(sketches) < 3:
+        return segments
+
+    rows = MINHASH_PERMUTATIONS//MINHASH_BANDS
+    buckets = {}
+    for k, sketch in enumerate(sketches):
+        for band in range(MINHASH_BANDS):
+            buckets.setdefault((band, sketch[band*rows:(band+1)*rows]), list()).append(k)
+    neighbours = [set() for _ in sketches]
+    for members in buckets.values():
+        for k in members:
+            neighbours[k].update(members)
+
+    def Similarity(k, l):
+        return sum(a == b for a, b in zip(sketches[k], sketches[l]))
+
+    density = [sum(len(groups[sketches[l]])*Similarity(k, l) for l in neighbours[k]) for k in range(len(sketches))]
+    left = set(range(len(sketches)))
+    order = list()
+    current = None
+    while left:
+        candidates = neighbours[current] & left if current is not None else None
+        if candidates:
+            current = max(candidates, key=lambda l: (Similarity(current, l), density[l], -l))
+        else:
+            current = max(left, key=lambda l: (density[l], -l))
+        left.remove(current)
+        order.append(current)
+    return [pair for k in order for pair in groups[sketches[k]]]
+
+
+def OrderedSegments(lineCountMap, ordering=None):
+    """Returns the (segment, lineCount) pairs in the order they are templated in, "similarity" or by frequency."""
+    # Heuristic for picking the segments: Sort the segments based on frequency and start templating with the highest frequency.
+    numberofSegmentsLineCountTuples = [
+        (len(lineCountMap[c]), c) for c in lineCountMap]
+    numberofSegmentsLineCountTuples.sort(reverse=True)
+
+    segments = [(segment, lineCount) for _, lineCount in numberofSegmentsLineCountTuples
+                for segment in lineCountMap[lineCount]]
+    if ordering == "similarity":
+        segments = SimilarityOrder(segments)
+    return segments
+
+
+def AssignmentReport(stats, solver, approxThreshold):
+    """ Returns the lines of output.txt naming the assignment solver that matched the lines, and the approximate auction
+    with its threshold when one is given, along with the gap of the approximate line matchings when there were any."""
+    report = "\nAssignment engine: {}".format(solver or Assignment.DEFAULT_SOLVER)
+    if approxThreshold:
+        report += ", approximate above {} lines".format(approxThreshold)
+    report += "\n"
+    if stats["approximate"]:
+        gap = stats["approximateCost"] - stats["lowerBound"]
+        report += "{} approximate line matchings cost {:.0f}, at most {:.0f} ({:.2%}) above their lower bound {:.0f}\n".format(
+            stats["approximate"], stats["approximateCost"], gap, gap/max(abs(stats["lowerBound"]), 1), stats["lowerBound"])
+    return report
+
+
+def StructuredGeneralization(patternString, devicesInfo, GetBlockSequence, outputDirectory, foundDevices, emptyDefDevices, candidates=None, **functions):
     """ Structured Generalization algorithm to generate the metaTemplate of the input segments.
     Based on : Algorithm 1 in the paper.
 
@@ -147,47 +725,35 @@ def StructuredGeneralization(patternString, devicesInfo, GetBlockSequence, outpu
     :ivar outputDirectory: The directory to output the metaTemplate.
     :ivar foundDevices: The set of devices which have at least one segment name matching the given pattern.
     :ivar emptyDefDevices: The set of devices which have a segment matching the pattern but the parser version has empty definition.
-    :ivar functions: All the other functions required for templating.
+    :ivar candidates: The (device, deviceInfo) pairs that define the segment, when known upfront all the other devices are skipped.
+    :ivar functions: All the other functions required for templating, along with the optional ScoreCacheSize,
+                     AlignmentMode, BandWidth, ScoreWorkers, Engine, Workers, Ordering, Solver and ApproxThreshold.
     """
     pattern = re.compile(patternString)
     lineCountMap = {}
-    exactDefMatchMap = {}
+    exactDefMatchMap = commonFunctions.ExactMatchMap()
+    assignmentStats = Assignment.ASSIGNMENT_STATS.copy()
 
     # Generate the blockSequences for all devices having a segment name matching the patternString.
-    for device in devicesInfo:
+    if candidates is None:
+        candidates = devicesInfo.items()
+    for device, deviceInfo in candidates:
         segments, lineCounts = GetBlockSequence(
-            device, devicesInfo[device], pattern, foundDevices, emptyDefDevices, exactDefMatchMap)
+            device, deviceInfo, pattern, foundDevices, emptyDefDevices, exactDefMatchMap)
         for s, l in zip(segments, lineCounts):
             lineCountMap.setdefault(l, list()).append(s)
 
-    # Heuristic for picking the segments: Sort the segments based on frequency and start templating with the highest frequency.
-    numberofSegmentsLineCountTuples = [
-        (len(lineCountMap[c]), c) for c in lineCountMap]
-    numberofSegmentsLineCountTuples.sort(reverse=True)
-
-    metaTemplate = None
-    parametersLines = None
-    templatingCount = 0
-
-    #Iterate over the sorted segments and combine them one after with other.
-    for _, lineCount in numberofSegmentsLineCountTuples:
-        for segment in lineCountMap[lineCount]:
-            if not parametersLines:
-                #Initialization metaTemplate with Segment1 and store other bookkeeping info
-                metaTemplate = copy.deepcopy(segment)
-                metaTemplate.deviceName = "Template"
-                lineMapping = {}
-                lineMapping[segment.deviceName] = [
-                    y for y in range(lineCount+1)]
-                parametersLines = commonFunctions.ParametersLinesMap(
-                    {segment.deviceName: {}}, lineMapping)
-            else:
-                parametersLines.parameters[segment.deviceName] = {}
-                block1Alignment, block2Alignment, lineMatchings = AlignSequences(
-                    metaTemplate, segment, parametersLines, **functions)
-                metaTemplate.blocks = functions["GenerateTemplate"](
-                    block1Alignment, block2Alignment, lineMatchings, parametersLines, segment.deviceName, functions["NumberOfAttributes"])
-                templatingCount += 1
+    segments = OrderedSegments(lineCountMap, functions.get("Ordering"))
+    workers = functions.get("Workers", 1)
+    try:
+        if functions.get("Engine") == "mapreduce" and workers > 1 and len(segments) >= 2*MIN_CHUNK_SEGMENTS:
+            metaTemplate, parametersLines, templatingCount = MapReduceTemplates(segments, workers, **functions)
+        elif functions.get("Engine") == "centerstar" and workers > 1 and len(segments) >= 2*MIN_CHUNK_SEGMENTS:
+            metaTemplate, parametersLines, templatingCount = CenterStarTemplates(segments, workers, **functions)
+        else:
+            metaTemplate, parametersLines, templatingCount = TemplateSegments(segments, **functions)
+    finally:
+        ShutdownWorkerPools()
 
     #Minimize Parameters
     if metaTemplate:
@@ -196,6 +762,9 @@ def StructuredGeneralization(patternString, devicesInfo, GetBlockSequence, outpu
         output, singleParamQ, spuriousQ = functions["PrintTemplate"](metaTemplate, parametersLines,
                                    outputDirectory, patternString, functions["NumberOfAttributes"])
         if output:
+            assignmentStats = collections.Counter({key: value - assignmentStats[key]
+                                                   for key, value in Assignment.ASSIGNMENT_STATS.items()})
+            output += AssignmentReport(assignmentStats, functions.get("Solver"), functions.get("ApproxThreshold", 0))
             finalPath = outputDirectory + os.path.sep + patternString
             with open(finalPath + os.path.sep + "output.txt", "w") as write_file:
                 write_file.write(output)
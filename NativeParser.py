@@ -0,0 +1,457 @@
+import ipaddress
+import json
+import os
+import re
+
+from docopt import docopt
+
+doc = """
+A lightweight parser for Cisco IOS style configurations that builds the parts of the Batfish
+vendor independent model (viModel) SelfStarter templates: ACLs, prefix lists and route-maps.
+It lets a --directory run skip the Batfish service altogether.
+
+    parse     Writes the viModel answer of the snapshot, which can be replayed with StandInServer.py.
+    record    Writes the viModel answer of the snapshot from the Batfish service, to compare the parser against.
+    compare   Compares the parsed segments against a viModel answer recorded from Batfish for the same snapshot.
+
+Lines the parser does not support are dropped, printed and listed under the "unsupportedLines" of their segment.
+
+Usage:
+    NativeParser.py parse <directory> <answerFile>
+    NativeParser.py record <directory> <answerFile>
+    NativeParser.py compare <directory> <answerFile> [--nodeRegex=<nr>]
+
+Options:
+    -h --help           Show this help screen.
+    --nodeRegex=<nr>    Regular expression for names of nodes to compare [default: .*].
+"""
+
+CONFIGURATION_FORMAT = "CISCO_IOS"
+
+POLICY = "org.batfish.datamodel.routing_policy."
+EXPR = POLICY + "expr."
+STATEMENT = POLICY + "statement."
+STATIC_STATEMENT = STATEMENT + "Statements$StaticStatement"
+
+IP_PROTOCOLS = {"ahp": "AHP", "eigrp": "EIGRP", "esp": "ESP", "gre": "GRE", "icmp": "ICMP", "igmp": "IGMP",
+                "ipinip": "IPINIP", "ospf": "OSPF", "pim": "PIM", "sctp": "SCTP", "tcp": "TCP", "udp": "UDP"}
+IP_PROTOCOL_NUMBERS = {1: "ICMP", 2: "IGMP", 4: "IPINIP", 6: "TCP", 17: "UDP", 47: "GRE", 50: "ESP", 51: "AHP",
+                       88: "EIGRP", 89: "OSPF", 103: "PIM", 132: "SCTP"}
+PORTS = {"bgp": 179, "biff": 512, "bootpc": 68, "bootps": 67, "chargen": 19, "cmd": 514, "daytime": 13,
+         "discard": 9, "dnsix": 195, "domain": 53, "echo": 7, "exec": 512, "finger": 79, "ftp": 21,
+         "ftp-data": 20, "gopher": 70, "hostname": 101, "https": 443, "ident": 113, "irc": 194, "isakmp": 500,
+         "klogin": 543, "kshell": 544, "login": 513, "lpd": 515, "mobile-ip": 434, "nameserver": 42,
+         "netbios-dgm": 138, "netbios-ns": 137, "netbios-ss": 139, "nntp": 119, "non500-isakmp": 4500,
+         "ntp": 123, "pim-auto-rp": 496, "pop2": 109, "pop3": 110, "rip": 520, "smtp": 25, "snmp": 161,
+         "snmptrap": 162, "sunrpc": 111, "syslog": 514, "tacacs": 49, "talk": 517, "telnet": 23, "tftp": 69,
+         "time": 37, "uucp": 540, "who": 513, "whois": 43, "www": 80, "xdmcp": 177}
+PORT_OPERATORS = ("eq", "neq", "lt", "gt", "range")
+ORIGINS = {"igp": "IGP", "egp": "EGP", "incomplete": "INCOMPLETE"}
+# Logging does not change what an ACL line matches, Batfish leaves it out of the headerSpace as well.
+LOGGING = ("log", "log-input")
+
+
+class UnsupportedLine(ValueError):
+    """Raised for a configuration line that the native parser cannot translate into the viModel."""
+
+
+def Stanzas(text):
+    """Yields the (header, children lines) of every top-level stanza of the configuration."""
+    header = None
+    children = []
+    for line in text.splitlines():
+        if not line.strip() or line.lstrip().startswith("!"):
+            continue
+        if line[0].isspace():
+            if header is not None:
+                children.append(line.strip())
+            continue
+        if header is not None:
+            yield header, children
+        header = line.strip()
+        children = []
+    if header is not None:
+        yield header, children
+
+
+def IpSpace(tokens, idx):
+    """ Parses the address at tokens[idx] (any, host <ip>, <ip> <wildcard> or <prefix>) into a Batfish IpSpace.
+    Returns the IpSpace and the index of the next token.
+    """
+    if idx >= len(tokens):
+        raise UnsupportedLine("missing address")
+    if tokens[idx] == "any":
+        return {"class": "org.batfish.datamodel.UniverseIpSpace"}, idx + 1
+    try:
+        if tokens[idx] == "host":
+            return {"class": "org.batfish.datamodel.IpIpSpace", "ip": str(ipaddress.IPv4Address(tokens[idx+1]))}, idx + 2
+        if "/" in tokens[idx]:
+            prefix = ipaddress.IPv4Network(tokens[idx], strict=False)
+            return {"class": "org.batfish.datamodel.IpWildcardIpSpace", "ipWildcard": str(prefix)}, idx + 1
+        ip = int(ipaddress.IPv4Address(tokens[idx]))
+        wildcard = int(ipaddress.IPv4Address(tokens[idx+1]))
+    except (IndexError, ValueError):
+        # Object groups (object-group, addrgroup) and other address forms.
+        raise UnsupportedLine("unsupported address " + " ".join(tokens[idx:idx+2]))
+    network = str(ipaddress.IPv4Address(ip & ~wildcard & 0xFFFFFFFF))
+    # A contiguous wildcard is printed as a prefix the way Batfish prints an IpWildcard.
+    if (wildcard + 1) & wildcard == 0:
+        ipWildcard = "{}/{}".format(network, 32 - bin(wildcard).count("1"))
+    else:
+        ipWildcard = "{}:{}".format(network, tokens[idx+1])
+    return {"class": "org.batfish.datamodel.IpWildcardIpSpace", "ipWildcard": ipWildcard}, idx + 2
+
+
+def PortNumber(token):
+    if token.isdigit():
+        return int(token)
+    if token not in PORTS:
+        raise UnsupportedLine("unknown port " + token)
+    return PORTS[token]
+
+
+def Ports(tokens, idx):
+    """ Parses an optional port specifier at tokens[idx] into a list of "low-high" ranges.
+    Returns the ranges and the index of the next token.
+    """
+    if idx >= len(tokens) or tokens[idx] not in PORT_OPERATORS:
+        return [], idx
+    operator = tokens[idx]
+    if operator == "range":
+        return ["{}-{}".format(PortNumber(tokens[idx+1]), PortNumber(tokens[idx+2]))], idx + 3
+    if operator == "gt":
+        return ["{}-65535".format(PortNumber(tokens[idx+1]) + 1)], idx + 2
+    if operator == "lt":
+        return ["0-{}".format(PortNumber(tokens[idx+1]) - 1)], idx + 2
+    ports = list()
+    idx += 1
+    while idx < len(tokens) and (tokens[idx].isdigit() or tokens[idx] in PORTS):
+        ports.append(PortNumber(tokens[idx]))
+        idx += 1
+    if operator == "eq":
+        return ["{}-{}".format(port, port) for port in ports], idx
+    ranges = list()
+    low = 0
+    for port in sorted(ports):
+        if port > low:
+            ranges.append("{}-{}".format(low, port - 1))
+        low = port + 1
+    if low <= 65535:
+        ranges.append("{}-65535".format(low))
+    return ranges, idx
+
+
+def Protocol(token):
+    if token == "ip":
+        return []
+    if token.isdigit():
+        return [IP_PROTOCOL_NUMBERS.get(int(token), "UNNAMED_" + token)]
+    if token not in IP_PROTOCOLS:
+        raise UnsupportedLine("unknown protocol " + token)
+    return [IP_PROTOCOLS[token]]
+
+
+def AclLine(text, standard):
+    """ Returns the viModel line of an ACL entry such as "permit tcp any host 10.0.0.1 eq www".
+    Raises UnsupportedLine for the qualifiers other than logging (established, ICMP types, dscp...), which would make
+    lines that only differ in them look identical.
+    """
+    tokens = text.split()
+    if tokens[0].isdigit():
+        tokens = tokens[1:]
+    action = tokens[0].upper()
+    name = " ".join(tokens)
+    while tokens[-1] in LOGGING:
+        tokens = tokens[:-1]
+    if standard:
+        protocols = []
+        # A standard entry may give the address without its wildcard.
+        if len(tokens) == 2 and tokens[1] != "any" and "/" not in tokens[1]:
+            tokens = tokens + ["0.0.0.0"]
+        srcIps, idx = IpSpace(tokens, 1)
+        srcPorts = dstPorts = []
+        dstIps = {"class": "org.batfish.datamodel.UniverseIpSpace"}
+    else:
+        protocols = Protocol(tokens[1])
+        srcIps, idx = IpSpace(tokens, 2)
+        srcPorts, idx = Ports(tokens, idx)
+        dstIps, idx = IpSpace(tokens, idx)
+        dstPorts, idx = Ports(tokens, idx)
+    if idx < len(tokens):
+        raise UnsupportedLine("unsupported qualifiers " + " ".join(tokens[idx:]))
+    headerSpace = {"dstIps": dstIps, "dstPorts": dstPorts, "ipProtocols": protocols,
+                   "negate": False, "srcIps": srcIps, "srcPorts": srcPorts}
+    return {"action": action, "name": name,
+            "matchCondition": {"class": "org.batfish.datamodel.acl.MatchHeaderSpace", "headerSpace": headerSpace}}
+
+
+def PrefixListLine(tokens, ipv6):
+    """Returns the viModel line of a prefix-list entry given the tokens after the list name."""
+    if tokens[0] == "seq":
+        tokens = tokens[2:]
+    try:
+        network = ipaddress.ip_network(tokens[1], strict=False)
+    except (IndexError, ValueError):
+        raise UnsupportedLine("unsupported prefix " + " ".join(tokens[1:2]))
+    maxLength = 128 if ipv6 else 32
+    low = high = network.prefixlen
+    options = dict(zip(tokens[2::2], tokens[3::2]))
+    if "ge" in options:
+        low = int(options["ge"])
+        high = maxLength
+    if "le" in options:
+        high = int(options["le"])
+    if ipv6:
+        # Batfish prints all eight groups of an IPv6 address.
+        address = ":".join("{:x}".format(int(group, 16))
+                           for group in network.network_address.exploded.split(":"))
+    else:
+        address = str(network.network_address)
+    return {"action": tokens[0].upper(), "ipWildcard": "{}/{}".format(address, network.prefixlen),
+            "lengthRange": "{}-{}".format(low, high)}
+
+
+def Literal(kind, value):
+    return {"class": EXPR + kind, "value": value}
+
+
+def AnyOf(conditions):
+    """Returns the single condition or a Disjunction of them for a match on several names."""
+    if len(conditions) == 1:
+        return conditions[0]
+    return {"class": EXPR + "Disjunction", "disjuncts": conditions}
+
+
+def MatchCondition(tokens):
+    """Returns the guard condition of a route-map "match" line, None if it is not supported."""
+    if tokens[:3] in (["ip", "address", "prefix-list"], ["ipv6", "address", "prefix-list"]):
+        ipv6 = tokens[0] == "ipv6"
+        return AnyOf([{"class": EXPR + ("MatchPrefix6Set" if ipv6 else "MatchPrefixSet"),
+                       "prefix": {"class": EXPR + ("DestinationNetwork6" if ipv6 else "DestinationNetwork")},
+                       "prefixSet": {"class": EXPR + ("NamedPrefix6Set" if ipv6 else "NamedPrefixSet"), "name": name}}
+                      for name in tokens[3:]])
+    if tokens[:2] in (["ip", "address"], ["ipv6", "address"]):
+        return AnyOf([{"class": EXPR + "MatchIpAccessList", "list": name} for name in tokens[2:]])
+    if tokens[0] == "community":
+        names = [name for name in tokens[1:] if name != "exact-match"]
+        return AnyOf([{"class": EXPR + "MatchCommunitySet",
+                       "expr": {"class": EXPR + "NamedCommunitySet", "name": name}} for name in names])
+    if tokens[0] == "as-path":
+        return AnyOf([{"class": EXPR + "MatchAsPath",
+                       "expr": {"class": EXPR + "NamedAsPathSet", "name": name}} for name in tokens[1:]])
+    if tokens[0] == "tag":
+        return AnyOf([{"class": EXPR + "MatchTag", "cmp": "EQ", "tag": Literal("LiteralLong", int(tag))}
+                      for tag in tokens[1:]])
+    if tokens[0] == "metric":
+        return {"class": EXPR + "MatchMetric", "comparator": "EQ", "metric": Literal("LiteralLong", int(tokens[1]))}
+    return None
+
+
+def SetStatement(tokens):
+    """Returns the statement of a route-map "set" line, None if it is not supported."""
+    if tokens[0] == "local-preference":
+        return {"class": STATEMENT + "SetLocalPreference", "localPreference": Literal("LiteralLong", int(tokens[1]))}
+    if tokens[0] == "weight":
+        return {"class": STATEMENT + "SetWeight", "weight": Literal("LiteralInt", int(tokens[1]))}
+    if tokens[0] == "metric":
+        if tokens[1].startswith("+"):
+            metric = {"class": EXPR + "IncrementMetric", "addend": int(tokens[1][1:])}
+        elif tokens[1].startswith("-"):
+            metric = {"class": EXPR + "DecrementMetric", "subtrahend": int(tokens[1][1:])}
+        else:
+            metric = Literal("LiteralLong", int(tokens[1]))
+        return {"class": STATEMENT + "SetMetric", "metric": metric}
+    if tokens[0] == "tag":
+        return {"class": STATEMENT + "SetTag", "tag": Literal("LiteralLong", int(tokens[1]))}
+    if tokens[0] == "origin" and tokens[1] in ORIGINS:
+        return {"class": STATEMENT + "SetOrigin",
+                "originType": {"class": EXPR + "LiteralOrigin", "originType": ORIGINS[tokens[1]]}}
+    if tokens[0] == "community" and tokens[1] != "none":
+        additive = tokens[-1] == "additive"
+        communities = [community for community in tokens[1:] if community != "additive"]
+        return {"class": STATEMENT + ("AddCommunity" if additive else "SetCommunity"),
+                "expr": {"class": EXPR + "LiteralCommunitySet", "communities": communities}}
+    if tokens[0] == "comm-list" and tokens[-1] == "delete":
+        return {"class": STATEMENT + "DeleteCommunity",
+                "expr": {"class": EXPR + "NamedCommunitySet", "name": tokens[1]}}
+    if tokens[:2] == ["as-path", "prepend"]:
+        return {"class": STATEMENT + "PrependAsPath",
+                "expr": {"class": EXPR + "LiteralAsList",
+                         "list": [{"class": EXPR + "ExplicitAs", "as": int(asn)} for asn in tokens[2:] if asn.isdigit()]}}
+    if tokens[:2] in (["ip", "next-hop"], ["ipv6", "next-hop"]):
+        if tokens[2] == "peer-address":
+            return {"class": STATEMENT + "SetNextHop", "expr": {"class": EXPR + "PeerAddressNextHop"}}
+        return {"class": STATEMENT + "SetNextHop", "expr": {"class": EXPR + "IpNextHop", "ips": tokens[2:]}}
+    return None
+
+
+def RoutingPolicy(name, clauses):
+    """ Chains the route-map clauses by sequence number into the If statements Batfish generates for Cisco.
+
+    :ivar clauses: The {seq: (action, conditions, statements)} of the route-map.
+    """
+    statements = [{"class": STATIC_STATEMENT, "type": "ReturnLocalDefaultAction"}]
+    for seq in sorted(clauses, reverse=True):
+        action, conditions, setStatements = clauses[seq]
+        trueStatements = setStatements + [{"class": STATIC_STATEMENT,
+                                           "type": "ReturnTrue" if action == "permit" else "ReturnFalse"}]
+        statements = [{"class": STATEMENT + "If", "comment": "clause: {}".format(seq),
+                       "guard": {"class": EXPR + "Conjunction", "conjuncts": conditions},
+                       "trueStatements": trueStatements, "falseStatements": statements}]
+    return {"name": name, "statements": statements}
+
+
+def AddLine(definition, ParseLine, hostname, text, *args):
+    """ Appends the viModel line ParseLine returns for the text to the lines of the definition, or prints the line and
+    lists it under the "unsupportedLines" of the definition when it is not supported."""
+    try:
+        definition["lines"].append(ParseLine(*args))
+    except UnsupportedLine as error:
+        print("Unsupported line in {}: {} ({})".format(hostname, text, error))
+        definition.setdefault("unsupportedLines", list()).append(text)
+
+
+def ParseConfig(text, fileName):
+    """ Returns the (node name, node model) of a Cisco IOS configuration.
+    Like Batfish the node is named after the lowercased hostname, or the file when there is none.
+    The lines that are not supported are dropped and listed under the "unsupportedLines" of their segment.
+    """
+    hostname = fileName
+    ipAccessLists = {}
+    routeFilterLists = {}
+    route6FilterLists = {}
+    routeMaps = {}
+    unsupportedLines = {}
+    for header, children in Stanzas(text):
+        tokens = header.split()
+        if tokens[0] == "hostname" and len(tokens) > 1:
+            hostname = tokens[1]
+        elif tokens[:2] == ["ip", "access-list"] and len(tokens) == 4 and tokens[2] in ("standard", "extended"):
+            acl = ipAccessLists.setdefault(tokens[3], {"name": tokens[3], "lines": []})
+            for child in children:
+                entry = child.split()
+                if entry[0].isdigit():
+                    entry = entry[1:]
+                if entry and entry[0] in ("permit", "deny"):
+                    AddLine(acl, AclLine, hostname, child, child, tokens[2] == "standard")
+        elif tokens[0] == "access-list" and len(tokens) > 3 and tokens[1].isdigit() and tokens[2] in ("permit", "deny"):
+            number = int(tokens[1])
+            standard = number < 100 or 1300 <= number < 2000
+            acl = ipAccessLists.setdefault(tokens[1], {"name": tokens[1], "lines": []})
+            AddLine(acl, AclLine, hostname, header, " ".join(tokens[2:]), standard)
+        elif tokens[1:2] == ["prefix-list"] and tokens[0] in ("ip", "ipv6") and len(tokens) > 4:
+            if tokens[3] == "description":
+                continue
+            lists = route6FilterLists if tokens[0] == "ipv6" else routeFilterLists
+            prefixList = lists.setdefault(tokens[2], {"name": tokens[2], "lines": []})
+            AddLine(prefixList, PrefixListLine, hostname, header, tokens[3:], tokens[0] == "ipv6")
+        elif tokens[0] == "route-map" and len(tokens) > 1:
+            clauses = routeMaps.setdefault(tokens[1], {})
+            action = tokens[2] if len(tokens) > 2 else "permit"
+            seq = int(tokens[3]) if len(tokens) > 3 else max(clauses, default=0) + 10
+            conditions = list()
+            statements = list()
+            for child in children:
+                entry = child.split()
+                if entry[0] == "match":
+                    condition = MatchCondition(entry[1:])
+                    if condition is None:
+                        print("Unsupported route-map line in {}: {}".format(hostname, child))
+                        unsupportedLines.setdefault(tokens[1], []).append(child.strip())
+                    else:
+                        conditions.append(condition)
+                elif entry[0] == "set":
+                    statement = SetStatement(entry[1:])
+                    if statement is None:
+                        print("Unsupported route-map line in {}: {}".format(hostname, child))
+                        unsupportedLines.setdefault(tokens[1], []).append(child.strip())
+                    else:
+                        statements.append(statement)
+            clauses[seq] = (action, conditions, statements)
+    nodeModel = {"configurationFormat": CONFIGURATION_FORMAT, "ipAccessLists": ipAccessLists}
+    if routeFilterLists:
+        nodeModel["routeFilterLists"] = routeFilterLists
+    if route6FilterLists:
+        nodeModel["route6FilterLists"] = route6FilterLists
+    if routeMaps:
+        nodeModel["routingPolicies"] = {name: RoutingPolicy(name, routeMaps[name]) for name in routeMaps}
+        # Not part of the Batfish model, it lets SelfStarter flag the route-maps it only partially knows.
+        for name in unsupportedLines:
+            nodeModel["routingPolicies"][name]["unsupportedLines"] = unsupportedLines[name]
+    return hostname.lower(), nodeModel
+
+
+def ConfigFiles(directory):
+    """Returns the configuration files of a snapshot directory, i.e. of its configs folder if it has one."""
+    if os.path.isdir(os.path.join(directory, "configs")):
+        directory = os.path.join(directory, "configs")
+    return sorted(os.path.join(root, name) for root, _, files in os.walk(directory)
+                  for name in files if not name.startswith("."))
+
+
+def ParseDirectory(directory, nodeRegexPattern):
+    """Returns the viModel nodes of the configurations in the snapshot directory whose names match the nodeRegexPattern."""
+    nodes = {}
+    for filePath in ConfigFiles(directory):
+        with open(filePath, "r", errors="replace") as f:
+            node, nodeModel = ParseConfig(f.read(), os.path.basename(filePath))
+        if nodeRegexPattern.match(node):
+            nodes[node] = nodeModel
+    return nodes
+
+
+def CompareSegments(nativeNodes, batfishNodes):
+    """ Compares the block sequences SelfStarter builds from both models and returns the differences found."""
+    import ACL
+    import commonFunctions
+    import PrefixList
+    import RoutePolicy
+
+    blockSequences = (("ipAccessLists", ACL.GetBlockSequence), ("routeFilterLists", PrefixList.GetBlockSequence),
+                      ("route6FilterLists", PrefixList.GetBlockSequence), ("routingPolicies", RoutePolicy.GetBlockSequence))
+    differences = list()
+    for node in sorted(set(nativeNodes) | set(batfishNodes)):
+        if node not in nativeNodes or node not in batfishNodes:
+            differences.append("{}: only found by {}".format(
+                node, "the native parser" if node in nativeNodes else "Batfish"))
+            continue
+        for segmentType, GetBlockSequence in blockSequences:
+            names = set(nativeNodes[node].get(segmentType, {})) | set(batfishNodes[node].get(segmentType, {}))
+            for name in sorted(names):
+                # Batfish generated segments have no counterpart in the configuration.
+                if name.startswith("~"):
+                    continue
+                sequences = list()
+                for nodes in (nativeNodes, batfishNodes):
+                    segments, _ = GetBlockSequence(node, nodes[node], re.compile(re.escape(name) + "$"), set(), set(), commonFunctions.ExactMatchMap())
+                    sequences.append([vars(block) for segment in segments for block in segment.blocks])
+                if sequences[0] != sequences[1]:
+                    differences.append("{}: {} {} differs".format(node, segmentType, name))
+    return differences
+
+
+if __name__ == '__main__':
+    arguments = docopt(doc)
+    if arguments["parse"]:
+        nodes = ParseDirectory(arguments["<directory>"], re.compile(".*"))
+        with open(arguments["<answerFile>"], "w") as write_file:
+            json.dump({"answerElements": [{"nodes": nodes}]}, write_file)
+        print("Wrote {} nodes to {}".format(len(nodes), arguments["<answerFile>"]))
+    if arguments["record"]:
+        from pybatfish.client.commands import bf_init_snapshot, bf_set_network
+        from pybatfish.question import bfq
+        from pybatfish.question.question import load_questions
+        bf_set_network("batfish")
+        bf_init_snapshot(arguments["<directory>"], name="native", overwrite=True)
+        load_questions()
+        answer = bfq.viModel().answer()["answerElements"][0]
+        with open(arguments["<answerFile>"], "w") as write_file:
+            json.dump({"answerElements": [{"nodes": answer.get("nodes", {})}]}, write_file, indent=1, sort_keys=True)
+        print("Wrote {} nodes to {}".format(len(answer.get("nodes", {})), arguments["<answerFile>"]))
+    if arguments["compare"]:
+        import ViModelStream
+        nodeRegexPattern = re.compile(arguments["--nodeRegex"])
+        with open(arguments["<answerFile>"], "rb") as answerFile:
+            batfishNodes = dict(ViModelStream.IterNodes(answerFile, nodeRegexPattern))
+        differences = CompareSegments(ParseDirectory(arguments["<directory>"], nodeRegexPattern), batfishNodes)
+        print("\n".join(differences) if differences else "The parsed segments match the Batfish answer")
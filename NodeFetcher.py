@@ -0,0 +1,114 @@
+import http.client
+import json
+import re
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import ViModelStream
+
+RETRY_DELAY = 1  # Seconds before the first retry, doubled on every further retry.
+
+
+class HttpAnswerSource:
+    """ Retrieves viModel answers for batches of nodes from an answer server such as StandInServer.
+    Every worker thread keeps its own persistent connection to the server.
+
+    :ivar url: The base URL of the answer server.
+    """
+
+    def __init__(self, url, timeout=300):
+        parsedUrl = urllib.parse.urlsplit(url)
+        self.host = parsedUrl.hostname
+        self.port = parsedUrl.port or 80
+        self.basePath = parsedUrl.path.rstrip("/")
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def connection(self):
+        if getattr(self.local, "connection", None) is None:
+            self.local.connection = http.client.HTTPConnection(
+                self.host, self.port, timeout=self.timeout)
+        return self.local.connection
+
+    def request(self, method, path, body=None):
+        """Sends the request on the thread's connection and returns the response, dropping the connection on errors."""
+        connection = self.connection()
+        try:
+            headers = {"Content-Type": "application/json"} if body is not None else {}
+            connection.request(method, self.basePath + path, body=body, headers=headers)
+            response = connection.getresponse()
+            if response.status != 200:
+                response.read()
+                raise http.client.HTTPException(
+                    "Answer server returned {} for {}".format(response.status, path))
+            return response
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            self.local.connection = None
+            raise
+
+    def NodeNames(self):
+        response = self.request("GET", "/nodes")
+        return json.loads(response.read())
+
+    def FetchBatch(self, nodes, nodeRegexPattern):
+        response = self.request(
+            "POST", "/viModel", json.dumps({"nodes": nodes}).encode())
+        models = list(ViModelStream.IterNodes(response, nodeRegexPattern))
+        # The rest of the answer has to be drained before the connection can be reused.
+        response.read()
+        return models
+
+
+class BatfishAnswerSource:
+    """ Retrieves viModel answers for batches of nodes from the Batfish service of the current pybatfish session."""
+
+    def NodeNames(self):
+        from pybatfish.question import bfq
+        rows = bfq.nodeProperties(properties="Configuration_Format").answer()[
+            "answerElements"][0]["rows"]
+        return [row["Node"]["name"] if isinstance(row["Node"], dict) else row["Node"] for row in rows]
+
+    def FetchBatch(self, nodes, nodeRegexPattern):
+        from pybatfish.question import bfq
+        nodesSpecifier = "/^(" + "|".join(re.escape(n) for n in nodes) + ")$/"
+        answer = bfq.viModel(nodes=nodesSpecifier).answer()[
+            "answerElements"][0]
+        return [(node, ViModelStream.ProjectNode(model)) for node, model in answer.get("nodes", {}).items()
+                if nodeRegexPattern.match(node)]
+
+
+def FetchWithRetry(source, nodes, nodeRegexPattern, retries):
+    delay = RETRY_DELAY
+    for attempt in range(retries + 1):
+        try:
+            return source.FetchBatch(nodes, nodeRegexPattern)
+        except (OSError, ValueError, http.client.HTTPException) as error:
+            if attempt == retries:
+                raise
+            print("Retrying a batch of {} nodes after: {}".format(len(nodes), error))
+            time.sleep(delay)
+            delay *= 2
+
+
+def FetchNodes(source, nodeRegexPattern, batchSize, workers, retries=3):
+    """ Yields the (name, model) of the nodes matching the nodeRegexPattern in the order of their names, the nodes of a
+    batch as soon as it and the batches before it arrived, while the later batches are still being fetched.
+
+    :ivar source: The HttpAnswerSource or BatfishAnswerSource to ask for the node models.
+    :ivar batchSize: The number of nodes asked for in a single request (0 for a single request with all nodes).
+    :ivar workers: The maximum number of requests in flight.
+    :ivar retries: The number of times a failed batch is retried before giving up.
+    """
+    names = [node for node in source.NodeNames() if nodeRegexPattern.match(node)]
+    if not names:
+        return
+    batchSize = batchSize or len(names)
+    batches = [names[i:i+batchSize] for i in range(0, len(names), batchSize)]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(FetchWithRetry, source, batch, nodeRegexPattern, retries)
+                   for batch in batches]
+        for future in futures:
+            yield from future.result()
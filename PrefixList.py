@@ -1,4 +1,5 @@
 import argparse
+import bisect
 import collections
 import copy
 import json
@@ -6,21 +7,17 @@ import os
 import pprint
 import re
 
-import pandas as pd
-import plotly
-import plotly.graph_objs as go
-from docopt import docopt
-from matplotlib import cm
-from matplotlib.colors import rgb2hex
-from munkres import Munkres
 from operator import itemgetter
 
-import commonFunctions
 import ACL
+import Assignment
+import commonFunctions
 
 LINE_PENALTY = 14
 ATTRIBUTES = 11
 LINENUM = -1  # Line number attribute in a line
+# Smaller cost matrices are built line by line, encoding their lines as arrays costs more than it saves.
+MIN_VECTORIZED_CELLS = 64
 
 
 class Block:
@@ -29,6 +26,8 @@ class Block:
     :ivar lineNum: The line number in the sequence of blocks.
     :ivar blockJson: The representation of a parsed block  in JSON. 
     :ivar action: Whether its a permit or deny block.
+    :ivar lineHashes: The hash of every line without its line number.
+    :ivar hash: The hash of the action and the lines of the block.
     
     Representation based on batfish parser
         For example, if "ipwildcard" = 10.30.0.0/15 (2000:0:0:0:0:0:0:0/3) and "lengthRange" : 15-20 (3-128) 
@@ -75,6 +74,17 @@ class Block:
                 for i, doubleOctet in enumerate(prefixIP.split(":")):
                     line[i+3] = doubleOctet
             self.lines.append(line)
+        self.rehash()
+
+    def __setstate__(self, state):
+        # String hashes differ between interpreters, so unpickled and copied blocks hash their content again.
+        self.__dict__.update(state)
+        self.rehash()
+
+    def rehash(self):
+        """Recomputes the content hashes of the lines and of the block, to be called whenever the lines change."""
+        self.lineHashes = [commonFunctions.LineHash(line, LINENUM) for line in self.lines]
+        self.hash = hash((self.action["type"], tuple(self.lineHashes)))
 
 
 class PrefixList:
@@ -110,7 +120,15 @@ class PrefixList:
         self.blocks.append(Block([startingLineNumber], presentAction, block))
 
 
-def GetBlockSequence(device, deviceInfo, pattern, foundDevices, emptyDefDevices, exactDefMatchMap):
+def NormalForm(prefixListJson):
+    """ Returns the canonical form of the prefix-list that is parsed and compared for exact equality:
+    only the action, prefix and length range of every line.
+    """
+    return {"lines": [{"action": line["action"], "ipWildcard": line["ipWildcard"], "lengthRange": line["lengthRange"]}
+                      for line in prefixListJson["lines"]]}
+
+
+def GetBlockSequence(device, deviceInfo, pattern, foundDevices, emptyDefDevices, exactDefMatchMap, segmentCache=None):
     """ Generates block sequence for prefixlist from the parsed JSON object.
     
     :ivar device: The name of the device.
@@ -118,30 +136,45 @@ def GetBlockSequence(device, deviceInfo, pattern, foundDevices, emptyDefDevices,
     :ivar pattern: The prefixlist pattern that is templated.
     :ivar foundDevices: The set of devices which have at least one prefixlist matching the pattern.
     :ivar emptyDefDevices: The set of devices that have an empty definition for the prefixlist.
-    :ivar exactDefMatchMap: The bookkeeping used for exact equality optimization. 
+    :ivar exactDefMatchMap: The ExactMatchMap used for exact equality optimization.
+    :ivar segmentCache: The SegmentCache to load already parsed prefixlists from (if any).
     """
     patternMatchSegments = []
     patternMatchSegmentsLineCounts = []
-    if deviceInfo.get("routeFilterLists"):
-        # segments = {**deviceInfo.get("routeFilterLists", {}),
-        #             **deviceInfo.get("route6FilterLists", {})}
-        segments = deviceInfo.get("routeFilterLists")
+    # Both the IPv4 and the IPv6 prefix-lists are templated.
+    for segments in (deviceInfo.get("routeFilterLists"), deviceInfo.get("route6FilterLists")):
+        if not segments:
+            continue
         for segmentName in segments:
             if pattern.match(segmentName):
                 if device in foundDevices:
                     rname = device + "#" + segmentName
                 else:
                     rname = device
-                parsedSegment = PrefixList(
-                    segmentName, rname, segments[segmentName], deviceInfo['configurationFormat'])
+                definition = NormalForm(segments[segmentName])
+                digest = commonFunctions.CanonicalDigest(definition)
+                if digest in exactDefMatchMap.emptyDigests:
+                    emptyDefDevices.add(rname)
+                    continue
+                # Identical definitions are only parsed once, for the representative of their group.
+                if exactDefMatchMap.addDuplicate(digest, rname):
+                    foundDevices.add(rname)
+                    continue
+                if segmentCache:
+                    parsedSegment = segmentCache.Parse(
+                        PrefixList, segmentName, rname, definition, deviceInfo['configurationFormat'], digest)
+                else:
+                    parsedSegment = PrefixList(
+                        segmentName, rname, definition, deviceInfo['configurationFormat'])
                 if len(parsedSegment.blocks) > 0 and len(parsedSegment.blocks[0].lines) > 0:
                     foundDevices.add(rname)
-                    if not commonFunctions.checkJSONEquality(exactDefMatchMap, segments[segmentName], rname):
-                        # Last block's last line's (-1) attribute.
-                        totalLines = parsedSegment.blocks[-1].lines[-1][LINENUM]
-                        patternMatchSegments.append(parsedSegment)
-                        patternMatchSegmentsLineCounts.append(totalLines)
+                    exactDefMatchMap.addRepresentative(digest, rname, definition)
+                    # Last block's last line's (-1) attribute.
+                    totalLines = parsedSegment.blocks[-1].lines[-1][LINENUM]
+                    patternMatchSegments.append(parsedSegment)
+                    patternMatchSegmentsLineCounts.append(totalLines)
                 else:
+                    exactDefMatchMap.emptyDigests.add(digest)
                     emptyDefDevices.add(rname)
     return patternMatchSegments, patternMatchSegmentsLineCounts
 
@@ -156,6 +189,24 @@ def LineSequence(block):
     return block.lines
 
 
+def LineNumber(line):
+    """Returns the line number of a line."""
+    return line[LINENUM]
+
+
+def ScoreLowerBound(block1, block2):
+    """Returns a lower bound of the MisMatchScore of two blocks, the penalty of the lines that are left unmatched."""
+    if block1.action["type"] != block2.action["type"]:
+        return commonFunctions.INFINITY
+    return LINE_PENALTY*abs(len(block1.lines) - len(block2.lines))
+
+
+def BlockDigest(block):
+    """Returns a digest of the action and lines of the block, leaving out the line numbers."""
+    return commonFunctions.CanonicalDigest([block.action["type"], [{key: value for key, value in line.items() if key != LINENUM}
+                                                                  for line in block.lines]])
+
+
 def LineScore(templateLine, deviceLine, paramValueMap):
     """Returns the score for matching the line from the metatemplate with a line from the device."""
     score = 0
@@ -171,36 +222,134 @@ def LineScore(templateLine, deviceLine, paramValueMap):
     return score
 
 
-def BipartiteMatching(LS1, LS2, paramValueMap, noOfAttributes):
-    """ Score and matching calculator for matching LineSequence1 with LineSequence2."""
-    #Based on the number of attributes in a line pick the appropriate entities either for ACL or prefixlist
+def CostMatrix(LS1, LS2, paramValueMap, noOfAttributes):
+    """ Returns the LineScore of every line of LS1 with every line of LS2, computed at once with numpy on the lines encoded
+    as integer codes of their attribute values (0 for a missing value). The ACL lines must share their protocol, as the
+    partitions of AssignLines do.
+    """
+    import numpy
+    codes = {}
+
+    def Encode(lines):
+        return numpy.array([[codes.setdefault(line[i], len(codes)+1) if line.get(i) else 0 for i in range(noOfAttributes)]
+                            for line in lines], dtype=numpy.int64).reshape(len(lines), noOfAttributes)
+
+    templateCodes = Encode(LS1)[:, None, :]
+    deviceCodes = Encode(LS2)[None, :, :]
+    # Every parameter of the template gets a row of the known mask, marking the codes of its values in the devices.
+    paramRows = numpy.zeros(len(codes)+1, dtype=numpy.int64)
+    params = [value for value in codes if value in paramValueMap]
+    known = numpy.zeros((len(params)+1, len(codes)+1), dtype=bool)
+    for row, param in enumerate(params, 1):
+        paramRows[codes[param]] = row
+        known[row, [codes[value] for value in paramValueMap[param] if value in codes]] = True
+    costs = numpy.where(templateCodes == deviceCodes, 0, numpy.where(known[paramRows[templateCodes], deviceCodes], 1, 2))
+    costs[(templateCodes == 0) | (deviceCodes == 0)] = 2
+    return costs.sum(axis=2).tolist()
+
+
+def HashMatching(lineHashes1, lineHashes2):
+    """Returns the matching of the lines with equal hashes, in the order of the lines of the second block."""
+    ls1HashMap = {}
+    matched = []
+    for i, hashValue in enumerate(lineHashes1):
+        ls1HashMap.setdefault(hashValue, list()).append(i)
+    for j, hashValue in enumerate(lineHashes2):
+        matches = ls1HashMap.get(hashValue)
+        if matches:
+            matched.append((matches.pop(), j))
+            if not matches:
+                del ls1HashMap[hashValue]
+    return matched
+
+
+def AssignLines(newLS1, newLS2, rows, columns, paramValueMap, noOfAttributes, solver, approxThreshold):
+    """ Returns the (x, y, score) of the minimum cost assignment of the lines rows of newLS1 to the lines columns of
+    newLS2. ACL lines of different protocols only match at an INFINITY score, so the lines of every protocol are matched
+    on their own and the lines left over pay the line penalty as if they were matched across protocols."""
     if noOfAttributes == ATTRIBUTES:
         LineScoreFunc = LineScore
-        linePenalty = LINE_PENALTY
+        partitions = [(list(rows), list(columns))] if rows and columns else []
     else:
         LineScoreFunc = ACL.LineScore
+        partitions = [([rows[x] for x in partRows], [columns[y] for y in partColumns]) for partRows, partColumns in
+                      commonFunctions.PartitionLines([newLS1[x] for x in rows], [newLS2[y] for y in columns], itemgetter(-2))]
+    indicies = []
+    for partRows, partColumns in partitions:
+        partLS1 = [newLS1[x] for x in partRows]
+        partLS2 = [newLS2[y] for y in partColumns]
+        if len(partLS1)*len(partLS2) >= MIN_VECTORIZED_CELLS:
+            similarityMatrix = CostMatrix(partLS1, partLS2, paramValueMap, noOfAttributes)
+        else:
+            similarityMatrix = []
+            for tline in partLS1:
+                row = []
+                for dline in partLS2:
+                    row.append(LineScoreFunc(tline, dline, paramValueMap))
+                similarityMatrix.append(row)
+        for x, y in Assignment.Assign(similarityMatrix, solver, approxThreshold):
+            indicies.append((partRows[x], partColumns[y], similarityMatrix[x][y]))
+    return indicies
+
+
+def WindowMatching(lineHashes1, lineHashes2, newLS1, newLS2, ls1Map, ls2Map, window, paramValueMap, noOfAttributes,
+                   solver, approxThreshold):
+    """ Returns the (x, y, score) of the lines of newLS1 and newLS2 matched within the windows between consecutive
+    anchors, the identical lines occurring once in both blocks and in the same order. Every window reaches window lines
+    past its anchors so that lines moved a little can still match, and the lines a window matched are not offered to the
+    next ones. The lines left unmatched by the windows, few when the differences are local, are then matched with each
+    other at once so that lines moved farther still match. Only the pairs below INFINITY are returned."""
+    bounds = [(-1, -1)]
+    bounds.extend(commonFunctions.UniqueAnchors(lineHashes1, lineHashes2, 0, len(lineHashes1), 0, len(lineHashes2)))
+    bounds.append((len(lineHashes1), len(lineHashes2)))
+    positions1 = [ls1Map[x] for x in range(len(newLS1))]
+    positions2 = [ls2Map[y] for y in range(len(newLS2))]
+    free1 = [True]*len(newLS1)
+    free2 = [True]*len(newLS2)
+    indicies = []
+    for (start1, start2), (end1, end2) in zip(bounds, bounds[1:]):
+        rows = [x for x in range(bisect.bisect_left(positions1, start1 - window),
+                                 bisect.bisect_right(positions1, end1 + window)) if free1[x]]
+        columns = [y for y in range(bisect.bisect_left(positions2, start2 - window),
+                                    bisect.bisect_right(positions2, end2 + window)) if free2[y]]
+        if not rows or not columns:
+            continue
+        for x, y, score in AssignLines(newLS1, newLS2, rows, columns, paramValueMap, noOfAttributes, solver,
+                                       approxThreshold):
+            # Pairs of two spilled over lines are left to the window the lines are in.
+            inside = start1 < positions1[x] < end1 or start2 < positions2[y] < end2
+            if score != commonFunctions.INFINITY and inside:
+                free1[x] = free2[y] = False
+                indicies.append((x, y, score))
+    rows = [x for x in range(len(newLS1)) if free1[x]]
+    columns = [y for y in range(len(newLS2)) if free2[y]]
+    if rows and columns:
+        indicies.extend((x, y, score) for x, y, score in AssignLines(newLS1, newLS2, rows, columns, paramValueMap,
+                                                                     noOfAttributes, solver, approxThreshold)
+                        if score != commonFunctions.INFINITY)
+    return indicies
+
+
+def BipartiteMatching(LS1, LS2, paramValueMap, noOfAttributes, lineHashes1=None, lineHashes2=None, solver=None,
+                      approxThreshold=0, window=0):
+    """ Score and matching calculator for matching LineSequence1 with LineSequence2, using the precomputed line hashes of
+    the blocks when given and the named Assignment solver, or the approximate one above approxThreshold lines. With a
+    window the lines are only matched within the windows between the identical lines (WindowMatching)."""
+    #Based on the number of attributes in a line pick the appropriate entities either for ACL or prefixlist
+    if noOfAttributes == ATTRIBUTES:
+        linePenalty = LINE_PENALTY
+    else:
         linePenalty = ACL.LINE_PENALTY
 
-    #Remove exactly equal Lines to speedup Munkres algorithm
-    ls1HashMap = {}
-    ls1Matched = set()
-    ls2Matched = set()
-    matched = []
+    #Remove exactly equal Lines to speedup the assignment solver
     # For each line remove the lineNumber attribute
-    for i, l1 in enumerate(LS1):
-        ls1HashMap.setdefault(
-            hash(frozenset(filter(lambda a: a[0] != LINENUM, l1.items()))), list()).append(i)
-    for j, l2 in enumerate(LS2):
-        hashValue = hash(frozenset(filter(lambda a: a[0] != LINENUM, l2.items())))
-        matches = ls1HashMap.get(hashValue)
-        if matches:
-            ls1Matched.add(matches[-1])
-            ls2Matched.add(j)
-            matched.append((matches[-1], j))
-            if len(matches) == 1:
-                del ls1HashMap[hashValue]
-            else:
-                del ls1HashMap[hashValue][-1]
+    if lineHashes1 is None:
+        lineHashes1 = [commonFunctions.LineHash(l1, LINENUM) for l1 in LS1]
+    if lineHashes2 is None:
+        lineHashes2 = [commonFunctions.LineHash(l2, LINENUM) for l2 in LS2]
+    matched = HashMatching(lineHashes1, lineHashes2)
+    ls1Matched = set(i for i, _ in matched)
+    ls2Matched = set(j for _, j in matched)
 
     newLS1 = []
     ls1Map = {}
@@ -218,28 +367,25 @@ def BipartiteMatching(LS1, LS2, paramValueMap, noOfAttributes):
             ls2Map[x] = i
             newLS2.append(line)
             x += 1
-    similarityMatrix = []
-    for tline in newLS1:
-        row = []
-        for dline in newLS2:
-            row.append(LineScoreFunc(tline, dline, paramValueMap))
-        similarityMatrix.append(row)
-    indicies = []
+    if window and newLS1 and newLS2:
+        indicies = WindowMatching(lineHashes1, lineHashes2, newLS1, newLS2, ls1Map, ls2Map, window, paramValueMap,
+                                  noOfAttributes, solver, approxThreshold)
+    else:
+        indicies = AssignLines(newLS1, newLS2, range(len(newLS1)), range(len(newLS2)), paramValueMap, noOfAttributes,
+                               solver, approxThreshold)
     matchScore = 0
-    if len(similarityMatrix) > 0:
-        m = Munkres()
-        indicies = m.compute(similarityMatrix)
-        for x, y in indicies:
-            if similarityMatrix[x][y] != commonFunctions.INFINITY:
-                matched.append((ls1Map[x], ls2Map[y]))
-                matchScore += similarityMatrix[x][y]
-            else:
-                matchScore += linePenalty
+    for x, y, score in sorted(indicies):
+        if score != commonFunctions.INFINITY:
+            matched.append((ls1Map[x], ls2Map[y]))
+            matchScore += score
+        else:
+            matchScore += linePenalty
+    matchScore += linePenalty*(min(len(newLS1), len(newLS2)) - len(indicies))
     matchScore += linePenalty*abs(len(LS1)-len(LS2))
     return matchScore, matched
 
 
-def MergeLines(templateLines, deviceLines, lineNum, parametersLines, matching, oldtoNewLineMap, newDeviceLines, device, noOfAttributes):
+def MergeLines(templateLines, deviceLines, lineNum, parametersLines, matching, oldtoNewLineMap, newDeviceLines, device, noOfAttributes, deviceLineMap):
 
     combinedLines = []
     paramValueMap = parametersLines.parameterDistribution()
@@ -262,6 +408,7 @@ def MergeLines(templateLines, deviceLines, lineNum, parametersLines, matching, o
     for i, line in enumerate(deviceLines):
         if i in deviceLeftout:
             line = copy.deepcopy(line)
+            deviceLineMap[line[LINENUM]] = lineNum
             line[LINENUM] = lineNum
             newDeviceLines.append(lineNum)
             lineNum += 1
@@ -292,6 +439,7 @@ def MergeLines(templateLines, deviceLines, lineNum, parametersLines, matching, o
                     parametersLines.addParameter(param, "", device)
                     line[attribute] = param
         oldtoNewLineMap[line[LINENUM]] = lineNum
+        deviceLineMap[dLine[LINENUM]] = lineNum
         line[LINENUM] = lineNum
         newDeviceLines.append(lineNum)
         lineNum += 1
@@ -300,9 +448,12 @@ def MergeLines(templateLines, deviceLines, lineNum, parametersLines, matching, o
     return combinedLines, lineNum
 
 
-def TemplateGenerator(block1Alignment, block2Alignment, lineMatchings, parametersLines, device, noOfAttributes):
-    """ Given the alignment and line matchings the function returns the merged terms."""
+def TemplateGenerator(block1Alignment, block2Alignment, lineMatchings, parametersLines, device, noOfAttributes, deviceLineMap=None):
+    """ Given the alignment and line matchings the function returns the merged terms.
+    The new line numbers of the device lines are recorded in the deviceLineMap (if given)."""
 
+    if deviceLineMap is None:
+        deviceLineMap = {}
     oldtoNewLineMap = {}
     newDeviceLines = list()
     mergedBlocks = list()
@@ -316,6 +467,7 @@ def TemplateGenerator(block1Alignment, block2Alignment, lineMatchings, parameter
                 if block2Alignment[i] != []:
                     block = copy.deepcopy(block2Alignment[i])
                     for line in block.lines:
+                        deviceLineMap[line[LINENUM]] = lineNum
                         line[LINENUM] = lineNum
                         newDeviceLines.append(lineNum)
                         lineNum += 1
@@ -331,7 +483,8 @@ def TemplateGenerator(block1Alignment, block2Alignment, lineMatchings, parameter
                 else:
                     block = copy.deepcopy(v)
                     block.lines, lineNum = MergeLines(
-                        block.lines, block2Alignment[i].lines, lineNum, parametersLines, lineMatchings[j], oldtoNewLineMap, newDeviceLines, device, noOfAttributes)
+                        block.lines, block2Alignment[i].lines, lineNum, parametersLines, lineMatchings[j], oldtoNewLineMap, newDeviceLines, device, noOfAttributes, deviceLineMap)
+                    block.rehash()
                     j += 1
                     mergedBlocks.append(block)
     parametersLines.remapLineNumbers(oldtoNewLineMap)
@@ -339,6 +492,51 @@ def TemplateGenerator(block1Alignment, block2Alignment, lineMatchings, parameter
     return mergedBlocks
 
 
+def ReorderMerge(metaTemplate, segment, parametersLines, device):
+    """ Merges the segment of the device into the metaTemplate without aligning them when every block of the segment only
+    reorders the lines of the corresponding template block. The template lines take the order of the device lines, as
+    TemplateGenerator would have done.
+    Returns False and leaves the metaTemplate untouched if the segment differs in any other way.
+    """
+    if len(metaTemplate.blocks) != len(segment.blocks):
+        return False
+    for tBlock, dBlock in zip(metaTemplate.blocks, segment.blocks):
+        if tBlock.action["type"] != dBlock.action["type"] or \
+                collections.Counter(tBlock.lineHashes) != collections.Counter(dBlock.lineHashes):
+            return False
+    oldtoNewLineMap = {}
+    newDeviceLines = list()
+    lineNum = 0
+    for tBlock, dBlock in zip(metaTemplate.blocks, segment.blocks):
+        if tBlock.hash == dBlock.hash:
+            matching = commonFunctions.IdentityMatching(tBlock.lineHashes)
+        else:
+            matching = HashMatching(tBlock.lineHashes, dBlock.lineHashes)
+        lines = list()
+        for i, _ in matching:
+            line = tBlock.lines[i]
+            oldtoNewLineMap[line[LINENUM]] = lineNum
+            line[LINENUM] = lineNum
+            newDeviceLines.append(lineNum)
+            lineNum += 1
+            lines.append(line)
+        tBlock.lines = lines
+        tBlock.rehash()
+    parametersLines.remapLineNumbers(oldtoNewLineMap)
+    parametersLines.lineMapping[device] = newDeviceLines
+    return True
+
+
+def RenameParameters(metaTemplate, renameMap, noOfAttributes):
+    """Renames the parameters of the metatemplate lines that are in the renameMap."""
+    for block in metaTemplate.blocks:
+        for line in block.lines:
+            for attribute in range(noOfAttributes):
+                if line[attribute] in renameMap:
+                    line[attribute] = renameMap[line[attribute]]
+        block.rehash()
+
+
 def ModifyErase(metaTemplate, parametersLines, replaceWith, eraseList, noOfAttributes):
     """ Replaces all the parameters in the eraselist with replacewith in the metatemplate."""
     for block in metaTemplate.blocks:
@@ -415,6 +613,8 @@ def MinimizeParameters(metaTemplate, parametersLines, noOfAttributes):
         metaTemplate.blocks[-1].lines[-1][LINENUM])
     parametersLines.groupAndSortPredicates(metaTemplate)
     RemapParameters(metaTemplate, parametersLines, noOfAttributes)
+    for block in metaTemplate.blocks:
+        block.rehash()
 
 
 def FormatBlock(configFormat, action, lines, linePredicateMap, patternString):
@@ -502,6 +702,7 @@ def PrintTemplate(metaTemplate, parametersLines, outputDirectory, patternString,
         commonFunctions.createFolder(finalPath)
         # with open(finalPath + os.path.sep + "parameters.json", "w") as write_param:
         #     json.dump(parameterTable, write_param, sort_keys=True, indent=2)
+        import pandas as pd
         df = pd.DataFrame(parameterTable)
         df.to_csv(finalPath + os.path.sep + "parameters.csv")
 
@@ -8,14 +8,8 @@ import re
 from operator import itemgetter
 from warnings import warn
 
-import pandas as pd
-import plotly
-import plotly.graph_objs as go
-from docopt import docopt
-from matplotlib import cm
-from matplotlib.colors import rgb2hex
-from munkres import Munkres
 
+import Assignment
 import commonFunctions
 
 LINENUM = "lineNum"
@@ -27,6 +21,8 @@ class Block:
     
     :ivar lineNum: The line number in the sequence of terms.
     :ivar termJson: The representation of a parsed term  in JSON. 
+    :ivar lineHashes: The hashes of the guard cmds and of the true cmds without their line numbers.
+    :ivar hash: The hash of the action and the cmds of the term.
     """
 
     def __init__(self, lineNum, guard, trueStatements):
@@ -130,6 +126,17 @@ class Block:
                     copyCmd[LINENUM] = lineNum[0]
                     lineNum[0] += 1
                     self.trueCmds.append(copyCmd)
+        self.rehash()
+
+    def __setstate__(self, state):
+        # String hashes differ between interpreters, so unpickled and copied terms hash their content again.
+        self.__dict__.update(state)
+        self.rehash()
+
+    def rehash(self):
+        """Recomputes the content hashes of the cmds and of the term, to be called whenever the cmds change."""
+        self.lineHashes = [[CmdHash(cmd) for cmd in self.guardCmds], [CmdHash(cmd) for cmd in self.trueCmds]]
+        self.hash = hash((self.action["type"], tuple(self.lineHashes[0]), tuple(self.lineHashes[1])))
 
     def checkGuardCmdSyntax(self, cmd):
         if "ConjunctionChain" in cmd["class"]:
@@ -268,7 +275,26 @@ class RoutePolicy:
                         soFarstmts.append(stmt)
 
 
-def GetBlockSequence(device, deviceInfo, pattern, foundDevices, emptyDefDevices, exactDefMatchMap):
+def NormalForm(statements):
+    """ Returns the canonical form of the route policy statements that is parsed and compared for exact equality:
+    BufferedStatement wrappers are removed, as are the Comment statements and the comments of the clauses
+    (which carry the sequence numbers).
+    """
+    normalized = list()
+    for stmt in statements:
+        if "BufferedStatement" in stmt["class"]:
+            stmt = stmt["statement"]
+        if stmt["class"].endswith(".Comment"):
+            continue
+        stmt = {key: value for key, value in stmt.items() if key != "comment"}
+        for key in ("trueStatements", "falseStatements"):
+            if key in stmt:
+                stmt[key] = NormalForm(stmt[key])
+        normalized.append(stmt)
+    return normalized
+
+
+def GetBlockSequence(device, deviceInfo, pattern, foundDevices, emptyDefDevices, exactDefMatchMap, segmentCache=None):
     """ Generates block sequence for route policy from the parsed JSON object.
     
     :ivar device: The name of the device.
@@ -276,7 +302,8 @@ def GetBlockSequence(device, deviceInfo, pattern, foundDevices, emptyDefDevices,
     :ivar pattern: The routepolicy pattern that is templated.
     :ivar foundDevices: The set of devices which have at least one routepolicy matching the pattern.
     :ivar emptyDefDevices: The set of devices that have an empty definition for the routepolicy.
-    :ivar exactDefMatchMap: The bookkeeping used for exact equality optimization. 
+    :ivar exactDefMatchMap: The ExactMatchMap used for exact equality optimization.
+    :ivar segmentCache: The SegmentCache to load already parsed route policies from (if any).
     """
     patternMatchPolicies = []
     patternMatchPoliciesLineCounts = []
@@ -288,20 +315,34 @@ def GetBlockSequence(device, deviceInfo, pattern, foundDevices, emptyDefDevices,
                     rname = device + "#" + policyName
                 else:
                     rname = device
-                routePolicy = RoutePolicy(
-                    policyName, rname, routePolicies[policyName]["statements"], deviceInfo['configurationFormat'])
+                definition = NormalForm(routePolicies[policyName]["statements"])
+                digest = commonFunctions.CanonicalDigest(definition)
+                if digest in exactDefMatchMap.emptyDigests:
+                    emptyDefDevices.add(rname)
+                    continue
+                # Identical definitions are only parsed once, for the representative of their group.
+                if exactDefMatchMap.addDuplicate(digest, rname):
+                    foundDevices.add(rname)
+                    continue
+                if segmentCache:
+                    routePolicy = segmentCache.Parse(
+                        RoutePolicy, policyName, rname, definition, deviceInfo['configurationFormat'], digest)
+                else:
+                    routePolicy = RoutePolicy(
+                        policyName, rname, definition, deviceInfo['configurationFormat'])
                 if len(routePolicy.blocks) > 0:
                     foundDevices.add(rname)
-                    if not commonFunctions.checkJSONEquality(exactDefMatchMap, routePolicies[policyName], rname):
-                        if len(routePolicy.blocks[-1].trueCmds) > 0:
-                            totalLines = routePolicy.blocks[-1].trueCmds[-1][LINENUM]
-                        elif len(routePolicy.blocks[-1].guardCmds) > 0:
-                            totalLines = routePolicy.blocks[-1].guardCmds[-1][LINENUM]
-                        else:
-                            totalLines = routePolicy.blocks[-1].action[LINENUM]
-                        patternMatchPolicies.append(routePolicy)
-                        patternMatchPoliciesLineCounts.append(totalLines)
+                    exactDefMatchMap.addRepresentative(digest, rname, definition)
+                    if len(routePolicy.blocks[-1].trueCmds) > 0:
+                        totalLines = routePolicy.blocks[-1].trueCmds[-1][LINENUM]
+                    elif len(routePolicy.blocks[-1].guardCmds) > 0:
+                        totalLines = routePolicy.blocks[-1].guardCmds[-1][LINENUM]
+                    else:
+                        totalLines = routePolicy.blocks[-1].action[LINENUM]
+                    patternMatchPolicies.append(routePolicy)
+                    patternMatchPoliciesLineCounts.append(totalLines)
                 else:
+                    exactDefMatchMap.emptyDigests.add(digest)
                     emptyDefDevices.add(rname)
     return patternMatchPolicies, patternMatchPoliciesLineCounts
 
@@ -320,6 +361,31 @@ def LineSequence(block):
     return combinedCmds
 
 
+def LineNumber(cmd):
+    """Returns the line number of a guard or set cmd."""
+    return cmd[LINENUM]
+
+
+def ScoreLowerBound(block1, block2):
+    """ Returns a lower bound of the MisMatchScore of two terms.
+    Unmatched cmds add no penalty in BipartiteMatching, so only terms with different actions are bounded.
+    """
+    if block1.action["type"] != block2.action["type"]:
+        return commonFunctions.INFINITY
+    return 0
+
+
+def BlockDigest(block):
+    """Returns a digest of the action, guard and set cmds of the block, leaving out the line numbers."""
+    return commonFunctions.CanonicalDigest([block.action["type"]] + [[{key: value for key, value in cmd.items() if key != LINENUM}
+                                                                     for cmd in cmds] for cmds in LineSequence(block)])
+
+
+def CmdHash(cmd):
+    """Returns a hash of the content of a cmd, leaving out its line number."""
+    return hash(json.dumps({key: value for key, value in cmd.items() if key != LINENUM}, sort_keys=True))
+
+
 def ConvertToString(value):
     if isinstance(value, str):
         return [value]
@@ -370,49 +436,51 @@ def LineScore(cmd, stmt, paramValueMap):
                         return commonFunctions.INFINITY
                     for k in cmd[key]:
                         if cmd[key][k] != stmt[key][k]:
-                            cmd[key][k] = ConvertToString(cmd[key][k])
-                            stmt[key][k] = ConvertToString(stmt[key][k])
-                            score += LineScoreHelper(cmd[key]
-                                                     [k], stmt[key][k], paramValueMap)
+                            score += LineScoreHelper(ConvertToString(cmd[key][k]),
+                                                     ConvertToString(stmt[key][k]), paramValueMap)
                 else:
                     if cmd[key] != stmt[key]:
-                        cmd[key] = ConvertToString(cmd[key])
-                        stmt[key] = ConvertToString(stmt[key])
-                        score += LineScoreHelper(cmd[key]
-                                                 , stmt[key], paramValueMap)
+                        score += LineScoreHelper(ConvertToString(cmd[key]),
+                                                 ConvertToString(stmt[key]), paramValueMap)
     return score
 
 
-def HungarianMatching(cmds1, cmds2, paramValueMap):
-    """Returns the score and matching for matching the cmds from the metatemplate with the cmds from the device using Hungarian matching algorithm."""
-    similarityMatrix = []
-    for cmd1 in cmds1:
-        row = []
-        for cmd2 in cmds2:
-            row.append(LineScore(cmd1, cmd2, paramValueMap))
-        similarityMatrix.append(row)
+def HungarianMatching(cmds1, cmds2, paramValueMap, solver=None, approxThreshold=0):
+    """Returns the score and matching for matching the cmds from the metatemplate with the cmds from the device using the named Assignment solver.
+    The cmds of every class are matched on their own, since cmds of different classes only match at an INFINITY score."""
     indicies = []
     matched = []
     matchScore = 0
     # Probably have to include extra score for unmatched lines
-    if len(similarityMatrix) > 0:
-        m = Munkres()
-        indicies = m.compute(similarityMatrix)
-        for x, y in indicies:
-            if similarityMatrix[x][y] != commonFunctions.INFINITY:
-                matched.append((x, y))
-                matchScore += similarityMatrix[x][y]
+    for rows, columns in commonFunctions.PartitionLines(cmds1, cmds2, itemgetter("class")):
+        similarityMatrix = []
+        for x in rows:
+            row = []
+            for y in columns:
+                row.append(LineScore(cmds1[x], cmds2[y], paramValueMap))
+            similarityMatrix.append(row)
+        for x, y in Assignment.Assign(similarityMatrix, solver, approxThreshold):
+            indicies.append((rows[x], columns[y], similarityMatrix[x][y]))
+    for x, y, score in sorted(indicies):
+        if score != commonFunctions.INFINITY:
+            matched.append((x, y))
+            matchScore += score
     return matchScore, matched
 
 
-def BipartiteMatching(LS1, LS2, paramValueMap, empty):
-    """ Score and matching calculator for matching LineSequence1 with LineSequence2."""
+def BipartiteMatching(LS1, LS2, paramValueMap, empty, lineHashes1=None, lineHashes2=None, solver=None, approxThreshold=0,
+                      window=0):
+    """ Score and matching calculator for matching LineSequence1 with LineSequence2.
+    The guard or true cmds whose precomputed line hashes agree are matched in order without the Hungarian matching.
+    The window is ignored, the cmds of a term are too few to be matched in windows."""
     score, matchedPairs = 0, []
-    guardScore, guardMatches = HungarianMatching(LS1[0], LS2[0], paramValueMap)
-    setScore, setMatches = HungarianMatching(LS1[1], LS2[1], paramValueMap)
-    score = guardScore + setScore
-    matchedPairs.append(guardMatches)
-    matchedPairs.append(setMatches)
+    for k in range(2):
+        if lineHashes1 is not None and lineHashes2 is not None and lineHashes1[k] == lineHashes2[k]:
+            cmdsScore, cmdsMatches = 0, commonFunctions.IdentityMatching(lineHashes1[k])
+        else:
+            cmdsScore, cmdsMatches = HungarianMatching(LS1[k], LS2[k], paramValueMap, solver, approxThreshold)
+        score += cmdsScore
+        matchedPairs.append(cmdsMatches)
     return score, matchedPairs
 
 
@@ -463,7 +531,7 @@ def CombineValueLists(templateValues, deviceValues, parametersLines, paramValueM
     return matchedTemplateValues
 
 
-def MergeCmds(templateCmds, deviceCmds, lineNum, parametersLines, matching, oldtoNewLineMap, newDeviceLines, device):
+def MergeCmds(templateCmds, deviceCmds, lineNum, parametersLines, matching, oldtoNewLineMap, newDeviceLines, device, deviceLineMap):
     """ Combines the templateCmds with the deviceCmds and returns the merged cmds.
     
     :ivar templateCmds: The cmds from the template.
@@ -493,6 +561,7 @@ def MergeCmds(templateCmds, deviceCmds, lineNum, parametersLines, matching, oldt
     for i, cmd in enumerate(deviceCmds):
         if i in deviceLeftout:
             line = copy.deepcopy(cmd)
+            deviceLineMap[line[LINENUM]] = lineNum
             line[LINENUM] = lineNum
             newDeviceLines.append(lineNum)
             lineNum += 1
@@ -519,6 +588,7 @@ def MergeCmds(templateCmds, deviceCmds, lineNum, parametersLines, matching, oldt
                             tCmd[key] = CombineValueLists(
                                 tCmd[key], dCmd[key], parametersLines, paramValueMap, device)
             oldtoNewLineMap[tCmd[LINENUM]] = lineNum
+            deviceLineMap[dCmd[LINENUM]] = lineNum
             tCmd[LINENUM] = lineNum
             newDeviceLines.append(lineNum)
             lineNum += 1
@@ -528,9 +598,12 @@ def MergeCmds(templateCmds, deviceCmds, lineNum, parametersLines, matching, oldt
     return combinedCmds, lineNum
 
 
-def TemplateGenerator(block1Alignment, block2Alignment, lineMatchings, parametersLines, device, empty):
-    """ Given the alignment and line matchings the function returns the merged terms."""
+def TemplateGenerator(block1Alignment, block2Alignment, lineMatchings, parametersLines, device, empty, deviceLineMap=None):
+    """ Given the alignment and line matchings the function returns the merged terms.
+    The new line numbers of the device lines are recorded in the deviceLineMap (if given)."""
 
+    if deviceLineMap is None:
+        deviceLineMap = {}
     oldtoNewLineMap = {}
     newDeviceLines = list()
     mergedTerms = list()
@@ -543,14 +616,17 @@ def TemplateGenerator(block1Alignment, block2Alignment, lineMatchings, parameter
             if v == []:
                 if block2Alignment[i] != []:
                     term = copy.deepcopy(block2Alignment[i])
+                    deviceLineMap[term.action[LINENUM]] = lineNum
                     term.action[LINENUM] = lineNum
                     newDeviceLines.append(lineNum)
                     lineNum += 1
                     for cmd in term.guardCmds:
+                        deviceLineMap[cmd[LINENUM]] = lineNum
                         cmd[LINENUM] = lineNum
                         newDeviceLines.append(lineNum)
                         lineNum += 1
                     for cmd in term.trueCmds:
+                        deviceLineMap[cmd[LINENUM]] = lineNum
                         cmd[LINENUM] = lineNum
                         newDeviceLines.append(lineNum)
                         lineNum += 1
@@ -573,13 +649,15 @@ def TemplateGenerator(block1Alignment, block2Alignment, lineMatchings, parameter
                 else:
                     term = copy.deepcopy(v)
                     oldtoNewLineMap[term.action[LINENUM]] = lineNum
+                    deviceLineMap[block2Alignment[i].action[LINENUM]] = lineNum
                     term.action[LINENUM] = lineNum
                     newDeviceLines.append(lineNum)
                     lineNum += 1
                     term.guardCmds, lineNum = MergeCmds(
-                        term.guardCmds, block2Alignment[i].guardCmds, lineNum, parametersLines, lineMatchings[j][0], oldtoNewLineMap, newDeviceLines, device)
+                        term.guardCmds, block2Alignment[i].guardCmds, lineNum, parametersLines, lineMatchings[j][0], oldtoNewLineMap, newDeviceLines, device, deviceLineMap)
                     term.trueCmds, lineNum = MergeCmds(
-                        term.trueCmds, block2Alignment[i].trueCmds, lineNum, parametersLines, lineMatchings[j][1], oldtoNewLineMap, newDeviceLines, device)
+                        term.trueCmds, block2Alignment[i].trueCmds, lineNum, parametersLines, lineMatchings[j][1], oldtoNewLineMap, newDeviceLines, device, deviceLineMap)
+                    term.rehash()
                     j += 1
                     mergedTerms.append(term)
     parametersLines.remapLineNumbers(oldtoNewLineMap)
@@ -587,6 +665,32 @@ def TemplateGenerator(block1Alignment, block2Alignment, lineMatchings, parameter
     return mergedTerms
 
 
+def ReorderMerge(metaTemplate, segment, parametersLines, device):
+    """ Merges the route policy of the device into the metaTemplate without aligning them when every term of the policy
+    only reorders the guard and true cmds of the corresponding template term. The template cmds keep their order.
+    Returns False and leaves the metaTemplate untouched if the policy differs in any other way.
+    """
+    if len(metaTemplate.blocks) != len(segment.blocks):
+        return False
+    for tTerm, dTerm in zip(metaTemplate.blocks, segment.blocks):
+        if tTerm.action["type"] != dTerm.action["type"] or \
+                any(collections.Counter(tHashes) != collections.Counter(dHashes)
+                    for tHashes, dHashes in zip(tTerm.lineHashes, dTerm.lineHashes)):
+            return False
+    oldtoNewLineMap = {}
+    newDeviceLines = list()
+    lineNum = 0
+    for term in metaTemplate.blocks:
+        for line in [term.action] + term.guardCmds + term.trueCmds:
+            oldtoNewLineMap[line[LINENUM]] = lineNum
+            line[LINENUM] = lineNum
+            newDeviceLines.append(lineNum)
+            lineNum += 1
+    parametersLines.remapLineNumbers(oldtoNewLineMap)
+    parametersLines.lineMapping[device] = newDeviceLines
+    return True
+
+
 def ModifyEraseHelper(cmd, replaceWith, eraseList):
     for key in cmd:
         if isinstance(cmd[key], dict):
@@ -636,6 +740,25 @@ def ModifyErase(metaTemplate, parametersLines, replaceWith, eraseList):
                 replaceWith, value)
 
 
+def RenameParametersHelper(cmd, renameMap):
+    for key in cmd:
+        if isinstance(cmd[key], dict):
+            # Assuming only depth of 1.
+            for k in cmd[key]:
+                if isinstance(cmd[key][k], list):
+                    cmd[key][k] = [renameMap.get(v, v) for v in cmd[key][k]]
+        elif isinstance(cmd[key], list):
+            cmd[key] = [renameMap.get(v, v) for v in cmd[key]]
+
+
+def RenameParameters(metaTemplate, renameMap, empty):
+    """Renames the parameters of the metatemplate cmds that are in the renameMap."""
+    for block in metaTemplate.blocks:
+        for cmd in block.guardCmds + block.trueCmds:
+            RenameParametersHelper(cmd, renameMap)
+        block.rehash()
+
+
 def RemapParametersHelper(cmd, paramValueMap, oldtoNewParamMap, count):
     for key in cmd:
         if isinstance(cmd[key], dict):
@@ -746,6 +869,8 @@ def MinimizeParameters(metaTemplate, parametersLines, empty):
     parametersLines.predicateGenerator(totalLines)
     # groupAndSortPredicates(metaTemplate)
     RemapParameters(metaTemplate, parametersLines)
+    for block in metaTemplate.blocks:
+        block.rehash()
 
 
 def FormatGuardCmds(guard, linePredicateMap):
@@ -1028,6 +1153,7 @@ def PrintTemplate(metaTemplate, parametersLines, outputDirectory, patternString,
         commonFunctions.createFolder(finalPath)
         # with open(finalPath + os.path.sep + "parameters.json", "w") as write_param:
         #     json.dump(parameterTable, write_param, sort_keys=True, indent=2)
+        import pandas as pd
         df = pd.DataFrame(parameterTable)
         df.to_csv(finalPath + os.path.sep + "parameters.csv")
 
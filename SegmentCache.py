@@ -0,0 +1,60 @@
+import os
+import pickle
+
+import commonFunctions
+from commonFunctions import createFolder
+
+# Bump whenever the ACL, PrefixList or RoutePolicy parsing changes, so that stale parsed segments are not reused.
+PARSER_VERSION = 2
+
+
+class SegmentCache:
+    """ An on-disk cache of the parsed ACL, PrefixList and RoutePolicy objects, keyed by a canonical digest of
+    the segment JSON along with its class, configuration format and the PARSER_VERSION.
+    Entries are kept pickled so that every lookup hands out a fresh object that templating can modify.
+
+    :ivar path: The pickle file holding the cached segments of one segment kind.
+    :ivar entries: The map from the key of a segment to its pickled parsed object.
+    """
+
+    def __init__(self, cacheDir, kind):
+        self.path = os.path.join(cacheDir, "segments_" + kind + ".pickle")
+        self.entries = {}
+        self.changed = False
+        self.hits = 0
+        self.misses = 0
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path, "rb") as f:
+                    self.entries = pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                print("Ignoring the unreadable segment cache " + self.path)
+
+    def Parse(self, SegmentClass, name, device, segmentJson, configurationFormat, digest=None):
+        """ Returns SegmentClass(name, device, segmentJson, configurationFormat), loaded pre-parsed when possible.
+        The digest of the definition is computed from the segmentJson unless it is given.
+        """
+        key = "{}:{}:{}:{}".format(PARSER_VERSION, SegmentClass.__name__, configurationFormat,
+                                   digest or commonFunctions.CanonicalDigest(segmentJson))
+        blob = self.entries.get(key)
+        if blob is None:
+            self.misses += 1
+            segment = SegmentClass(name, device, segmentJson, configurationFormat)
+            self.entries[key] = pickle.dumps(segment, pickle.HIGHEST_PROTOCOL)
+            self.changed = True
+            return segment
+        self.hits += 1
+        segment = pickle.loads(blob)
+        # The same definition may be cached from another device or under another name.
+        segment.name = name
+        segment.deviceName = device
+        return segment
+
+    def Save(self):
+        if not self.changed:
+            return
+        createFolder(os.path.dirname(self.path) or ".")
+        with open(self.path + ".tmp", "wb") as write_file:
+            pickle.dump(self.entries, write_file, pickle.HIGHEST_PROTOCOL)
+        os.replace(self.path + ".tmp", self.path)
+        self.changed = False
@@ -0,0 +1,88 @@
+import hashlib
+import json
+import mmap
+import os
+import re
+
+from commonFunctions import createFolder
+
+DATA_SUFFIX = ".data"
+INDEX_SUFFIX = ".index"
+
+
+def DirectoryHash(directory):
+    """ Returns a digest of the relative paths and contents of all the files in the snapshot directory."""
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            filePath = os.path.join(root, name)
+            digest.update(os.path.relpath(filePath, directory).encode())
+            with open(filePath, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+    return digest.hexdigest()
+
+
+def CacheKey(snapshotName, directory=None):
+    """ Returns the key under which the nodes of a snapshot are cached. Only a snapshot initialized from a directory is
+    keyed by its contents, the nodes cached under a snapshotName alone are replaced whenever it is queried again.
+
+    :ivar snapshotName: The name of the snapshot in Batfish.
+    :ivar directory: The configs directory the snapshot was initialized from (if any).
+    """
+    key = snapshotName
+    if directory:
+        key += "_" + DirectoryHash(directory)[:16]
+    return re.sub(r"[^\w.-]", "_", key)
+
+
+def Exists(cacheDir, key):
+    return os.path.isfile(os.path.join(cacheDir, key + INDEX_SUFFIX))
+
+
+def Caching(cacheDir, key, nodes):
+    """ Yields the (name, model) pairs of the nodes while persisting every model as one JSON blob, along with an index of
+    (offset, length) per node. The index is written last, after the last node was yielded, so that a partially written
+    cache is never picked up.
+    """
+    createFolder(cacheDir)
+    dataPath = os.path.join(cacheDir, key + DATA_SUFFIX)
+    indexPath = os.path.join(cacheDir, key + INDEX_SUFFIX)
+    index = {}
+    with open(dataPath + ".tmp", "wb") as write_file:
+        for node, model in nodes:
+            blob = json.dumps(model).encode()
+            index[node] = (write_file.tell(), len(blob))
+            write_file.write(blob)
+            yield node, model
+    with open(indexPath + ".tmp", "w") as write_file:
+        json.dump(index, write_file)
+    os.replace(dataPath + ".tmp", dataPath)
+    os.replace(indexPath + ".tmp", indexPath)
+
+
+def Save(cacheDir, key, nodes):
+    """Persists the nodes of the viModel answer (a dict) as Caching does."""
+    for _ in Caching(cacheDir, key, nodes.items()):
+        pass
+
+
+def Load(cacheDir, key, nodeRegexPattern):
+    """ Returns the cached nodes whose names match the nodeRegexPattern or None if the snapshot is not cached.
+    The data file is memory-mapped and only the blobs of the matching nodes are decoded.
+    """
+    if not Exists(cacheDir, key):
+        return None
+    with open(os.path.join(cacheDir, key + INDEX_SUFFIX), "r") as f:
+        index = json.load(f)
+    nodes = {}
+    selected = [node for node in index if nodeRegexPattern.match(node)]
+    if not selected:
+        return nodes
+    with open(os.path.join(cacheDir, key + DATA_SUFFIX), "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for node in selected:
+                offset, length = index[node]
+                nodes[node] = json.loads(data[offset:offset+length])
+    return nodes
@@ -0,0 +1,96 @@
+import json
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from docopt import docopt
+
+doc = """
+A local stand-in for the Batfish service that replays a recorded viModel answer,
+so that the node fetching path can be tested and benchmarked without a Batfish container.
+
+    GET  /nodes     The names of all the recorded nodes.
+    POST /viModel   The viModel answer restricted to the {"nodes": [...]} in the request body.
+
+Usage:
+    StandInServer.py <answerFile> [--port=<p>] [--latency=<ms>]
+
+Options:
+    -h --help           Show this help screen.
+    --port=<p>          The port to listen on [default: 9990].
+    --latency=<ms>      Extra delay per requested node added to every viModel request in milliseconds [default: 0].
+"""
+
+
+def LoadRecordedNodes(answerFile):
+    """Returns the nodes of a recorded viModel answer, or of an object with just a "nodes" key."""
+    with open(answerFile, "r") as f:
+        answer = json.load(f)
+    if "answerElements" in answer:
+        answer = answer["answerElements"][0]
+    return answer["nodes"]
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def reply(self, content):
+        body = json.dumps(content).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/nodes":
+            self.reply(sorted(self.server.nodes))
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.rstrip("/") != "/viModel":
+            self.send_error(404)
+            return
+        requested = json.loads(body)["nodes"] if body else list(self.server.nodes)
+        if self.server.latency:
+            time.sleep(self.server.latency*len(requested))
+        nodes = {node: self.server.nodes[node]
+                 for node in requested if node in self.server.nodes}
+        self.reply({"answerElements": [{"class": "org.batfish.question.ViModelQuestionPlugin$ViModelAnswerElement",
+                                        "nodes": nodes}],
+                    "status": "SUCCESS"})
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingServer(socketserver.ThreadingMixIn, HTTPServer):
+    """An HTTPServer answering every request in its own thread (http.server.ThreadingHTTPServer needs Python 3.7)."""
+    daemon_threads = True
+
+
+def StartServer(nodes, port=0, latency=0):
+    """ Serves the nodes from a background thread and returns the server, its URL is http://127.0.0.1:<server.server_port>.
+
+    :ivar nodes: The recorded viModel nodes.
+    :ivar port: The port to listen on, 0 picks a free one.
+    :ivar latency: Extra delay in seconds per requested node, emulating the time Batfish takes to answer.
+    """
+    server = ThreadingServer(("127.0.0.1", port), StandInHandler)
+    server.nodes = nodes
+    server.latency = latency
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    arguments = docopt(doc)
+    server = ThreadingServer(("127.0.0.1", int(arguments["--port"])), StandInHandler)
+    server.nodes = LoadRecordedNodes(arguments["<answerFile>"])
+    server.latency = int(arguments["--latency"])/1000.0
+    print("Replaying {} nodes on http://127.0.0.1:{}".format(
+        len(server.nodes), server.server_port))
+    server.serve_forever()
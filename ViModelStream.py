@@ -0,0 +1,180 @@
+import codecs
+import json
+import re
+
+# The only fields of a node's vendor independent model that SelfStarter reads.
+SEGMENT_FIELDS = ("ipAccessLists", "routeFilterLists",
+                  "route6FilterLists", "routingPolicies", "configurationFormat")
+CHUNK_SIZE = 1 << 20
+
+_STRUCTURAL = re.compile(r'["{}\[\]]')
+_STRING_END = re.compile(r'(?:[^"\\]|\\.)*"', re.DOTALL)
+_SCALAR_END = re.compile(r'[\s,}\]]')
+
+
+def ProjectNode(nodeJson):
+    """Returns the node model with only the fields used for templating."""
+    return {field: nodeJson[field] for field in SEGMENT_FIELDS if field in nodeJson}
+
+
+class _Reader:
+    """ An incremental reader over a JSON text stream that hands out one value at a time.
+
+    :ivar stream: A binary or text file-like object.
+    :ivar buffer: The part of the stream read but not consumed yet.
+    :ivar pos: The position of the next unconsumed character in the buffer.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """Reads the next chunk into the buffer and returns False at the end of the stream."""
+        if self.eof:
+            return False
+        chunk = self.stream.read(CHUNK_SIZE)
+        if not chunk:
+            self.eof = True
+            self.buffer += self.decoder.decode(b"", final=True)
+            return False
+        if isinstance(chunk, bytes):
+            chunk = self.decoder.decode(chunk)
+        # Drop the consumed prefix so that the buffer holds at most one value plus a chunk.
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Skips whitespace and returns the next character ('' at the end of the stream)."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self.fill():
+                return self.buffer[self.pos:self.pos+1]
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError("Malformed viModel answer: expected '{}' at offset {}".format(
+                char, self.pos))
+        self.pos += 1
+
+    def readValue(self):
+        """Returns the raw text of the next JSON value and consumes it."""
+        first = self.peek()
+        if first == "":
+            raise ValueError("Malformed viModel answer: unexpected end of stream")
+        scan = self.pos
+        depth = 0
+        end = None
+        while end is None:
+            if first not in "{[\"":
+                found = _SCALAR_END.search(self.buffer, scan)
+                if found:
+                    end = found.start()
+                    continue
+            else:
+                found = _STRUCTURAL.search(self.buffer, scan)
+                if found and found.group() == '"':
+                    closing = _STRING_END.match(self.buffer, found.end())
+                    if closing:
+                        scan = closing.end()
+                        if depth == 0:
+                            end = scan
+                        continue
+                    # Rescan the whole string once more of it has been read.
+                    scan = found.start()
+                elif found:
+                    scan = found.end()
+                    depth += 1 if found.group() in "{[" else -1
+                    if depth == 0:
+                        end = scan
+                    continue
+                else:
+                    scan = len(self.buffer)
+            offset = scan - self.pos
+            if not self.fill():
+                if first in "{[\"":
+                    raise ValueError("Malformed viModel answer: unexpected end of stream")
+                end = len(self.buffer)
+                continue
+            scan = self.pos + offset
+        value = self.buffer[self.pos:end]
+        self.pos = end
+        return value
+
+    def members(self):
+        """Iterates over the keys of the object at the current position.
+        The caller has to consume the value of each key before asking for the next one.
+        """
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = json.loads(self.readValue())
+            self.expect(":")
+            yield key
+            separator = self.peek()
+            self.pos += 1
+            if separator == "}":
+                return
+            if separator != ",":
+                raise ValueError("Malformed viModel answer: expected ',' or '}'")
+
+    def elements(self):
+        """Iterates over the elements of the array at the current position, the caller consumes each element."""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield
+            separator = self.peek()
+            self.pos += 1
+            if separator == "]":
+                return
+            if separator != ",":
+                raise ValueError("Malformed viModel answer: expected ',' or ']'")
+
+
+def _NodesOf(reader, nodeRegexPattern):
+    """Yields the projected nodes of the "nodes" object at the current position of the reader."""
+    for node in reader.members():
+        text = reader.readValue()
+        if nodeRegexPattern.match(node):
+            yield node, ProjectNode(json.loads(text))
+
+
+def IterNodes(stream, nodeRegexPattern):
+    """ Walks a viModel answer (or an object with a "nodes" key) as a stream and yields the (name, model) of the
+    nodes matching the nodeRegexPattern, keeping only the SEGMENT_FIELDS of each model.
+    Only one node is decoded at a time and the nodes that do not match the pattern are never decoded.
+    """
+    reader = _Reader(stream)
+    for key in reader.members():
+        if key == "nodes" and reader.peek() == "{":
+            yield from _NodesOf(reader, nodeRegexPattern)
+            return
+        elif key == "answerElements" and reader.peek() == "[":
+            for _ in reader.elements():
+                if reader.peek() != "{":
+                    reader.readValue()
+                    continue
+                for elementKey in reader.members():
+                    if elementKey == "nodes" and reader.peek() == "{":
+                        yield from _NodesOf(reader, nodeRegexPattern)
+                        return
+                    reader.readValue()
+        else:
+            reader.readValue()
+
+
+def IterNodeFile(answerFile, nodeRegexPattern):
+    """Yields the nodes of the saved viModel answer at the path answerFile as IterNodes does, the file is kept open until
+    the last one."""
+    with open(answerFile, "rb") as stream:
+        yield from IterNodes(stream, nodeRegexPattern)
@@ -1,17 +1,14 @@
 import argparse
+import bisect
 import collections
 import copy
+import hashlib
 import json
 import os
 import pprint
 import re
 import statistics
 
-import plotly
-import plotly.graph_objs as go
-from matplotlib import cm
-from matplotlib.colors import rgb2hex
-
 SPURIOUS_PARAM_THRESHOLD = 0.05
 SINGLE_PARAM_THRESHOLD = 0.09
 INFINITY = 10000
@@ -277,22 +274,50 @@ class ParametersLinesMap:
         return differences
 
 
-class matrixCell():
-    """ A cell in the matrix for sequence alignment
-    
-    :ivar score : The value of that cell
-    :ivar pointer: Whether this value was obtained from diagonal(1), left(2) or right(3).
-                   The pointer is stored so as not to compute clauseScore multiple times. 
-    :ivar matchedLines: The line mapping for the aligned blocks.
+class ScoreCache:
+    """ A bounded cache of the MisMatchScore of a template block with a device block that evicts the least recently used scores.
+    The keys are the (template block digest, device block digest, parameter distribution version) of a pair.
+
+    :ivar capacity: The maximum number of scores kept.
+    :ivar hits: The number of scores found in the cache.
+    :ivar misses: The number of scores that had to be computed.
     """
 
-    def __init__(self):
-        self.score = 0
-        self.pointer = [-1]
-        self.matchedLines = []
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+
+def ParameterDistributionVersion(paramValueMap):
+    """ Returns a digest of the values each parameter takes. The scores only check whether a value is one of the values
+    of a parameter, so the number of devices having each value is left out.
+    """
+    return CanonicalDigest(sorted((param, sorted(repr(value) for value in paramValueMap[param]))
+                                  for param in paramValueMap))
 
 
 def generateHTML(htmlLines, parametersLines, outputPath):
+    # The visualization stack is only loaded when a template is actually rendered.
+    import plotly
+    import plotly.graph_objs as go
+    from matplotlib import cm
+    from matplotlib.colors import rgb2hex
 
     outputLines = outputPath + os.path.sep + "MetaTemplate.html"
     outputGroups = outputPath + os.path.sep + "Groups.html"
@@ -355,6 +380,76 @@ def createFolder(path):
         os.makedirs(path)
 
 
+def CanonicalDigest(value):
+    """Returns a sha256 digest of the JSON value that does not depend on the order of the keys in it."""
+    return hashlib.sha256(json.dumps(value, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+def LineHash(line, lineNumKey):
+    """Returns a hash of the content of a flat line, leaving out its line number."""
+    return hash(frozenset(item for item in line.items() if item[0] != lineNumKey))
+
+
+def IdentityMatching(lineHashes):
+    """Returns the matching of every line of a block with itself, nested in the same way as the line hashes of the block."""
+    if lineHashes and isinstance(lineHashes[0], list):
+        return [IdentityMatching(hashes) for hashes in lineHashes]
+    return [(k, k) for k in range(len(lineHashes))]
+
+
+def UniqueAnchors(digests1, digests2, i0, i1, j0, j1):
+    """ Returns the (i, j) pairs of items that are identical and occur exactly once in both digests1[i0:i1] and
+    digests2[j0:j1], keeping the longest chain of them that is in the same order in both (patience diff).
+    """
+    positions1 = collections.Counter(digests1[i0:i1])
+    positions2 = {}
+    for j in range(j0, j1):
+        positions2.setdefault(digests2[j], list()).append(j)
+    pairs = [(i, positions2[digests1[i]][0]) for i in range(i0, i1)
+             if positions1[digests1[i]] == 1 and len(positions2.get(digests1[i], ())) == 1]
+    # Longest increasing subsequence of the j's: the pile tops and the pair before each pair in its chain.
+    tops = list()
+    topIndices = list()
+    previous = [None]*len(pairs)
+    for index, (_, j) in enumerate(pairs):
+        pile = bisect.bisect_left(tops, j)
+        previous[index] = topIndices[pile-1] if pile > 0 else None
+        if pile == len(tops):
+            tops.append(j)
+            topIndices.append(index)
+        else:
+            tops[pile] = j
+            topIndices[pile] = index
+    anchors = list()
+    index = topIndices[-1] if topIndices else None
+    while index is not None:
+        anchors.append(pairs[index])
+        index = previous[index]
+    anchors.reverse()
+    return anchors
+
+
+def PartitionLines(lines1, lines2, Key):
+    """ Returns the (indices1, indices2) of the lines of both sequences that share a Key, for every Key found in both of
+    them in the order of lines1. Lines of different Keys can only be matched at an INFINITY score."""
+    partitions = collections.OrderedDict()
+    for i, line in enumerate(lines1):
+        partitions.setdefault(Key(line), (list(), list()))[0].append(i)
+    for j, line in enumerate(lines2):
+        if Key(line) in partitions:
+            partitions[Key(line)][1].append(j)
+    return [(indices1, indices2) for indices1, indices2 in partitions.values() if indices2]
+
+
+def WithoutKeys(value, keys):
+    """Returns a copy of the JSON value without the given keys at any depth."""
+    if isinstance(value, dict):
+        return {key: WithoutKeys(v, keys) for key, v in value.items() if key not in keys}
+    if isinstance(value, list):
+        return [WithoutKeys(v, keys) for v in value]
+    return value
+
+
 def instanceCheck(u, v):
     if isinstance(v, list) and isinstance(u, list):
         if not checkListEquality(v, u):
@@ -390,11 +485,28 @@ def checkdictEquality(json1, json2):
         return True
 
 
-def checkJSONEquality(exisitingMap, newJson, router):
-    for r in exisitingMap:
-        eJson = exisitingMap[r][1]
-        if instanceCheck(eJson, newJson):
-            exisitingMap[r][0].add(router)
-            return True
-    exisitingMap[router] = (set(), newJson)
-    return False
+class ExactMatchMap(dict):
+    """ The bookkeeping used for exact equality optimization, {representative device: (set of devices with an identical
+    definition, definition)}. Definitions are grouped by the CanonicalDigest of their normal form, so a duplicate is
+    found with a single lookup before it is parsed.
+
+    :ivar representatives: The map from the digest of a non-empty definition to its representative device.
+    :ivar emptyDigests: The digests of the definitions that are parsed to an empty segment.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.representatives = {}
+        self.emptyDigests = set()
+
+    def addDuplicate(self, digest, device):
+        """Adds the device to the group of the digest and returns False if no such definition is seen yet."""
+        representative = self.representatives.get(digest)
+        if representative is None:
+            return False
+        self[representative][0].add(device)
+        return True
+
+    def addRepresentative(self, digest, device, definition):
+        self.representatives[digest] = device
+        self[device] = (set(), definition)
@@ -1,22 +1,26 @@
 import collections
+import functools
 import json
 import os
 import re
 import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 from os import listdir, makedirs, path, walk
 
-import pandas as pd
 from docopt import docopt
-from pybatfish.client.commands import *
-from pybatfish.question import bfq
-from pybatfish.question.question import list_questions, load_questions
 
 import ACL
+import Assignment
+import NativeParser
+import NodeFetcher
 import PrefixList
 import RoutePolicy
+import SegmentCache
+import SnapshotCache
+import ViModelStream
 from commonFunctions import createFolder
-from MetaTemplater import StructuredGeneralization
+from MetaTemplater import MATCHING_STATS, SCORE_CACHE_STATS, StructuredGeneralization
 
 doc = """
 SelfStarter  automatically  infers  likely network configuration errors,
@@ -30,7 +34,7 @@ across  templates  and  uses  the  templates  to  propose   high-quality
 configuration outliers.
 
 Usage: 
-    main.py (--directory=<dir> | --network=<net> --snapshot=<snap>) [-harp] [--pattern=<pa>] [--nodeRegex=<nr>] [--outputDir=<dir>]
+    main.py (--directory=<dir> [--native] | --network=<net> --snapshot=<snap> | --answerFile=<af> | --answerServer=<url>) [-harp] [--pattern=<pa>] [--nodeRegex=<nr>] [--outputDir=<dir>] [--fromCache] [--cacheDir=<cdir>] [--fetchBatch=<fb>] [--fetchWorkers=<fw>] [--segmentCache] [--jobs=<j>] [--scoreCache=<sc>] [--alignment=<al>] [--band=<bw>] [--scoreWorkers=<sw>] [--engine=<en>] [--workers=<w>] [--ordering=<or>] [--solver=<so>] [--approxThreshold=<at>] [--window=<wn>]
     main.py statistics [--inputDir=<idir>]
 
 Options:
@@ -38,9 +42,45 @@ Options:
     -a --acl            Include ACLs.
     -r --routemap       Include RouteMaps.
     -p --prefixlist     Include PrefixLists.
+    --answerFile=<af>   A saved viModel answer (JSON) to read the nodes from instead of querying Batfish. The answer is
+                        parsed one node at a time, which only lowers the memory of parsing it: the templating starts
+                        once the segments of all the nodes are extracted.
+    --answerServer=<url>  An answer server (e.g. StandInServer.py) to fetch the node models from instead of Batfish.
+    --native            Parse the Cisco IOS configurations of the directory with NativeParser instead of Batfish.
     --pattern=<pa>      Segment Name Regex [default: .*].
     --nodeRegex=<nr>    Regular expression for names of nodes to include [default: .*].
     --outputDir=<dir>   The output directory [default: Results].
+    --fromCache         Load the nodes from the snapshot cache instead of querying Batfish. A --network/--snapshot is
+                        cached by its names only, every run without --fromCache refreshes its cache.
+    --cacheDir=<cdir>   The directory for the snapshot cache [default: Cache].
+    --fetchBatch=<fb>   Number of nodes asked for in a single viModel request, 0 asks for all nodes at once [default: 0].
+    --fetchWorkers=<fw>  Number of concurrent viModel requests [default: 4].
+    --segmentCache      Reuse the segments parsed by earlier runs, cached in the cacheDir.
+    --jobs=<j>          Number of processes templating the ACLs, PrefixLists and RoutePolicies concurrently [default: 1].
+    --scoreCache=<sc>   Number of block pair scores cached while templating a segment, 0 disables the cache [default: 10000].
+    --alignment=<al>    The block alignment, "full" keeps the score table of two segments, "linear" only O(m+n) scores and "anchored"
+                        only aligns the blocks between the identical leading and trailing blocks of the two segments [default: full].
+    --band=<bw>         Only align the blocks of the full or anchored tables within bw blocks of the diagonal, 0 for no band [default: 0].
+    --scoreWorkers=<sw>  Number of processes scoring the block pairs of a large alignment upfront [default: 1].
+    --engine=<en>       How the segments sharing a name are templated, "sequential" merges them into one template one
+                        after the other, "mapreduce" templates chunks of them in parallel and merges the partial
+                        templates pairwise and "centerstar" aligns each of them with the most common one in parallel
+                        and folds the alignments into one template. The mapreduce engine aligns partial templates with
+                        each other and the centerstar engine aligns devices with the center instead of with one growing
+                        template, so their groups can differ from the sequential ones [default: sequential].
+    --workers=<w>       Number of processes of the mapreduce and centerstar engines [default: 4].
+    --ordering=<or>     The order the segments are templated in, "frequency" starts with the most common line count and
+                        "similarity" moves from the densest cluster of similar segments to the nearest neighbours [default: frequency].
+    --solver=<so>       The assignment solver matching the lines of two blocks, "lapjv" (shortest augmenting paths) or
+                        "munkres" (the munkres package, kept as the reference). Both find matchings of the same cost but
+                        pick different ones among equally cheap matchings, so the parameters and outliers can differ
+                        between them [default: lapjv].
+    --approxThreshold=<at>  Blocks with more lines left to match are matched by an approximate auction instead, 0 always
+                        matches exactly. The solver and threshold are recorded in output.txt, along with the gap of the
+                        approximate matchings to a lower bound when there were any [default: 0].
+    --window=<wn>       First match the ACL and prefix list lines left after the identical ones within the windows between
+                        the identical lines found once in both blocks, reaching wn lines past them, then the lines still
+                        unmatched with each other, 0 matches all the lines at once [default: 0].
     --inputDir=<idir>   The top-level input directory for statistics [default: Results].
 
 """
@@ -49,8 +89,13 @@ prefixListFunctions = {}
 prefixListFunctions["GapPenalty"] = PrefixList.GapPenalty
 prefixListFunctions["GetBlockSequence"] = PrefixList.GetBlockSequence
 prefixListFunctions["GetLineSequence"] = PrefixList.LineSequence
+prefixListFunctions["LineNumber"] = PrefixList.LineNumber
+prefixListFunctions["BlockDigest"] = PrefixList.BlockDigest
+prefixListFunctions["ScoreLowerBound"] = PrefixList.ScoreLowerBound
 prefixListFunctions["MinimumWeightBipartiteMatching"] = PrefixList.BipartiteMatching
 prefixListFunctions["GenerateTemplate"] = PrefixList.TemplateGenerator
+prefixListFunctions["ReorderMerge"] = PrefixList.ReorderMerge
+prefixListFunctions["RenameParameters"] = PrefixList.RenameParameters
 prefixListFunctions["MinimizeParameters"] = PrefixList.MinimizeParameters
 prefixListFunctions["PrintTemplate"] = PrefixList.PrintTemplate
 prefixListFunctions["NumberOfAttributes"] = PrefixList.ATTRIBUTES
@@ -60,8 +105,13 @@ aclFunctions = {}
 aclFunctions["GapPenalty"] = ACL.GapPenalty
 aclFunctions["GetBlockSequence"] = ACL.GetBlockSequence
 aclFunctions["GetLineSequence"] = ACL.LineSequence
+aclFunctions["LineNumber"] = ACL.LineNumber
+aclFunctions["BlockDigest"] = ACL.BlockDigest
+aclFunctions["ScoreLowerBound"] = ACL.ScoreLowerBound
 aclFunctions["MinimumWeightBipartiteMatching"] = ACL.BipartiteMatching
 aclFunctions["GenerateTemplate"] = ACL.TemplateGenerator
+aclFunctions["ReorderMerge"] = ACL.ReorderMerge
+aclFunctions["RenameParameters"] = ACL.RenameParameters
 aclFunctions["MinimizeParameters"] = ACL.MinimizeParameters
 aclFunctions["PrintTemplate"] = ACL.PrintTemplate
 aclFunctions["NumberOfAttributes"] = ACL.ATTRIBUTES
@@ -70,12 +120,23 @@ routePolicyFunctions = {}
 routePolicyFunctions["GapPenalty"] = RoutePolicy.GapPenalty
 routePolicyFunctions["GetBlockSequence"] = RoutePolicy.GetBlockSequence
 routePolicyFunctions["GetLineSequence"] = RoutePolicy.LineSequence
+routePolicyFunctions["LineNumber"] = RoutePolicy.LineNumber
+routePolicyFunctions["BlockDigest"] = RoutePolicy.BlockDigest
+routePolicyFunctions["ScoreLowerBound"] = RoutePolicy.ScoreLowerBound
 routePolicyFunctions["MinimumWeightBipartiteMatching"] = RoutePolicy.BipartiteMatching
 routePolicyFunctions["GenerateTemplate"] = RoutePolicy.TemplateGenerator
+routePolicyFunctions["ReorderMerge"] = RoutePolicy.ReorderMerge
+routePolicyFunctions["RenameParameters"] = RoutePolicy.RenameParameters
 routePolicyFunctions["MinimizeParameters"] = RoutePolicy.MinimizeParameters
 routePolicyFunctions["PrintTemplate"] = RoutePolicy.PrintTemplate
 routePolicyFunctions["NumberOfAttributes"] = None
 
+# The command line flag, viModel segment types and functions of each kind of segment.
+SEGMENT_KINDS = collections.OrderedDict()
+SEGMENT_KINDS["ACLs"] = ("--acl", ["ipAccessLists"], aclFunctions)
+SEGMENT_KINDS["PrefixLists"] = ("--prefixlist", ["routeFilterLists", "route6FilterLists"], prefixListFunctions)
+SEGMENT_KINDS["RoutePolicies"] = ("--routemap", ["routingPolicies"], routePolicyFunctions)
+
 
 def WriteFile(content, filename, outputPath):
     with open(outputPath + os.path.sep + filename, "w") as write_file:
@@ -116,22 +177,120 @@ def Statistics(rootDir, prefixMap, routeMap, aclMap):
    
 
 
-def AllSegments(devicesInfo, segmentType, outputDirectory, segmentNameRegex, **functions):
+def LoadNodesData(arguments, nodeRegexPattern):
+    """ Returns the (name, model) pairs of the viModel nodes matching the nodeRegexPattern, either from the native parser,
+    the snapshot cache or from Batfish. The nodes of a saved answer are parsed one at a time and the nodes fetched in
+    batches are handed out as their batch arrives, which keeps the memory of parsing low, while a single viModel query
+    still holds its whole answer in memory until the nodes are projected. Either way the templating only starts once
+    ExtractSegments (or dict) has consumed all the nodes.
+    The nodes retrieved from Batfish are cached per snapshot for the later --fromCache runs, replacing the nodes cached
+    before: a --network/--snapshot is only known by its names, which stay the same when the snapshot is re-initialized.
+    Only the ViModelStream.SEGMENT_FIELDS of each node are kept.
+    """
+    batchSize = int(arguments["--fetchBatch"])
+    workers = int(arguments["--fetchWorkers"])
+    if arguments["--answerFile"]:
+        return ViModelStream.IterNodeFile(arguments["--answerFile"], nodeRegexPattern)
+    if arguments["--answerServer"]:
+        source = NodeFetcher.HttpAnswerSource(arguments["--answerServer"])
+        return NodeFetcher.FetchNodes(source, nodeRegexPattern, batchSize, workers)
+    if arguments["--native"]:
+        return NativeParser.ParseDirectory(arguments["--directory"], nodeRegexPattern).items()
+    if arguments["--directory"]:
+        cacheKey = SnapshotCache.CacheKey("batfish", arguments["--directory"])
+    else:
+        cacheKey = SnapshotCache.CacheKey(
+            arguments["--network"] + "_" + arguments["--snapshot"])
+    if arguments["--fromCache"]:
+        nodesData = SnapshotCache.Load(
+            arguments["--cacheDir"], cacheKey, nodeRegexPattern)
+        if nodesData is not None:
+            return nodesData.items()
+        print("No cached snapshot found for " + cacheKey + ", querying Batfish")
+
+    # pybatfish is only loaded when a Batfish snapshot is actually needed.
+    from pybatfish.client.commands import bf_init_snapshot, bf_set_network, bf_set_snapshot
+    from pybatfish.question import bfq
+    from pybatfish.question.question import load_questions
+    if arguments["--directory"]:
+        bf_set_network("batfish")
+        bf_init_snapshot(arguments["--directory"],
+                         name="batfish", overwrite=True)
+    else:
+        bf_set_network(arguments["--network"])
+        bf_set_snapshot(arguments["--snapshot"])
+    load_questions()
+    if batchSize:
+        nodes = NodeFetcher.FetchNodes(NodeFetcher.BatfishAnswerSource(), nodeRegexPattern, batchSize, workers)
+        # Only the nodes matching the nodeRegex are fetched, the cache must have all of them.
+        if nodeRegexPattern.pattern == ".*":
+            return SnapshotCache.Caching(arguments["--cacheDir"], cacheKey, nodes)
+        return nodes
+    answer = bfq.viModel().answer()["answerElements"][0]
+    if 'nodes' not in answer:
+        return None
+    # Drop everything but the segments right away so that the full answer can be freed.
+    allNodesData = {router: ViModelStream.ProjectNode(
+        model) for router, model in answer['nodes'].items()}
+    del answer
+    SnapshotCache.Save(arguments["--cacheDir"], cacheKey, allNodesData)
+    nodesData = {}
+    for router in allNodesData:
+        if nodeRegexPattern.match(router):
+            nodesData[router] = allNodesData[router]
+    return nodesData.items()
+
+
+def ExtractSegments(nodes, segmentTypesOfKinds):
+    """ Walks the (router, model) pairs of the devices once, as they are read, and returns, for every kind of segment, the number of definitions of every segment
+    name and the map from every segment name to the (device, deviceInfo) pairs that define it, where each
+    deviceInfo holds only the segments with that name.
+
+    :ivar segmentTypesOfKinds: The map from a kind of segment to the viModel segment types it is made of.
+    """
+    extracted = {kind: (collections.defaultdict(int), {}) for kind in segmentTypesOfKinds}
+    for router, model in nodes:
+        for kind, segmentType in segmentTypesOfKinds.items():
+            segmentNameCount, segmentDevices = extracted[kind]
+            for stype in segmentType:
+                if model.get(stype):
+                    for segmentName, definition in model.get(stype).items():
+                        # Ignoring the batfish generated RoutePolicies
+                        if not segmentName.startswith("~"):
+                            segmentNameCount[segmentName] += 1
+                            deviceInfo = segmentDevices.setdefault(segmentName, {}).setdefault(
+                                router, {"configurationFormat": model.get("configurationFormat")})
+                            deviceInfo.setdefault(stype, {})[segmentName] = definition
+    for kind, (segmentNameCount, segmentDevices) in extracted.items():
+        extracted[kind] = (segmentNameCount, {name: list(segmentDevices[name].items()) for name in segmentDevices})
+    return extracted
+
+
+def DevicesWithUnsupportedLines(segmentDevices, segmentName):
+    """Returns the devices whose definition of the segment lost the lines the native parser does not support."""
+    return sorted(device for device, deviceInfo in segmentDevices
+                  if any(definitions[segmentName].get("unsupportedLines") for definitions in deviceInfo.values()
+                         if isinstance(definitions, dict) and segmentName in definitions))
+
+
+def OpenSegmentCache(arguments, kind):
+    """Returns the SegmentCache for the kind of segments if --segmentCache is given."""
+    if arguments["--segmentCache"]:
+        return SegmentCache.SegmentCache(arguments["--cacheDir"], kind)
+    return None
+
+
+def AllSegments(devicesInfo, segmentType, outputDirectory, segmentNameRegex, segmentCache=None, extracted=None, **functions):
     if not os.path.exists(outputDirectory):
         os.makedirs(outputDirectory)
     blockSeqFun = functions["GetBlockSequence"]
     del functions["GetBlockSequence"]
+    if segmentCache:
+        blockSeqFun = functools.partial(blockSeqFun, segmentCache=segmentCache)
     csvgen = list()
     exactVsSelfStarter = []
     if segmentNameRegex == ".*":
-        segmentNameCount = collections.defaultdict(int)
-        for router in devicesInfo:
-            for stype in segmentType:
-                if devicesInfo[router].get(stype):
-                    for segmentName in devicesInfo[router].get(stype):
-                        # Ignoring the batfish generated RoutePolicies
-                        if not segmentName.startswith("~"):
-                            segmentNameCount[segmentName] += 1
+        segmentNameCount, segmentIndex = extracted or ExtractSegments(devicesInfo.items(), {None: segmentType})[None]
         countSegmentMap = {}
         for name in segmentNameCount:
             countSegmentMap.setdefault(segmentNameCount[name], set()).add(name)
@@ -144,8 +303,14 @@ def AllSegments(devicesInfo, segmentType, outputDirectory, segmentNameRegex, **f
                 try:
                     foundRouters = set()
                     emptyDefDevices = set()
+                    partialDevices = DevicesWithUnsupportedLines(segmentIndex[segmentName], segmentName)
+                    if partialDevices:
+                        if "Unsupported Lines Dropped" not in differentCounts:
+                            differentCounts["Unsupported Lines Dropped"] = 0
+                        differentCounts["Unsupported Lines Dropped"] += 1
                     groupsList, singleParamQ, spuriousQ, code, exactGroupSizes = StructuredGeneralization(
-                        segmentName+"$", devicesInfo, blockSeqFun, outputDirectory, foundRouters, emptyDefDevices, **functions)
+                        segmentName+"$", devicesInfo, blockSeqFun, outputDirectory, foundRouters, emptyDefDevices,
+                        segmentIndex[segmentName], **functions)
                     if groupsList:
                         questions = "\n\nFor Segment  " + segmentName + " \n"
                         questions += "Sizes of Groups found = " + \
@@ -154,6 +319,8 @@ def AllSegments(devicesInfo, segmentType, outputDirectory, segmentNameRegex, **f
                             str(singleParamQ.count('\n'))
                         questions += "\nNumber of Spurious Parameter outliers = " + \
                             str(spuriousQ.count('\n'))
+                        if partialDevices:
+                            questions += "\nDevices with unsupported lines dropped = " + str(partialDevices)
                         largestGroup = len(
                             groupsList[0][1])/float(sum([len(tup[1]) for tup in groupsList]))
                         largestGroupSizeStatMap.setdefault(
@@ -198,45 +365,87 @@ def AllSegments(devicesInfo, segmentType, outputDirectory, segmentNameRegex, **f
     else:
         StructuredGeneralization(segmentNameRegex, devicesInfo,
                                  blockSeqFun, outputDirectory, set(), set(), **functions)
+    if SCORE_CACHE_STATS:
+        print("Score cache: {} hits, {} misses".format(
+            SCORE_CACHE_STATS["hits"], SCORE_CACHE_STATS["misses"]))
+        SCORE_CACHE_STATS.clear()
+    if MATCHING_STATS:
+        print("Lower bound: {} of {} block pair matchings pruned".format(
+            MATCHING_STATS["pruned"], MATCHING_STATS["pruned"] + MATCHING_STATS["matched"]))
+        MATCHING_STATS.clear()
+    if Assignment.ASSIGNMENT_STATS:
+        print("Assignment solvers: " + ", ".join("{} ({} line matchings)".format(name, Assignment.ASSIGNMENT_STATS[name])
+              for name in list(Assignment.SOLVERS) + ["approximate"] if Assignment.ASSIGNMENT_STATS[name] > 0))
+    if Assignment.ASSIGNMENT_STATS["approximate"]:
+        print("Assignment: {} line matchings approximated, at most {:.0f} above their lower bound".format(
+            Assignment.ASSIGNMENT_STATS["approximate"],
+            Assignment.ASSIGNMENT_STATS["approximateCost"] - Assignment.ASSIGNMENT_STATS["lowerBound"]))
+    Assignment.ASSIGNMENT_STATS.clear()
+    if segmentCache:
+        segmentCache.Save()
+        print("Segment cache: {} parsed segments reused, {} parsed".format(
+            segmentCache.hits, segmentCache.misses))
     return csvgen, json.dumps(exactVsSelfStarter, sort_keys=True, indent=2)
 
 
+def TemplateKind(kind, devicesInfo, extracted, arguments):
+    """Templates all the segments of one kind (ACLs, PrefixLists or RoutePolicies) into its output directory."""
+    _, segmentType, functions = SEGMENT_KINDS[kind]
+    outputDirectory = arguments["--outputDir"] + os.path.sep + kind
+    matching = functools.partial(functions["MinimumWeightBipartiteMatching"], solver=arguments["--solver"],
+                                 approxThreshold=int(arguments["--approxThreshold"]), window=int(arguments["--window"]))
+    functions = dict(functions, MinimumWeightBipartiteMatching=matching,
+                     ScoreCacheSize=int(arguments["--scoreCache"]), AlignmentMode=arguments["--alignment"],
+                     BandWidth=int(arguments["--band"]), ScoreWorkers=int(arguments["--scoreWorkers"]),
+                     Engine=arguments["--engine"], Workers=int(arguments["--workers"]), Ordering=arguments["--ordering"],
+                     Solver=arguments["--solver"], ApproxThreshold=int(arguments["--approxThreshold"]))
+    csvgen, exactVsSelfStarter = AllSegments(devicesInfo, segmentType, outputDirectory, arguments["--pattern"],
+                                             OpenSegmentCache(arguments, kind), extracted, **functions)
+    WriteFile(exactVsSelfStarter, "ExactComp.json", outputDirectory)
+
+
 if __name__ == '__main__':
     arguments = docopt(doc, version='SelfStarter 1.0')
-    if arguments["--directory"]:
-        bf_set_network("batfish")
-        bf_init_snapshot(arguments["--directory"],
-                         name="batfish", overwrite=True)
-    elif arguments["--network"] and arguments["--snapshot"]:
-        bf_set_network(arguments["--network"])
-        bf_set_snapshot(arguments["--snapshot"])
 
     if not arguments["statistics"]:
+        if arguments["--alignment"] not in ("full", "linear", "anchored"):
+            print("Unknown alignment " + arguments["--alignment"] + ", use full, linear or anchored")
+            exit()
+        if arguments["--engine"] not in ("sequential", "mapreduce", "centerstar"):
+            print("Unknown engine " + arguments["--engine"] + ", use sequential, mapreduce or centerstar")
+            exit()
+        if arguments["--ordering"] not in ("frequency", "similarity"):
+            print("Unknown ordering " + arguments["--ordering"] + ", use frequency or similarity")
+            exit()
+        if arguments["--solver"] not in Assignment.SOLVERS:
+            print("Unknown solver " + arguments["--solver"] + ", use " + " or ".join(Assignment.SOLVERS))
+            exit()
         nodeRegex = arguments["--nodeRegex"]
         namePattern = arguments["--pattern"]
-        load_questions()
-        nodesData = bfq.viModel().answer()["answerElements"][0]
-        if 'nodes' in nodesData:
-            allNodesData = nodesData['nodes']
-            nodeRegexPattern = re.compile(nodeRegex)
-            nodesData = {}
-            for router in allNodesData:
-                if nodeRegexPattern.match(router):
-                    nodesData[router] = allNodesData[router]
-        else:
+        nodes = LoadNodesData(arguments, re.compile(nodeRegex))
+        if nodes is None:
             print("No data could be retrieved")
             exit()
         if not os.path.exists(arguments["--outputDir"]):
             os.makedirs(arguments["--outputDir"])
-        if arguments["--acl"]:
-            csvgen, exactVsSelfStarter = AllSegments(nodesData, ["ipAccessLists"], arguments["--outputDir"] + os.path.sep + "ACLs", namePattern, **aclFunctions)
-            WriteFile(exactVsSelfStarter, "ExactComp.json", arguments["--outputDir"]+ os.path.sep + "ACLs")
-        if arguments["--prefixlist"]:
-            csvgen, exactVsSelfStarter = AllSegments(nodesData, ["routeFilterLists", "route6FilterLists"], arguments["--outputDir"]+ os.path.sep + "PrefixLists", namePattern, **prefixListFunctions)
-            WriteFile(exactVsSelfStarter, "ExactComp.json", arguments["--outputDir"] + os.path.sep + "PrefixLists")
-        if arguments["--routemap"]:
-            csvgen, exactVsSelfStarter = AllSegments(nodesData, ["routingPolicies"], arguments["--outputDir"] + os.path.sep + "RoutePolicies", namePattern, **routePolicyFunctions)   
-            WriteFile(exactVsSelfStarter, "ExactComp.json", arguments["--outputDir"] + os.path.sep + "RoutePolicies")
+        kinds = [kind for kind in SEGMENT_KINDS if arguments[SEGMENT_KINDS[kind][0]]]
+        extracted = {}
+        if namePattern == ".*":
+            # A single walk over the nodes feeds the templating of all the kinds, without keeping the nodes themselves.
+            extracted = ExtractSegments(nodes, {kind: SEGMENT_KINDS[kind][1] for kind in kinds})
+            nodesData = {}
+        else:
+            nodesData = dict(nodes)
+        jobs = min(int(arguments["--jobs"]), len(kinds))
+        if jobs > 1:
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                futures = [pool.submit(TemplateKind, kind, nodesData, extracted.get(kind), arguments)
+                           for kind in kinds]
+                for future in futures:
+                    future.result()
+        else:
+            for kind in kinds:
+                TemplateKind(kind, nodesData, extracted.get(kind), arguments)
     else:
         aclMap, prefixMap, routeMap = {},  {}, {}
         Statistics(arguments["--inputDir"], prefixMap, routeMap, aclMap)
@@ -0,0 +1,69 @@
+import random
+
+import MetaTemplater
+
+
+def AlignmentCost(moves, PairScore, gaps1, gaps2):
+    """Returns the score of the alignment made of the moves."""
+    cost = 0
+    i = j = 0
+    for move in moves:
+        if move == MetaTemplater.DIAGONAL:
+            cost += PairScore(i, j)
+            i += 1
+            j += 1
+        elif move == MetaTemplater.LEFT:
+            cost += gaps2[j]
+            j += 1
+        else:
+            cost += gaps1[i]
+            i += 1
+    return cost
+
+
+def Scoring(digests1, digests2, scores, gaps):
+    """Returns the PairScore and gap penalties of two sequences of block digests."""
+    def PairScore(i, j, limit=float("inf")):
+        return scores[digests1[i], digests2[j]]
+    return PairScore, [gaps[d] for d in digests1], [gaps[d] for d in digests2]
+
+
+def RandomScores(rng, alphabet):
+    """Returns random pair scores, 0 for identical blocks, and gap penalties of the alphabet of block digests."""
+    gaps = {d: rng.randrange(1, 8)*20 for d in alphabet}
+    scores = {}
+    for a in alphabet:
+        for b in alphabet:
+            if a == b:
+                scores[a, b] = 0
+            elif (b, a) in scores:
+                scores[a, b] = scores[b, a]
+            else:
+                scores[a, b] = rng.choice([rng.randrange(0, 300), 10000])
+    return scores, gaps
+
+
+def test_anchored_alignment_costs_the_same_as_full():
+    rng = random.Random(0)
+    for _ in range(500):
+        alphabet = "ABCDEFG"[:rng.randrange(2, 8)]
+        scores, gaps = RandomScores(rng, alphabet)
+        common = [rng.choice(alphabet) for _ in range(rng.randrange(0, 4))]
+        digests1 = common + [rng.choice(alphabet) for _ in range(rng.randrange(0, 8))] + common[::-1]
+        digests2 = common + [rng.choice(alphabet) for _ in range(rng.randrange(0, 8))] + common[::-1]
+        PairScore, gaps1, gaps2 = Scoring(digests1, digests2, scores, gaps)
+        full = MetaTemplater.TableAlignmentPath(0, len(digests1), 0, len(digests2), PairScore, gaps1, gaps2)
+        for PairLowerBound in (lambda i, j: 0, PairScore):
+            anchored = MetaTemplater.AnchoredAlignmentPath(digests1, digests2, PairScore, PairLowerBound, gaps1, gaps2)
+            assert (AlignmentCost(anchored, PairScore, gaps1, gaps2) ==
+                    AlignmentCost(full, PairScore, gaps1, gaps2)), (digests1, digests2)
+
+
+def test_anchored_alignment_does_not_pin_a_moved_block():
+    # The permit block moved to the front, aligning it would leave the deny blocks around it unaligned.
+    digests1 = ["D", "D", "D", "P", "D"]
+    digests2 = ["P", "D", "D", "D", "D"]
+    scores = {("D", "D"): 0, ("P", "P"): 0, ("D", "P"): 10000, ("P", "D"): 10000}
+    PairScore, gaps1, gaps2 = Scoring(digests1, digests2, scores, {"D": 40, "P": 40})
+    anchored = MetaTemplater.AnchoredAlignmentPath(digests1, digests2, PairScore, PairScore, gaps1, gaps2)
+    assert AlignmentCost(anchored, PairScore, gaps1, gaps2) == 80
@@ -0,0 +1,28 @@
+import random
+
+import Assignment
+from Benchmark import RandomCostMatrix
+
+
+def Cost(matrix, pairs):
+    return sum(matrix[i][j] for i, j in pairs)
+
+
+def test_solvers_find_the_same_optimal_cost():
+    rng = random.Random(0)
+    corpus = [RandomCostMatrix(rng, rng.randint(1, 12), rng.randint(1, 12)) for _ in range(200)]
+    corpus += [RandomCostMatrix(rng, size, size) for size in (3, 10, 30) for _ in range(10)]
+    corpus += [RandomCostMatrix(rng, size, size//2 + 1) for size in (3, 10, 30) for _ in range(10)]
+    for matrix in corpus:
+        costs = {name: Cost(matrix, Assignment.Assign(matrix, name)) for name in Assignment.SOLVERS}
+        assert len(set(costs.values())) == 1, costs
+
+
+def test_solvers_assign_every_row_or_column():
+    rng = random.Random(1)
+    for _ in range(50):
+        matrix = RandomCostMatrix(rng, rng.randint(1, 12), rng.randint(1, 12))
+        for name in Assignment.SOLVERS:
+            pairs = Assignment.Assign(matrix, name)
+            assert len(pairs) == min(len(matrix), len(matrix[0]))
+            assert len({i for i, _ in pairs}) == len({j for _, j in pairs}) == len(pairs)
@@ -0,0 +1,103 @@
+import collections
+import os
+import random
+import re
+
+import ACL
+import MetaTemplater
+import NativeParser
+import commonFunctions
+import main
+
+SAMPLE_CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sampleDataSet", "configs",
+                             "router1.dept1")
+
+
+def SampleAclLines(name):
+    """Returns the lines of the extended ACL of the sample configuration."""
+    lines = list()
+    with open(SAMPLE_CONFIG) as f:
+        stanza = False
+        for line in f:
+            if not line.startswith(" "):
+                stanza = line.split() == ["ip", "access-list", "extended", name]
+            elif stanza and line.split()[0] in ("permit", "deny"):
+                lines.append(line.rstrip())
+    return lines
+
+
+def EditedNodes(name, count, seed):
+    """Returns the natively parsed nodes of count devices defining the sample ACL with a few local edits each."""
+    rng = random.Random(seed)
+    base = SampleAclLines(name)
+    nodes = {}
+    for d in range(count):
+        lines = list(base)
+        edit = rng.randrange(4)
+        k = rng.randrange(len(lines) - 1)
+        if edit == 1:
+            del lines[k]
+        elif edit == 2:
+            lines[k], lines[k+1] = lines[k+1], lines[k]
+        elif edit == 3:
+            lines.insert(k, " permit ip host 10.0.{}.1 any".format(rng.randrange(4)))
+        text = "hostname dev{}\nip access-list extended {}\n{}\n".format(d, name, "\n".join(lines))
+        node, nodeModel = NativeParser.ParseConfig(text, "dev{}".format(d))
+        nodes[node] = nodeModel
+    return nodes
+
+
+def Segments(nodes, name):
+    """Returns the (segment, lineCount) pairs of the ACL in the order they are templated."""
+    lineCountMap = {}
+    for device in sorted(nodes):
+        segments, lineCounts = ACL.GetBlockSequence(device, nodes[device], re.compile(re.escape(name) + "$"), set(),
+                                                    set(), commonFunctions.ExactMatchMap())
+        for segment, lineCount in zip(segments, lineCounts):
+            lineCountMap.setdefault(lineCount, list()).append(segment)
+    return MetaTemplater.OrderedSegments(lineCountMap)
+
+
+def Lines(segment):
+    return collections.Counter((block.action["type"], tuple(sorted((key, value) for key, value in line.items()
+                                                                   if key != ACL.LINENUM)))
+                               for block in segment.blocks for line in block.lines)
+
+
+def DeviceLines(metaTemplate, parametersLines, device):
+    """Returns the lines of the device rebuilt from the metaTemplate with the parameter values of the device."""
+    templateLines = {line[ACL.LINENUM]: (block.action["type"], line) for block in metaTemplate.blocks
+                     for line in block.lines}
+    values = parametersLines.parameters[device]
+    lines = collections.Counter()
+    for lineNum in parametersLines.lineMapping[device]:
+        action, line = templateLines[lineNum]
+        lines[(action, tuple(sorted((key, values.get(value, value)) for key, value in line.items()
+                                    if key != ACL.LINENUM)))] += 1
+    return lines
+
+
+def Groups(metaTemplate, parametersLines):
+    main.aclFunctions["MinimizeParameters"](metaTemplate, parametersLines, ACL.ATTRIBUTES)
+    return sorted(sorted(devices) for _, devices in parametersLines.groupsList)
+
+
+def CheckEngine(Template):
+    """Checks that the Template engine keeps the lines of every device and finds the groups of the sequential engine."""
+    name = "voip_dept1_in"
+    nodes = EditedNodes(name, 3*MetaTemplater.MIN_CHUNK_SEGMENTS, 0)
+    segments = Segments(nodes, name)
+    metaTemplate, parametersLines, _ = Template(segments, **main.aclFunctions)
+    MetaTemplater.ShutdownWorkerPools()
+    for segment, _ in segments:
+        assert DeviceLines(metaTemplate, parametersLines, segment.deviceName) == Lines(segment)
+    sequential = MetaTemplater.TemplateSegments(Segments(nodes, name), **main.aclFunctions)
+    assert Groups(metaTemplate, parametersLines) == Groups(*sequential[:2])
+
+
+def test_mapreduce_matches_sequential():
+    CheckEngine(lambda segments, **functions: MetaTemplater.MapReduceTemplates(segments, 2, **functions))
+
+
+def test_centerstar_matches_sequential():
+    CheckEngine(lambda segments, **functions: MetaTemplater.CenterStarTemplates(segments, 2, **functions))
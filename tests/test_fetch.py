@@ -0,0 +1,75 @@
+import http.client
+import re
+
+import pytest
+
+import NodeFetcher
+import StandInServer
+
+
+def RecordedNodes(count):
+    """Returns count viModel nodes with an ACL each and a field that is not a segment."""
+    return {"router{:02d}".format(k): {"configurationFormat": "CISCO_IOS",
+                                       "ipAccessLists": {"acl": {"name": "acl", "lines": [{"name": "permit ip any any"}]}},
+                                       "interfaces": {"Ethernet{}".format(k): {}}}
+            for k in range(count)}
+
+
+class FlakySource(NodeFetcher.HttpAnswerSource):
+    """An HttpAnswerSource sending the first failures requests of every batch to a path the server does not know."""
+
+    def __init__(self, url, failures):
+        super().__init__(url)
+        self.failures = failures
+        self.attempts = {}
+
+    def FetchBatch(self, nodes, nodeRegexPattern):
+        attempt = self.attempts[nodes[0]] = self.attempts.get(nodes[0], 0) + 1
+        if attempt <= self.failures:
+            self.request("POST", "/missing", b"{}")
+        return super().FetchBatch(nodes, nodeRegexPattern)
+
+
+@pytest.fixture
+def server():
+    server = StandInServer.StartServer(RecordedNodes(23), latency=0.001)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def Url(server):
+    return "http://127.0.0.1:{}".format(server.server_port)
+
+
+def test_batched_fetch_matches_sequential_fetch(server):
+    nodeRegex = re.compile(".*")
+    sequential = list(NodeFetcher.FetchNodes(NodeFetcher.HttpAnswerSource(Url(server)), nodeRegex, 0, 1))
+    batched = list(NodeFetcher.FetchNodes(NodeFetcher.HttpAnswerSource(Url(server)), nodeRegex, 4, 4))
+    assert [name for name, _ in sequential] == sorted(server.nodes)
+    assert batched == sequential
+    assert all("interfaces" not in model for _, model in batched)
+
+
+def test_batched_fetch_keeps_only_matching_nodes(server):
+    nodeRegex = re.compile("router1.*")
+    nodes = list(NodeFetcher.FetchNodes(NodeFetcher.HttpAnswerSource(Url(server)), nodeRegex, 3, 4))
+    assert [name for name, _ in nodes] == [name for name in sorted(server.nodes) if nodeRegex.match(name)]
+
+
+def test_failed_batches_are_retried(server, monkeypatch):
+    monkeypatch.setattr(NodeFetcher, "RETRY_DELAY", 0)
+    nodeRegex = re.compile(".*")
+    source = FlakySource(Url(server), 2)
+    nodes = list(NodeFetcher.FetchNodes(source, nodeRegex, 5, 3, retries=2))
+    assert nodes == list(NodeFetcher.FetchNodes(NodeFetcher.HttpAnswerSource(Url(server)), nodeRegex, 0, 1))
+    assert sorted(source.attempts.values()) == [3]*5
+
+
+def test_batch_failing_every_retry_raises(server, monkeypatch):
+    monkeypatch.setattr(NodeFetcher, "RETRY_DELAY", 0)
+    source = FlakySource(Url(server), 3)
+    with pytest.raises(http.client.HTTPException):
+        list(NodeFetcher.FetchNodes(source, re.compile(".*"), 5, 3, retries=2))
+    # The connections dropped after the errors are opened again for the next requests.
+    assert len(list(NodeFetcher.FetchNodes(source, re.compile(".*"), 5, 3, retries=2))) == len(server.nodes)
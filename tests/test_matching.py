@@ -0,0 +1,16 @@
+import PrefixList
+
+
+def PrefixLine(lineNum, third, length="24"):
+    """Returns a prefix list line of 10.0.third.0/length le 32."""
+    return {PrefixList.LINENUM: lineNum, -2: 0, 0: length, 1: length, 2: "32", 3: "10", 4: "0", 5: str(third), 6: "0"}
+
+
+def test_window_matches_lines_moved_past_the_window():
+    template = [PrefixLine(k, k) for k in range(30)]
+    # The first line is edited and moved to the end of the block, far past the window.
+    device = [PrefixLine(k - 1, k) for k in range(1, 30)] + [PrefixLine(29, 0, "25")]
+    exact = PrefixList.BipartiteMatching(template, device, {}, PrefixList.ATTRIBUTES)
+    windowed = PrefixList.BipartiteMatching(template, device, {}, PrefixList.ATTRIBUTES, window=2)
+    assert (0, 29) in windowed[1]
+    assert windowed[0] == exact[0]
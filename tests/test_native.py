@@ -0,0 +1,58 @@
+import json
+import os
+import re
+
+import pytest
+
+import NativeParser
+import commonFunctions
+import main
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "native")
+# The viModel answer of the fixture snapshot recorded from Batfish with NativeParser.py record.
+BATFISH_ANSWER = os.path.join(FIXTURE, "batfish.json")
+
+
+def test_fixture_covers_every_segment_kind():
+    nodes = NativeParser.ParseDirectory(FIXTURE, re.compile(".*"))
+    model = nodes["edge1"]
+    for kind, (_, segmentTypes, functions) in main.SEGMENT_KINDS.items():
+        found = 0
+        for segmentType in segmentTypes:
+            for name, definition in model[segmentType].items():
+                assert "unsupportedLines" not in definition, (segmentType, name)
+                segments, _ = functions["GetBlockSequence"]("edge1", model, re.compile(re.escape(name) + "$"), set(),
+                                                            set(), commonFunctions.ExactMatchMap())
+                found += len(segments)
+        assert found > 0, kind
+
+
+def test_fixture_matches_batfish():
+    if not os.path.exists(BATFISH_ANSWER):
+        pytest.skip("Record the Batfish answer with: python3 NativeParser.py record {} {}".format(FIXTURE,
+                                                                                                  BATFISH_ANSWER))
+    with open(BATFISH_ANSWER) as f:
+        batfishNodes = json.load(f)["answerElements"][0]["nodes"]
+    assert NativeParser.CompareSegments(NativeParser.ParseDirectory(FIXTURE, re.compile(".*")), batfishNodes) == []
+
+
+def test_unsupported_lines_are_flagged():
+    text = """hostname edge2
+ip access-list extended EDGE_IN
+ permit tcp any any established
+ permit icmp any any echo
+ permit foo any any
+ permit ip object-group INSIDE any
+ permit ip any any log
+ip prefix-list PL_BAD seq 5 permit 10.0.0.300/24
+route-map RM_IN permit 10
+ set dampening 15 750 2000 60
+"""
+    node, model = NativeParser.ParseConfig(text, "edge2.cfg")
+    acl = model["ipAccessLists"]["EDGE_IN"]
+    assert [line["name"] for line in acl["lines"]] == ["permit ip any any log"]
+    assert len(acl["unsupportedLines"]) == 4
+    assert model["routeFilterLists"]["PL_BAD"]["unsupportedLines"]
+    assert model["routingPolicies"]["RM_IN"]["unsupportedLines"] == ["set dampening 15 750 2000 60"]
+    for segmentType, name in (("ipAccessLists", "EDGE_IN"), ("routeFilterLists", "PL_BAD"), ("routingPolicies", "RM_IN")):
+        assert main.DevicesWithUnsupportedLines([(node, {segmentType: model[segmentType]})], name) == [node]